@@ -0,0 +1,280 @@
+"""
+Serial actuator service for the spray controller
+
+A dedicated I/O thread owns the serial port; the event loop never touches
+it. Callers enqueue a command and await a future that resolves once the
+ESP32 acknowledges it.
+
+Line protocol (see esp32_spray_control.ino):
+- host -> device: "<COMMAND>#<seq>", e.g. "RUN:30#1712345"
+- device -> host: "ACK:<seq>" or "NAK:<seq>:<reason>"; any other line is
+  device logging and is ignored
+
+Commands are sent one at a time. An attempt that gets no ACK within
+ack_timeout is retried with the same sequence number, up to `retries`
+times; the device re-acknowledges a sequence number it has already run
+instead of running it twice. A port that fails or disappears is closed and
+reopened every reconnect_interval seconds. The command queue is bounded;
+when it is full send() raises ActuatorQueueFull.
+"""
+
+import asyncio
+import itertools
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import serial
+
+
+class ActuatorError(Exception):
+    """A command was rejected by the device or never acknowledged"""
+
+
+class ActuatorQueueFull(ActuatorError):
+    """Raised when queue_size commands are already waiting"""
+
+
+class ActuatorCommand:
+    """
+    One queued command and the future its caller awaits
+    """
+
+    __slots__ = ("seq", "command", "future", "loop", "enqueued_at", "attempts")
+
+    def __init__(self, seq: int, command: str, future: asyncio.Future, loop: asyncio.AbstractEventLoop):
+        self.seq = seq
+        self.command = command
+        self.future = future
+        self.loop = loop
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+    def resolve(self, result: Any = None, error: Optional[Exception] = None):
+        """Complete the caller's future from the I/O thread"""
+        def complete():
+            if self.future.done():
+                return
+            if error is not None:
+                self.future.set_exception(error)
+            else:
+                self.future.set_result(result)
+        self.loop.call_soon_threadsafe(complete)
+
+
+class SerialActuator:
+    """
+    Serial port owner with a bounded command queue and ACK correlation
+    """
+
+    def __init__(self, port: str, baud: int = 115200, queue_size: int = 32, ack_timeout: float = 2.0,
+                 retries: int = 2, reconnect_interval: float = 5.0,
+                 serial_factory: Callable[..., Any] = serial.Serial):
+        self.port = port
+        self.baud = baud
+        self.queue_size = queue_size
+        self.ack_timeout = ack_timeout
+        self.retries = retries
+        self.reconnect_interval = reconnect_interval
+        self.serial_factory = serial_factory
+
+        self._queue: "queue.Queue[Optional[ActuatorCommand]]" = queue.Queue(maxsize=queue_size)
+        # Seeded from the clock so a restarted API does not reuse the device's last sequence number
+        self._seq = itertools.count(int(time.time() * 1000) % 1_000_000_000)
+        self._serial = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._last_connect_attempt = 0.0
+
+        self.sent = 0
+        self.acked = 0
+        self.nacked = 0
+        self.failed = 0
+        self.retried = 0
+        self.connects = 0
+        self.ack_ms_total = 0.0
+        self.last_error: Optional[str] = None
+
+    @property
+    def connected(self) -> bool:
+        """Whether the serial port is currently open"""
+        return self._serial is not None
+
+    def start(self):
+        """Start the I/O thread; the port is opened (and reopened) from there"""
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="serial-actuator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Fail queued commands, stop the I/O thread and close the port"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self._thread.join()
+        self._thread = None
+
+        while True:
+            try:
+                command = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if command is not None:
+                command.resolve(error=ActuatorError("Actuator service stopped"))
+
+    async def send(self, command: str, seq: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Queue a command and wait for the device to acknowledge it
+        Returns the sequence number, attempts and round-trip time; raises
+        ActuatorError on NAK or when every attempt timed out. Pass a stable
+        seq to make a resend after a restart idempotent on the device.
+        """
+        if self._thread is None:
+            raise RuntimeError("Serial actuator is not started")
+        loop = asyncio.get_running_loop()
+        queued = ActuatorCommand(next(self._seq) if seq is None else seq, command, loop.create_future(), loop)
+        try:
+            self._queue.put_nowait(queued)
+        except queue.Full:
+            raise ActuatorQueueFull(f"Actuator queue full ({self.queue_size} commands waiting)")
+        return await queued.future
+
+    def stats(self) -> Dict[str, Any]:
+        """Connection state and command counters"""
+        return {
+            "port": self.port,
+            "connected": self.connected,
+            "queued": self._queue.qsize(),
+            "queue_size": self.queue_size,
+            "sent": self.sent,
+            "acked": self.acked,
+            "nacked": self.nacked,
+            "failed": self.failed,
+            "retried": self.retried,
+            "connects": self.connects,
+            "avg_ack_ms": round(self.ack_ms_total / self.acked, 1) if self.acked else 0.0,
+            "last_error": self.last_error
+        }
+
+    # I/O thread
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._ensure_connected()
+            try:
+                command = self._queue.get(timeout=0.2)
+            except queue.Empty:
+                self._drain_input()
+                continue
+            if command is None:
+                break
+            if command.future.cancelled():
+                continue
+            self._execute(command)
+        self._close()
+
+    def _execute(self, command: ActuatorCommand):
+        """Send one command, retrying until it is acknowledged or attempts run out"""
+        line = f"{command.command}#{command.seq}\n".encode()
+        while command.attempts <= self.retries and not self._stopping.is_set():
+            if command.attempts:
+                self.retried += 1
+            command.attempts += 1
+
+            if not self._ensure_connected(force=True):
+                self._stopping.wait(self.ack_timeout)  # Give the device time to come back
+                continue
+            try:
+                self._serial.write(line)
+                self._serial.flush()
+                self.sent += 1
+                reply = self._await_reply(command.seq)
+            except (serial.SerialException, OSError) as e:
+                self._connection_lost(e)
+                continue
+            if reply is None:
+                self.last_error = f"No ACK for {command.command} (seq {command.seq}) within {self.ack_timeout}s"
+                logging.error(self.last_error)
+                continue
+
+            status, detail = reply
+            if status == "ACK":
+                ack_ms = (time.monotonic() - command.enqueued_at) * 1000
+                self.acked += 1
+                self.ack_ms_total += ack_ms
+                command.resolve({"seq": command.seq, "attempts": command.attempts, "ack_ms": round(ack_ms, 1)})
+            else:
+                self.nacked += 1
+                self.last_error = f"{command.command} rejected by device: {detail}"
+                command.resolve(error=ActuatorError(self.last_error))
+            return
+
+        self.failed += 1
+        command.resolve(error=ActuatorError(
+            f"{command.command} not acknowledged after {command.attempts} attempts: {self.last_error}"
+        ))
+
+    def _await_reply(self, seq: int) -> Optional[tuple]:
+        """("ACK"|"NAK", detail) for seq, or None on timeout; other lines are ignored"""
+        deadline = time.monotonic() + self.ack_timeout
+        while time.monotonic() < deadline:
+            raw = self._serial.readline()
+            if not raw:
+                continue
+            text = raw.decode(errors="replace").strip()
+            status, _, rest = text.partition(":")
+            if status not in ("ACK", "NAK"):
+                continue
+            reply_seq, _, detail = rest.partition(":")
+            if reply_seq == str(seq):
+                return status, detail
+        return None
+
+    def _drain_input(self):
+        """Consume device logging between commands so stale lines never pile up"""
+        if self._serial is None:
+            return
+        try:
+            while self._serial.in_waiting:
+                self._serial.readline()
+        except (serial.SerialException, OSError) as e:
+            self._connection_lost(e)
+
+    def _ensure_connected(self, force: bool = False) -> bool:
+        """Open the port if it is closed, at most once per reconnect_interval unless forced"""
+        if self._serial is not None:
+            return True
+        now = time.monotonic()
+        if not force and now - self._last_connect_attempt < self.reconnect_interval:
+            return False
+        self._last_connect_attempt = now
+        try:
+            # Short read timeout keeps ACK waits responsive to the deadline
+            self._serial = self.serial_factory(self.port, self.baud, timeout=0.1, write_timeout=1)
+        except (serial.SerialException, OSError, ValueError) as e:
+            self.last_error = f"Cannot open {self.port}: {e}"
+            return False
+        self.connects += 1
+        print(f"✅ Serial connection established on {self.port}")
+        return True
+
+    def _connection_lost(self, error: Exception):
+        self.last_error = f"Serial connection lost: {error}"
+        logging.error(self.last_error)
+        self._close()
+
+    def _close(self):
+        if self._serial is not None:
+            try:
+                self._serial.close()
+            except Exception:
+                pass
+            self._serial = None
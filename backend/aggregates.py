@@ -0,0 +1,103 @@
+"""
+Incrementally maintained aggregate counters
+
+The dashboard endpoints need all-time totals, per-disease / per-plant counts
+and per-day dosage. Instead of COUNT/SUM/GROUP BY over the full tables on
+every refresh, those numbers live in the `aggregates` table and are bumped by
+AFTER INSERT triggers (migration 6), i.e. in the same transaction as the row
+that changes them, whichever code path inserted it.
+
+Rows are (metric, key, value):
+- ("detections", "", n)             all detections
+- ("disease", <disease_type>, n)    detections per disease (incl. healthy)
+- ("plant", <plant_type>, n)        detections per plant
+- ("sprays", "", n)                 all spray events
+- ("dosage_day", "YYYY-MM-DD", sum) spray dosage per local calendar day
+
+If the counters ever drift (manual edits, restored backups), rebuild them
+(this also rebuilds the time-series rollups in rollups.py, and includes rows
+already moved to the Parquet archive), from backend/:
+python -m aggregates --rebuild [--db pesticide_control.db]
+"""
+
+import argparse
+import os
+import sqlite3
+from typing import Optional
+
+# Local calendar day of an epoch-millisecond timestamp, as used for dosage_day keys
+DAY_SQL = "date({ms} / 1000, 'unixepoch', 'localtime')"
+
+REBUILD_STATEMENTS = [
+    "DELETE FROM aggregates",
+    "INSERT INTO aggregates (metric, key, value) SELECT 'detections', '', COUNT(*) FROM {detections}",
+    "INSERT INTO aggregates (metric, key, value) SELECT 'disease', disease_type, COUNT(*) FROM {detections} GROUP BY disease_type",
+    "INSERT INTO aggregates (metric, key, value) SELECT 'plant', plant_type, COUNT(*) FROM {detections} GROUP BY plant_type",
+    "INSERT INTO aggregates (metric, key, value) SELECT 'sprays', '', COUNT(*) FROM {spray_events}",
+    f'''INSERT INTO aggregates (metric, key, value)
+        SELECT 'dosage_day', {DAY_SQL.format(ms="timestamp_ms")}, SUM(dosage)
+        FROM {{spray_events}} WHERE timestamp_ms IS NOT NULL GROUP BY 1''',
+]
+
+
+def rebuild_aggregates(conn: sqlite3.Connection, detections: str = "detections", spray_events: str = "spray_events"):
+    """Recompute every counter from the raw tables (run inside a transaction)"""
+    for statement in REBUILD_STATEMENTS:
+        conn.execute(statement.format(detections=detections, spray_events=spray_events))
+
+
+def read_counter(conn: sqlite3.Connection, metric: str, key: str = "") -> float:
+    """One counter value (0 when it has never been incremented)"""
+    row = conn.execute("SELECT value FROM aggregates WHERE metric = ? AND key = ?", (metric, key)).fetchone()
+    return row[0] if row else 0
+
+
+def most_common(conn: sqlite3.Connection, metric: str, exclude: Optional[str] = None) -> Optional[str]:
+    """Key with the largest non-zero value, optionally ignoring one key"""
+    row = conn.execute(
+        "SELECT key FROM aggregates WHERE metric = ? AND key != ? AND value > 0 ORDER BY value DESC LIMIT 1",
+        (metric, exclude if exclude is not None else "")
+    ).fetchone()
+    return row[0] if row else None
+
+
+def main():
+    from archive import ARCHIVED_TABLES, ParquetArchive
+    from database import Database
+    from rollups import rebuild_rollups
+
+    parser = argparse.ArgumentParser(description="Maintain the aggregate counters table")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute all counters from raw rows")
+    parser.add_argument("--db", default=os.getenv("DATABASE_PATH", "pesticide_control.db"), help="Database path")
+    parser.add_argument("--archive", default=os.getenv("ARCHIVE_DIR", "archive"), help="Parquet archive directory")
+    args = parser.parse_args()
+
+    conn = Database(args.db).connect()
+    if args.rebuild:
+        # Archived rows are staged in temp tables on disk and unioned with the hot tables
+        conn.execute("PRAGMA temp_store=FILE")
+        archive = ParquetArchive(args.archive)
+        sources = {}
+        for table in ARCHIVED_TABLES:
+            conn.execute(f"CREATE TEMP TABLE cold_{table} AS SELECT * FROM main.{table} WHERE 0")
+            archive.load_into(conn, table, f"cold_{table}")
+            conn.execute(f"CREATE TEMP VIEW all_{table} AS SELECT * FROM main.{table} UNION ALL SELECT * FROM cold_{table}")
+            sources[table] = f"all_{table}"
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rebuild_aggregates(conn, **sources)
+            rebuild_rollups(conn, **sources)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        print(f"✅ Rebuilt aggregates and rollups in {args.db}")
+
+    for metric, key, value in conn.execute("SELECT metric, key, value FROM aggregates ORDER BY metric, key"):
+        print(f"{metric:<12}{key:<24}{value:>14g}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+"""
+Columnar Parquet archive tier for cold detections and spray events
+
+Compaction moves rows older than N days out of SQLite into month-partitioned
+Parquet files:
+
+    <root>/<table>/month=YYYY-MM/part-<epoch_ms>.parquet
+
+Every file is registered in the archive_partitions manifest (migration 8)
+in the same transaction that deletes its rows from the hot table. A file
+only becomes visible once that transaction commits, and files left behind
+by a crash before commit are never read and are removed on the next run.
+
+Reads go through the manifest, so partitions outside the requested time
+range are pruned without opening them. Files are written in small row
+groups sorted on (timestamp_ms, rowid); inside an opened file, row groups
+whose min/max statistics rule out the filters are skipped, and the rest are
+streamed in batches only until the page is full. Memory per read is bounded
+by the page size and one row group, not the partition. HistoryQuery merges
+these cold rows with the hot ones, so history and export endpoints span both
+tiers transparently. The aggregate counters and rollups are only ever incremented
+on insert, so they keep covering archived rows after compaction.
+
+Usage (from backend/):
+python -m archive --compact --older-than-days 365
+python -m archive --list
+"""
+
+import argparse
+import heapq
+import logging
+import operator
+import os
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterator, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+ARCHIVED_TABLES = ("detections", "spray_events")
+
+# HistoryQuery filter operators as Arrow expressions
+FILTER_EXPRESSIONS = {
+    "=": operator.eq,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+# SQLite declared type -> Arrow type; anything else is archived as text
+ARROW_TYPES = {
+    "INTEGER": pa.int64(),
+    "BOOLEAN": pa.int64(),
+    "REAL": pa.float64(),
+}
+
+
+def month_bounds_ms(year: int, month: int) -> Tuple[int, int]:
+    """[start, end) epoch milliseconds of a local calendar month"""
+    start = datetime(year, month, 1)
+    end = datetime(year + month // 12, month % 12 + 1, 1)
+    return int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+
+
+class ParquetArchive:
+    """
+    Month-partitioned Parquet files plus their SQLite manifest
+    """
+
+    def __init__(self, root: str, chunk_size: int = 50000, compression: str = "zstd",
+                 row_group_size: int = 8192, scan_batch_size: int = 1024):
+        self.root = Path(root)
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.scan_batch_size = scan_batch_size
+
+    # ---- compaction -------------------------------------------------------
+
+    def compact(self, conn: sqlite3.Connection, older_than_days: float) -> int:
+        """Archive every row older than the cutoff from all archived tables; returns rows moved"""
+        cutoff_ms = int((time.time() - older_than_days * 86400) * 1000)
+        return sum(self.compact_table(conn, table, cutoff_ms) for table in ARCHIVED_TABLES)
+
+    def compact_table(self, conn: sqlite3.Connection, table: str, cutoff_ms: int) -> int:
+        """Move rows with timestamp_ms < cutoff_ms into monthly Parquet partitions"""
+        self.remove_orphans(conn, table)
+
+        # Rows inserted after this point (higher rowids) are left for the next run
+        snapshot_rowid, oldest_ms = conn.execute(
+            f"SELECT MAX(rowid), MIN(timestamp_ms) FROM {table}"
+        ).fetchone()
+        if snapshot_rowid is None or oldest_ms is None or oldest_ms >= cutoff_ms:
+            return 0
+
+        schema = self._schema(conn, table)
+        moved = 0
+        month = datetime.fromtimestamp(oldest_ms / 1000).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        while True:
+            start_ms, end_ms = month_bounds_ms(month.year, month.month)
+            if start_ms >= cutoff_ms:
+                break
+            moved += self._compact_month(conn, table, schema, month.strftime("%Y-%m"),
+                                         start_ms, min(end_ms, cutoff_ms), snapshot_rowid)
+            month = datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+        return moved
+
+    def _compact_month(self, conn: sqlite3.Connection, table: str, schema: pa.Schema, month: str,
+                       start_ms: int, end_ms: int, snapshot_rowid: int) -> int:
+        predicate = "timestamp_ms >= ? AND timestamp_ms < ? AND rowid <= ?"
+        params = (start_ms, end_ms, snapshot_rowid)
+        columns = [name for name in schema.names if name != "rowid"]
+
+        directory = self.root / table / f"month={month}"
+        final_path = directory / f"part-{int(time.time() * 1000)}.parquet"
+        tmp_path = final_path.with_suffix(".parquet.tmp")
+
+        written, min_ms, max_ms = 0, None, None
+        writer = None
+        try:
+            rows = conn.execute(f'''
+                SELECT {", ".join(columns)}, rowid FROM {table}
+                WHERE {predicate}
+                ORDER BY timestamp_ms, rowid
+            ''', params)
+            while True:
+                chunk = rows.fetchmany(self.chunk_size)
+                if not chunk:
+                    break
+                batch = pa.RecordBatch.from_arrays(
+                    [pa.array(values, type=field.type) for values, field in zip(zip(*chunk), schema)],
+                    schema=schema
+                )
+                if writer is None:
+                    directory.mkdir(parents=True, exist_ok=True)
+                    writer = pq.ParquetWriter(tmp_path, schema, compression=self.compression)
+                writer.write_batch(batch, row_group_size=self.row_group_size)
+                timestamps = batch.column(schema.get_field_index("timestamp_ms"))
+                min_ms = timestamps[0].as_py() if min_ms is None else min_ms
+                max_ms = timestamps[-1].as_py()
+                written += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+
+        if not written:
+            return 0
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            deleted = conn.execute(f"DELETE FROM {table} WHERE {predicate}", params).rowcount
+            if deleted != written:
+                raise RuntimeError(f"{table} {month}: archived {written} rows but {deleted} matched for deletion")
+            conn.execute('''
+                INSERT INTO archive_partitions (path, table_name, month, min_timestamp_ms,
+                                                max_timestamp_ms, row_count, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (final_path.relative_to(self.root).as_posix(), table, month, min_ms, max_ms,
+                  written, datetime.now()))
+            os.replace(tmp_path, final_path)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            tmp_path.unlink(missing_ok=True)
+            raise
+        conn.execute("COMMIT")
+
+        print(f"🗄️ Archived {written} {table} rows for {month} to {final_path}")
+        return written
+
+    def remove_orphans(self, conn: sqlite3.Connection, table: str):
+        """Delete files left by interrupted compactions (not in the manifest)"""
+        directory = self.root / table
+        if not directory.exists():
+            return
+        registered = {path for (path,) in conn.execute(
+            "SELECT path FROM archive_partitions WHERE table_name = ?", (table,)
+        )}
+        for path in directory.glob("month=*/part-*"):
+            if path.relative_to(self.root).as_posix() not in registered:
+                logging.error(f"Removing orphaned archive file {path}")
+                path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _schema(conn: sqlite3.Connection, table: str) -> pa.Schema:
+        fields = [pa.field(name, ARROW_TYPES.get(declared.upper(), pa.string()))
+                  for _, name, declared, *_ in conn.execute(f"PRAGMA table_info({table})")]
+        return pa.schema(fields + [pa.field("rowid", pa.int64())])
+
+    # ---- reads ------------------------------------------------------------
+
+    def partitions(self, conn: sqlite3.Connection, table: str, filters: List[Tuple[str, str, Any]],
+                   position: Optional[Tuple[int, int]] = None, descending: bool = True,
+                   bound_ms: Optional[int] = None) -> List[tuple]:
+        """(path, min_ms, max_ms, row_count) of partitions that can hold matching rows, in scan order"""
+        low, high = self._window(filters, position, descending, bound_ms)
+        conditions, params = ["table_name = ?"], [table]
+        if low is not None:
+            conditions.append("max_timestamp_ms >= ?")
+            params.append(low)
+        if high is not None:
+            conditions.append("min_timestamp_ms <= ?")
+            params.append(high)
+        order = "max_timestamp_ms DESC" if descending else "min_timestamp_ms ASC"
+        return conn.execute(f'''
+            SELECT path, min_timestamp_ms, max_timestamp_ms, row_count FROM archive_partitions
+            WHERE {" AND ".join(conditions)} ORDER BY {order}
+        ''', params).fetchall()
+
+    def page(self, conn: sqlite3.Connection, table: str, columns: List[str], filters: List[Tuple[str, str, Any]],
+             position: Optional[Tuple[int, int]], limit: int, descending: bool = True,
+             bound_ms: Optional[int] = None) -> List[tuple]:
+        """
+        Up to `limit` archived rows after the keyset position, as (*columns, timestamp_ms, rowid) tuples
+        bound_ms is the timestamp of the last row of an already full hot page;
+        archived rows past it cannot make the merged page, so partitions and
+        row groups beyond it are never opened.
+        """
+        wanted = list(columns) + ["timestamp_ms", "rowid"]
+        key = lambda row: (row[-2], row[-1])
+        scan_filters = list(filters)
+        keyset = None
+        if position is not None:
+            timestamp_ms, rowid = position
+            ts, rid = pc.field("timestamp_ms"), pc.field("rowid")
+            if descending:
+                scan_filters.append(("timestamp_ms", "<=", timestamp_ms))
+                keyset = (ts < timestamp_ms) | ((ts == timestamp_ms) & (rid < rowid))
+            else:
+                scan_filters.append(("timestamp_ms", ">=", timestamp_ms))
+                keyset = (ts > timestamp_ms) | ((ts == timestamp_ms) & (rid > rowid))
+        if bound_ms is not None:
+            scan_filters.append(("timestamp_ms", ">=" if descending else "<=", bound_ms))
+
+        collected: List[tuple] = []
+        for path, min_ms, max_ms, _ in self.partitions(conn, table, filters, position, descending, bound_ms):
+            if len(collected) >= limit:
+                # Partitions arrive in scan order; stop once none can beat the current page
+                boundary = collected[limit - 1][-2]
+                if (descending and max_ms < boundary) or (not descending and min_ms > boundary):
+                    break
+
+            # Files are written sorted on (timestamp_ms, rowid), so the first `limit` rows scanned are the page
+            rows: List[tuple] = []
+            for chunk in self._scan(path, wanted, scan_filters, keyset, descending):
+                rows.extend(zip(*(chunk.column(name).to_pylist() for name in wanted)))
+                if len(rows) >= limit:
+                    break
+            collected = list(heapq.merge(collected, rows[:limit], key=key, reverse=descending))[:limit]
+
+        return collected
+
+    def count(self, conn: sqlite3.Connection, table: str, filters: List[Tuple[str, str, Any]]) -> int:
+        """Archived rows matching the filters"""
+        total = 0
+        only_time = all(column == "timestamp_ms" for column, _, _ in filters)
+        low, high = self._window(filters)
+        for path, min_ms, max_ms, row_count in self.partitions(conn, table, filters):
+            # Partitions entirely inside a pure time-range filter are counted from the manifest
+            if only_time and (low is None or min_ms >= low) and (high is None or max_ms < high):
+                total += row_count
+                continue
+            total += sum(chunk.num_rows for chunk in self._scan(path, ["rowid"], filters))
+        return total
+
+    def load_into(self, conn: sqlite3.Connection, table: str, target: str) -> int:
+        """Append every archived row of `table` into `target` (same column names); returns rows loaded"""
+        loaded = 0
+        target_columns = [row[1] for row in conn.execute(f"PRAGMA table_info({target})")]
+        for path, *_ in self.partitions(conn, table, [], descending=False):
+            parquet = pq.ParquetFile(self.root / path, memory_map=True)
+            columns = [c for c in target_columns if c in parquet.schema_arrow.names]
+            sql = f"INSERT INTO {target} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+            for batch in parquet.iter_batches(batch_size=self.chunk_size, columns=columns):
+                conn.executemany(sql, zip(*(batch.column(name).to_pylist() for name in columns)))
+                loaded += batch.num_rows
+        return loaded
+
+    @staticmethod
+    def _window(filters: List[Tuple[str, str, Any]], position: Optional[Tuple[int, int]] = None,
+                descending: bool = True, bound_ms: Optional[int] = None) -> Tuple[Optional[int], Optional[int]]:
+        """Inclusive [low, high] timestamp_ms range implied by the filters, keyset position and bound"""
+        low, high = None, None
+        for column, op, value in filters:
+            if column != "timestamp_ms":
+                continue
+            if op in (">", ">="):
+                low = value if low is None else max(low, value)
+            elif op in ("<", "<="):
+                high = value if high is None else min(high, value)
+            elif op == "=":
+                low = high = value
+        if position is not None:
+            if descending:
+                high = position[0] if high is None else min(high, position[0])
+            else:
+                low = position[0] if low is None else max(low, position[0])
+        if bound_ms is not None:
+            if descending:
+                low = bound_ms if low is None else max(low, bound_ms)
+            else:
+                high = bound_ms if high is None else min(high, bound_ms)
+        return low, high
+
+    def _scan(self, path: str, columns: List[str], filters: List[Tuple[str, str, Any]],
+              extra: Optional[pc.Expression] = None, descending: bool = False) -> Iterator[pa.Table]:
+        """
+        Filtered chunks of one partition in (timestamp_ms, rowid) scan order
+        Row groups whose min/max statistics rule out the filters are skipped
+        without being read; the rest are streamed with iter_batches. Nothing
+        is yielded if a filtered column predates the file (NULL never
+        satisfies a comparison).
+        """
+        parquet = pq.ParquetFile(self.root / path, memory_map=True)
+        available = parquet.schema_arrow.names
+        if any(column not in available for column, _, _ in filters):
+            return
+        columns = list(dict.fromkeys(columns))
+        read_columns = [c for c in dict.fromkeys(columns + [c for c, _, _ in filters]) if c in available]
+
+        expression = extra
+        for column, op, value in filters:
+            term = FILTER_EXPRESSIONS[op](pc.field(column), value)
+            expression = term if expression is None else expression & term
+
+        metadata = parquet.metadata
+        groups = [i for i in range(metadata.num_row_groups)
+                  if self._may_match(metadata.row_group(i), available, filters)]
+        if descending:
+            groups.reverse()
+
+        for group in groups:
+            batches = parquet.iter_batches(batch_size=self.scan_batch_size, row_groups=[group], columns=read_columns)
+            if descending:
+                # A row group is scanned as a whole so it can be returned newest first
+                chunks = [pa.Table.from_batches(list(batches))]
+            else:
+                chunks = (pa.Table.from_batches([batch]) for batch in batches)
+            for chunk in chunks:
+                if expression is not None:
+                    chunk = chunk.filter(expression)
+                if chunk.num_rows == 0:
+                    continue
+                if descending:
+                    chunk = chunk.sort_by([("timestamp_ms", "descending"), ("rowid", "descending")])
+                for name in columns:
+                    if name not in available:
+                        chunk = chunk.append_column(name, pa.nulls(chunk.num_rows))
+                yield chunk.select(columns)
+
+    @staticmethod
+    def _may_match(row_group: pq.RowGroupMetaData, names: List[str], filters: List[Tuple[str, str, Any]]) -> bool:
+        """False when a row group's column statistics prove no row can satisfy the filters"""
+        for column, op, value in filters:
+            statistics = row_group.column(names.index(column)).statistics
+            if statistics is None or not statistics.has_min_max:
+                continue
+            low, high = statistics.min, statistics.max
+            try:
+                if ((op == "=" and not low <= value <= high) or (op == "<" and low >= value)
+                        or (op == "<=" and low > value) or (op == ">" and high <= value)
+                        or (op == ">=" and high < value)):
+                    return False
+            except TypeError:
+                continue
+        return True
+
+
+def main():
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Compact cold rows into the Parquet archive tier")
+    parser.add_argument("--compact", action="store_true", help="Move old rows into the archive")
+    parser.add_argument("--older-than-days", type=float, default=365, help="Archive rows older than this")
+    parser.add_argument("--list", action="store_true", help="List archived partitions")
+    parser.add_argument("--db", default=os.getenv("DATABASE_PATH", "pesticide_control.db"), help="Database path")
+    parser.add_argument("--root", default=os.getenv("ARCHIVE_DIR", "archive"), help="Archive directory")
+    args = parser.parse_args()
+
+    conn = Database(args.db).connect()
+    archive = ParquetArchive(args.root)
+    if args.compact:
+        moved = archive.compact(conn, args.older_than_days)
+        print(f"✅ Archived {moved} rows older than {args.older_than_days:g} days")
+    if args.list:
+        for path, table, month, rows in conn.execute(
+            "SELECT path, table_name, month, row_count FROM archive_partitions ORDER BY table_name, month"
+        ):
+            print(f"{table:<14}{month:<10}{rows:>12}  {path}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Dynamic micro-batching scheduler for single-image detection requests
+
+Concurrent /api/detect calls are collected for up to max_wait_ms (or until
+max_batch_size images are waiting) and then run as one vectorized job on the
+inference pool. Each caller awaits its own future and receives only its own
+result (or its own error: one undecodable upload does not fail the batch).
+
+Tuning knobs:
+- max_batch_size: upper bound on images per job (throughput)
+- max_wait_ms: how long the first request of a batch may wait (latency)
+- queue_depth: requests allowed to wait before new ones are rejected
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from inference import InferenceExecutor, InferenceQueueFull
+
+
+class MicroBatcher:
+    """
+    Collects concurrent detection requests into batched inference jobs
+    """
+
+    def __init__(self, executor: InferenceExecutor, max_batch_size: int = 16,
+                 max_wait_ms: float = 10.0, queue_depth: int = 256):
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.queue_depth = queue_depth
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._arrived: Optional[asyncio.Event] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._in_flight: Set[asyncio.Task] = set()
+
+        # Tuning statistics
+        self._batches = 0
+        self._images = 0
+        self._largest_batch = 0
+        self._total_wait = 0.0
+        self._rejected = 0
+
+    def start(self):
+        """Start the collector task on the running event loop"""
+        if self._collector is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_depth)
+        self._arrived = asyncio.Event()
+        self._collector = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        """Stop collecting, let dispatched batches finish and fail anything still queued"""
+        if self._collector is None:
+            return
+        self._collector.cancel()
+        try:
+            await self._collector
+        except asyncio.CancelledError:
+            pass
+        self._collector = None
+
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+        while not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Detection scheduler stopped"))
+
+    async def detect(self, image_bytes: bytes) -> Dict[str, Any]:
+        """Queue one image for batched detection and wait for its result"""
+        if self._collector is None:
+            raise RuntimeError("Detection scheduler is not started")
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((image_bytes, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self._rejected += 1
+            raise InferenceQueueFull(f"Detection queue full ({self.queue_depth} requests waiting)")
+        self._arrived.set()
+
+        return await future
+
+    def stats(self) -> Dict[str, Any]:
+        """Current configuration and batching statistics"""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "queue_depth": self.queue_depth,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "batches_in_flight": len(self._in_flight),
+            "batches_run": self._batches,
+            "images_run": self._images,
+            "avg_batch_size": round(self._images / self._batches, 2) if self._batches else 0.0,
+            "largest_batch": self._largest_batch,
+            "avg_wait_ms": round(self._total_wait / self._images * 1000, 2) if self._images else 0.0,
+            "rejected": self._rejected,
+            "executor_pending_jobs": self.executor.pending
+        }
+
+    async def _collect(self):
+        """Form batches: block for the first request, then gather more until full or the window closes"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait_ms / 1000
+
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                self._arrived.clear()
+                try:
+                    await asyncio.wait_for(self._arrived.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+
+            # Dispatch without waiting so the next batch can form while this one runs
+            task = asyncio.create_task(self._run_batch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _run_batch(self, batch: List[Tuple[bytes, asyncio.Future, float]]):
+        """Run one batched job and resolve each waiting request's future"""
+        dispatched_at = time.perf_counter()
+        self._batches += 1
+        self._images += len(batch)
+        self._largest_batch = max(self._largest_batch, len(batch))
+        self._total_wait += sum(dispatched_at - queued_at for _, _, queued_at in batch)
+
+        try:
+            results = await self.executor.run_job([image_bytes for image_bytes, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            # Callers that gave up (e.g. client disconnected) have cancelled futures
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Preprocessing micro-benchmark
+=============================
+
+Compares the original DiseaseDetector.preprocess_image (full-resolution
+resize, float64 normalize) with the current draft-mode, buffer-reusing
+pipeline on synthetic phone-camera JPEGs.
+
+Reports per-image wall time and peak traced memory (numpy + Python
+allocations via tracemalloc) for each variant.
+
+Usage (from backend/):
+python benchmarks/preprocess_benchmark.py --width 4000 --height 3000 --runs 20
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ml_model import DiseaseDetector
+
+
+def legacy_preprocess(image_bytes: bytes) -> np.ndarray:
+    """The pre-optimization pipeline, kept verbatim for comparison"""
+    image = Image.open(io.BytesIO(image_bytes))
+    image = image.resize((224, 224))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    img_array = np.array(image)
+    img_array = img_array / 255.0
+    return img_array
+
+
+def make_sample_jpeg(width: int, height: int, quality: int = 90) -> bytes:
+    """Create a noisy synthetic leaf photo so JPEG decoding does real work"""
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    pixels[:, :, 1] = np.maximum(pixels[:, :, 1], 120)  # Mostly green
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def measure(fn, image_bytes: bytes, runs: int):
+    """Return (mean seconds per image, peak traced bytes)"""
+    fn(image_bytes)  # Warm-up, also allocates any reusable buffers
+    
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn(image_bytes)
+    per_image = (time.perf_counter() - start) / runs
+    
+    tracemalloc.start()
+    fn(image_bytes)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    return per_image, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image preprocessing")
+    parser.add_argument("--width", type=int, default=4000, help="Sample image width")
+    parser.add_argument("--height", type=int, default=3000, help="Sample image height")
+    parser.add_argument("--runs", type=int, default=20, help="Timed runs per variant")
+    args = parser.parse_args()
+    
+    image_bytes = make_sample_jpeg(args.width, args.height)
+    print(f"📸 Sample: {args.width}x{args.height} JPEG, {len(image_bytes) / 1e6:.1f} MB")
+    
+    float_detector = DiseaseDetector(input_dtype=np.float32)
+    uint8_detector = DiseaseDetector(input_dtype=np.uint8)
+    
+    variants = [
+        ("legacy (float64)", legacy_preprocess),
+        ("pipeline (float32)", lambda b: float_detector.preprocess_image(float_detector.load_image(b))),
+        ("pipeline (uint8)", lambda b: uint8_detector.preprocess_image(uint8_detector.load_image(b))),
+    ]
+    
+    baseline = None
+    print(f"{'variant':<22}{'ms/image':>12}{'peak MB':>12}{'speedup':>10}")
+    for name, fn in variants:
+        per_image, peak = measure(fn, image_bytes, args.runs)
+        baseline = baseline or per_image
+        print(f"{name:<22}{per_image * 1000:>12.2f}{peak / 1e6:>12.2f}{baseline / per_image:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Schema/index benchmark
+======================
+
+Builds a synthetic database at schema v2 (the original tables: no indexes,
+text timestamps), times the API's dashboard and history queries, applies the
+remaining migrations (timestamp_ms backfill + indexes), then times the
+index-friendly versions of the same queries.
+
+Usage (from backend/):
+python benchmarks/schema_benchmark.py --rows 5000000 --spray-rows 1000000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import Database
+from migrations import migrate
+
+DISEASES = ["powdery_mildew", "leaf_spot", "rust", "blight", "bacterial_spot",
+            "mosaic_virus", "spider_mites", "nutrient_deficiency", "healthy"]
+PLANTS = ["tomato", "potato", "corn", "wheat", "rice", "soybean", "cotton", "apple", "grape"]
+ZONES = [f"zone_{i}" for i in range(50)]
+
+
+def random_timestamps(count: int, days: int):
+    """Naive local timestamps spread over the last `days` days, ending now"""
+    now = datetime.now()
+    span = days * 86400
+    for _ in range(count):
+        yield now - timedelta(seconds=random.uniform(0, span))
+
+
+def populate(conn, rows: int, spray_rows: int, days: int):
+    """Insert synthetic detections and spray events in large transactions"""
+    def detections():
+        for i, ts in enumerate(random_timestamps(rows, days)):
+            yield (f"det_{i}", random.choice(DISEASES), random.choice(PLANTS), random.uniform(75, 99),
+                   "moderate", random.uniform(0, 45), "synthetic", 0.5, 5, "ml_model", ts)
+
+    def sprays():
+        for i, ts in enumerate(random_timestamps(spray_rows, days)):
+            yield (f"spray_{i}", random.choice(ZONES), None, 60, "Fungicide", random.uniform(0.2, 0.9), 1, ts)
+
+    conn.execute("BEGIN")
+    conn.executemany('''
+        INSERT INTO detections (detection_id, disease_type, plant_type, confidence, severity,
+            affected_area_percentage, recommendation, pesticide_dosage, spray_time_seconds,
+            detection_method, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', detections())
+    conn.executemany('''
+        INSERT INTO spray_events (spray_id, zone_id, detection_id, spray_duration,
+            pesticide_type, dosage, success, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', sprays())
+    conn.execute("COMMIT")
+
+
+def queries():
+    """(name, query before migration, query after migration, params after)"""
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    today_ms = (int(today.timestamp() * 1000), int((today + timedelta(days=1)).timestamp() * 1000))
+    return [
+        ("healthy count",
+         "SELECT COUNT(*) FROM detections WHERE disease_type = 'healthy'",
+         "SELECT COUNT(*) FROM detections WHERE disease_type = 'healthy'", ()),
+        ("most common disease",
+         "SELECT disease_type, COUNT(*) c FROM detections WHERE disease_type != 'healthy' GROUP BY disease_type ORDER BY c DESC LIMIT 1",
+         "SELECT disease_type, COUNT(*) c FROM detections WHERE disease_type != 'healthy' GROUP BY disease_type ORDER BY c DESC LIMIT 1", ()),
+        ("most common plant",
+         "SELECT plant_type, COUNT(*) c FROM detections GROUP BY plant_type ORDER BY c DESC LIMIT 1",
+         "SELECT plant_type, COUNT(*) c FROM detections GROUP BY plant_type ORDER BY c DESC LIMIT 1", ()),
+        ("dosage today",
+         "SELECT SUM(dosage) FROM spray_events WHERE DATE(timestamp) = DATE('now')",
+         "SELECT SUM(dosage) FROM spray_events WHERE timestamp_ms >= ? AND timestamp_ms < ?", today_ms),
+        ("history first page",
+         "SELECT * FROM detections ORDER BY timestamp DESC LIMIT 50",
+         "SELECT * FROM detections ORDER BY timestamp_ms DESC LIMIT 50", ()),
+        ("history by disease",
+         "SELECT * FROM detections WHERE disease_type = 'rust' ORDER BY timestamp DESC LIMIT 50",
+         "SELECT * FROM detections WHERE disease_type = 'rust' ORDER BY timestamp_ms DESC LIMIT 50", ()),
+        ("sprays by zone",
+         "SELECT * FROM spray_events WHERE zone_id = 'zone_7' ORDER BY timestamp DESC LIMIT 50",
+         "SELECT * FROM spray_events WHERE zone_id = 'zone_7' ORDER BY timestamp_ms DESC LIMIT 50", ()),
+    ]
+
+
+def best_of(conn, sql: str, params=(), runs: int = 3) -> float:
+    """Best wall time in milliseconds over `runs` executions"""
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark query times before/after schema migrations")
+    parser.add_argument("--rows", type=int, default=5_000_000, help="Synthetic detections")
+    parser.add_argument("--spray-rows", type=int, default=1_000_000, help="Synthetic spray events")
+    parser.add_argument("--days", type=int, default=730, help="Days of history to spread rows over")
+    parser.add_argument("--db", help="Database path (default: temporary file)")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), "benchmark.db")
+    conn = Database(path).connect()
+
+    conn.execute("BEGIN")
+    migrate(conn, target_version=2)
+    conn.execute("COMMIT")
+
+    print(f"📦 Populating {args.rows:,} detections and {args.spray_rows:,} spray events in {path}")
+    start = time.perf_counter()
+    populate(conn, args.rows, args.spray_rows, args.days)
+    print(f"   done in {time.perf_counter() - start:.1f}s")
+
+    before = {name: best_of(conn, old_sql) for name, old_sql, _, _ in queries()}
+
+    start = time.perf_counter()
+    conn.execute("BEGIN")
+    migrate(conn)
+    conn.execute("COMMIT")
+    print(f"🔧 Migrations (backfill + indexes) took {time.perf_counter() - start:.1f}s")
+
+    print(f"\n{'query':<22}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for name, _, new_sql, params in queries():
+        after = best_of(conn, new_sql, params)
+        print(f"{name:<22}{before[name]:>12.2f}{after:>12.2f}{before[name] / max(after, 1e-6):>9.1f}x")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+WebSocket wire format benchmark
+===============================
+
+Replays a synthetic hour of field events (zone updates, device telemetry,
+sprays, detections) through the EventBus and reports, per connected client,
+bytes per hour and encode CPU for:
+
+- legacy: json.dumps per event per client (the original broadcast loop)
+- json: one JSON text frame per event, encoded once and shared
+- msgpack: coalesced MessagePack frames per tick
+- msgpack-deflate: coalesced MessagePack frames, deflated when large enough
+
+Transport framing and TLS overhead are excluded.
+
+Usage (from backend/):
+python benchmarks/ws_protocol_benchmark.py --clients 5000 --events-per-second 20
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import wire
+from events import EventBus
+
+ZONES = [f"zone_{c}" for c in "abcdefgh"]
+DEVICES = [f"device_{i}" for i in range(1, 41)]
+
+
+def synthetic_events(seconds: int, events_per_second: float):
+    """(second, topic, event, zone_id, key) tuples in time order"""
+    for _ in range(int(seconds * events_per_second)):
+        second = random.uniform(0, seconds)
+        kind = random.random()
+        if kind < 0.45:
+            device_id = random.choice(DEVICES)
+            yield second, "devices", {"event": "device_status", "device_id": device_id,
+                                      "status": "online", "battery": random.uniform(20, 100)}, None, device_id
+        elif kind < 0.8:
+            zone_id = random.choice(ZONES)
+            yield second, "zones", {"event": "zone_update", "zone_id": zone_id,
+                                    "health_score": random.uniform(60, 95),
+                                    "infection_rate": random.uniform(5, 40),
+                                    "treatment_needed": False}, zone_id, zone_id
+        elif kind < 0.95:
+            yield second, "detections", {"event": "detection", "detection_id": f"det_{random.getrandbits(40)}",
+                                         "disease_type": "leaf_spot", "plant_type": "tomato",
+                                         "severity": "moderate", "confidence": random.uniform(70, 99),
+                                         "affected_area_percentage": random.uniform(0, 40),
+                                         "detection_method": "ml_model",
+                                         "gps_coordinates": {"lat": 30.73, "lng": 76.77}}, None, None
+        else:
+            zone_id = random.choice(ZONES)
+            yield second, "sprays", {"event": "spray_started", "spray_id": f"spray_{random.getrandbits(40)}",
+                                     "zone_id": zone_id, "dosage": 0.5, "duration": 2,
+                                     "success": True}, zone_id, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare WebSocket wire formats")
+    parser.add_argument("--clients", type=int, default=5000, help="Connected dashboards to account for")
+    parser.add_argument("--events-per-second", type=float, default=20, help="Published events per second")
+    parser.add_argument("--seconds", type=int, default=3600, help="Simulated duration")
+    parser.add_argument("--tick-ms", type=float, default=100, help="Coalescing tick")
+    args = parser.parse_args()
+
+    events = sorted(synthetic_events(args.seconds, args.events_per_second), key=lambda e: e[0])
+    print(f"📡 {len(events):,} events over {args.seconds}s, {args.clients:,} clients, {args.tick_ms:g} ms tick")
+
+    # Legacy: every client serializes every event itself
+    start = time.perf_counter()
+    legacy_bytes = sum(len(json.dumps(event).encode()) for _, _, event, _, _ in events)
+    legacy_ms = (time.perf_counter() - start) * 1000
+
+    results = {"legacy": (legacy_bytes, legacy_ms * args.clients, legacy_ms)}
+    for codec in wire.CODECS:
+        bus = EventBus(recent_events=1, coalesce_tick_ms=args.tick_ms)
+        received = {"bytes": 0}
+        bus.subscribe(lambda item: received.__setitem__("bytes", received["bytes"] + item.encode(codec)[1]),
+                      coalesce=codec != wire.JSON)
+        before = wire.stats()[codec]["encode_ms"]
+
+        tick = args.tick_ms / 1000
+        next_flush = tick
+        for second, topic, event, zone_id, key in events:
+            while second >= next_flush:
+                bus.flush()
+                next_flush += tick
+            bus.publish(topic, event, zone_id=zone_id, key=key)
+        bus.flush()
+
+        encode_ms = wire.stats()[codec]["encode_ms"] - before
+        # Frames are encoded once and shared, so the server cost does not scale with clients
+        results[codec] = (received["bytes"], encode_ms, encode_ms / args.clients)
+
+    hours = args.seconds / 3600
+    print(f"\n{'format':<18}{'KB/hour/client':>16}{'server encode ms':>18}{'encode ms/client':>18}")
+    for name, (total_bytes, server_ms, per_client_ms) in results.items():
+        print(f"{name:<18}{total_bytes / 1024 / hours:>16.1f}{server_ms:>18.1f}{per_client_ms:>18.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Confidence-gated hybrid detection
+
+The local DiseaseDetector is cheap; the remote model (Gemini) costs quota
+and a network round trip. HybridCascade decides when the remote call is
+worth it.
+
+Modes:
+- "cascade" (default): run local first and escalate to remote only when
+  local confidence is below confidence_threshold, the severity is one of
+  escalate_severities (high stakes: a wrong call means a wrong spray), or
+  local detection failed on the model side. If the remote call fails, the
+  local result is used.
+- "race": start both at once and return the first confident result. If
+  neither is confident, return the most confident one finished within
+  latency_budget_ms. Lower tail latency, but every request pays for a
+  remote call unless local wins first (the remote call is then cancelled).
+  Escalations here count requests answered by the remote model, including
+  "local_slow" when local had not finished yet.
+
+Errors of a client_errors type (an upload that does not decode) are the
+caller's fault, not the local model's: they are raised as-is and never
+escalated, so a corrupt image cannot spend remote quota or come back with
+a remote diagnosis. In race mode the remote call is cancelled.
+
+Confidences are compared as percentages (0-100), the scale of
+DetectionResult.confidence; the detector adapters in main.py put both
+models' results on that scale, so confidence_threshold is a percentage too.
+
+stats() reports the escalation rate, escalations by reason and latency
+per path, for tuning the threshold against cost and latency.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple, Type
+
+CASCADE_MODES = ("cascade", "race")
+
+
+class HybridCascade:
+    """
+    Local-first detection with escalation to a remote model
+    """
+
+    def __init__(self, confidence_threshold: float = 85, escalate_severities: Iterable[str] = ("high", "critical"),
+                 mode: str = "cascade", latency_budget_ms: float = 1500,
+                 client_errors: Tuple[Type[BaseException], ...] = ()):
+        if mode not in CASCADE_MODES:
+            raise ValueError(f"mode must be one of {CASCADE_MODES}")
+        self.confidence_threshold = confidence_threshold
+        self.escalate_severities = set(escalate_severities)
+        self.mode = mode
+        self.latency_budget_ms = latency_budget_ms
+        self.client_errors = tuple(client_errors)
+
+        self.requests = 0
+        self.local_accepted = 0
+        self.escalations = {"low_confidence": 0, "high_severity": 0, "local_error": 0, "local_slow": 0}
+        self.remote_errors = 0
+        self.rejected = 0
+        self.race_wins = {"local": 0, "remote": 0}
+        self.budget_exceeded = 0
+        self._latency_ms = {"local": 0.0, "remote": 0.0, "total": 0.0}
+        self._latency_counts = {"local": 0, "remote": 0, "total": 0}
+
+    def escalation_reason(self, result: Any) -> Optional[str]:
+        """Why a result is not good enough on its own (None if it is)"""
+        if result.confidence < self.confidence_threshold:
+            return "low_confidence"
+        severity = getattr(result.severity, "value", result.severity)
+        if severity in self.escalate_severities:
+            return "high_severity"
+        return None
+
+    async def detect(self, local: Callable[[], Awaitable[Any]], remote: Callable[[], Awaitable[Any]]) -> Any:
+        """Run the cascade (or race) over the two detectors"""
+        self.requests += 1
+        start = time.perf_counter()
+        try:
+            if self.mode == "race":
+                return await self._race(local, remote)
+            return await self._cascade(local, remote)
+        finally:
+            self._record("total", start)
+
+    async def _cascade(self, local, remote) -> Any:
+        local_result = None
+        start = time.perf_counter()
+        try:
+            local_result = await local()
+            reason = self.escalation_reason(local_result)
+        except self.client_errors:
+            self.rejected += 1
+            raise
+        except Exception as e:
+            logging.error(f"Local detection failed, escalating: {e}")
+            reason = "local_error"
+        finally:
+            self._record("local", start)
+
+        if reason is None:
+            self.local_accepted += 1
+            return local_result
+
+        self.escalations[reason] += 1
+        start = time.perf_counter()
+        try:
+            return await remote()
+        except Exception as e:
+            self.remote_errors += 1
+            if local_result is None:
+                raise
+            logging.error(f"Remote detection failed, using local result: {e}")
+            return local_result
+        finally:
+            self._record("remote", start)
+
+    async def _race(self, local, remote) -> Any:
+        start = time.perf_counter()
+        tasks = {asyncio.ensure_future(local()): "local", asyncio.ensure_future(remote()): "remote"}
+        finished: Dict[str, Any] = {}
+        local_failed = False
+        deadline = start + self.latency_budget_ms / 1000
+        pending = set(tasks)
+        try:
+            while pending:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0 and finished:
+                    self.budget_exceeded += 1
+                    break
+                done, pending = await asyncio.wait(pending, timeout=timeout if finished else None,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    source = tasks[task]
+                    self._record(source, start)
+                    if task.exception() is not None:
+                        if source == "local" and isinstance(task.exception(), self.client_errors):
+                            self.rejected += 1
+                            raise task.exception()
+                        if source == "remote":
+                            self.remote_errors += 1
+                        else:
+                            local_failed = True
+                        logging.error(f"{source} detection failed: {task.exception()}")
+                        continue
+                    finished[source] = task.result()
+                    if self.escalation_reason(task.result()) is None:
+                        return self._race_result(source, finished, local_failed)
+            if not finished:
+                raise RuntimeError("Both local and remote detection failed")
+            # Nobody was confident: take the most confident result available
+            source = max(finished, key=lambda s: finished[s].confidence)
+            return self._race_result(source, finished, local_failed)
+        finally:
+            for task, source in tasks.items():
+                # The local job is shared with the micro-batcher; let it finish on its own
+                if source == "remote" and not task.done():
+                    task.cancel()
+                # Retrieve late or unexamined failures so asyncio does not report them as never retrieved
+                task.add_done_callback(self._discard_late_result)
+
+    @staticmethod
+    def _discard_late_result(task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Detection failed after the race was decided: {task.exception()}")
+
+    def _race_result(self, source: str, finished: Dict[str, Any], local_failed: bool) -> Any:
+        self.race_wins[source] += 1
+        if source == "local":
+            self.local_accepted += 1
+            return finished[source]
+
+        local_result = finished.get("local")
+        if local_result is not None:
+            reason = self.escalation_reason(local_result) or "low_confidence"
+        else:
+            reason = "local_error" if local_failed else "local_slow"
+        self.escalations[reason] += 1
+        return finished[source]
+
+    def _record(self, path: str, start: float):
+        self._latency_ms[path] += (time.perf_counter() - start) * 1000
+        self._latency_counts[path] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Escalation rate and latency per path"""
+        escalated = sum(self.escalations.values())
+        return {
+            "mode": self.mode,
+            "confidence_threshold": self.confidence_threshold,
+            "escalate_severities": sorted(self.escalate_severities),
+            "latency_budget_ms": self.latency_budget_ms,
+            "requests": self.requests,
+            "local_accepted": self.local_accepted,
+            "escalated": escalated,
+            "escalation_rate": round(escalated / self.requests, 4) if self.requests else 0.0,
+            "escalations": dict(self.escalations),
+            "remote_errors": self.remote_errors,
+            "rejected": self.rejected,
+            "race_wins": dict(self.race_wins),
+            "budget_exceeded": self.budget_exceeded,
+            "avg_latency_ms": {
+                path: round(self._latency_ms[path] / count, 1) if count else 0.0
+                for path, count in self._latency_counts.items()
+            }
+        }
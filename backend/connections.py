@@ -0,0 +1,243 @@
+"""
+Backpressure-aware WebSocket fan-out
+
+Every connected client gets a bounded send queue and its own writer task.
+broadcast() only appends to those queues (no awaits per client), so one
+stalled socket can never delay delivery to the others. When a client's
+queue is full the slow-consumer policy applies:
+- "drop_oldest": discard the oldest queued message to make room
+- "disconnect": close the client; it can reconnect and resync
+
+A send that fails closes and prunes the connection; a watchdog does the same
+for sends stuck longer than send_timeout (cheaper than a wait_for timer per
+send across thousands of sockets).
+
+stats() exposes per-connection lag (time from enqueue to socket write),
+queue depth, drops, bytes per hour and time spent in socket sends (framing
+plus any transport compression, i.e. per-client CPU), with totals per wire
+codec.
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+
+from fastapi import WebSocket
+
+Message = Union[str, bytes]
+
+SLOW_CLIENT_POLICIES = ("drop_oldest", "disconnect")
+
+
+def message_size(message: Message) -> int:
+    """Payload size in bytes as written to the socket"""
+    return len(message) if isinstance(message, bytes) else len(message.encode())
+
+
+class ClientConnection:
+    """
+    One WebSocket with its send queue, writer task and delivery metrics
+    """
+
+    def __init__(self, client_id: int, websocket: WebSocket, queue_size: int, codec: str = "json"):
+        self.client_id = client_id
+        self.websocket = websocket
+        self.queue_size = queue_size
+        self.codec = codec
+        self.queue: Deque[Tuple[Message, int, float]] = deque()
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.open = True
+        self.connected_at = time.monotonic()
+        self.sending_since: Optional[float] = None
+
+        self.sent = 0
+        self.dropped = 0
+        self.bytes_sent = 0
+        self.send_ms = 0.0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """Delivery metrics for this connection"""
+        oldest_ms = (time.monotonic() - self.queue[0][2]) * 1000 if self.queue else 0.0
+        connected_hours = max(time.monotonic() - self.connected_at, 1e-6) / 3600
+        return {
+            "client_id": self.client_id,
+            "codec": self.codec,
+            "queued": len(self.queue),
+            "oldest_queued_ms": round(oldest_ms, 1),
+            "last_lag_ms": round(self.last_lag_ms, 1),
+            "max_lag_ms": round(self.max_lag_ms, 1),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "bytes_sent": self.bytes_sent,
+            "bytes_per_hour": round(self.bytes_sent / connected_hours),
+            "send_ms": round(self.send_ms, 3),
+            "connected_seconds": round(time.monotonic() - self.connected_at, 1)
+        }
+
+
+class ConnectionManager:
+    """
+    Tracks connected WebSocket clients and fans messages out to them
+    """
+
+    def __init__(self, queue_size: int = 256, slow_client_policy: str = "drop_oldest",
+                 send_timeout: float = 10.0):
+        if slow_client_policy not in SLOW_CLIENT_POLICIES:
+            raise ValueError(f"slow_client_policy must be one of {SLOW_CLIENT_POLICIES}")
+        self.queue_size = queue_size
+        self.slow_client_policy = slow_client_policy
+        self.send_timeout = send_timeout
+
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        self._ids = itertools.count(1)
+        self._closing = set()
+        self._watchdog: Optional[asyncio.Task] = None
+
+        self.broadcasts = 0
+        self.dropped = 0
+        self.disconnected_slow = 0
+        self.pruned = 0
+
+    @property
+    def active_connections(self) -> List[WebSocket]:
+        """Currently connected sockets"""
+        return list(self.clients)
+
+    async def connect(self, websocket: WebSocket, subprotocol: Optional[str] = None,
+                      codec: str = "json") -> ClientConnection:
+        """Accept a socket (with the negotiated subprotocol) and start its writer task"""
+        await websocket.accept(subprotocol=subprotocol)
+        client = ClientConnection(next(self._ids), websocket, self.queue_size, codec)
+        client.task = asyncio.create_task(self._writer(client))
+        self.clients[websocket] = client
+        if self._watchdog is None or self._watchdog.done():
+            self._watchdog = asyncio.create_task(self._watch_stalled_sends())
+        return client
+
+    def disconnect(self, websocket: WebSocket):
+        """Forget a socket and stop its writer (safe to call more than once)"""
+        client = self.clients.pop(websocket, None)
+        if client is None:
+            return
+        client.open = False
+        client.queue.clear()
+        if client.task is not None and client.task is not asyncio.current_task():
+            client.task.cancel()
+
+    async def send_personal_message(self, message: Message, websocket: WebSocket):
+        """Queue a message for one client"""
+        self.queue_message(websocket, message)
+
+    def queue_message(self, websocket: WebSocket, message: Message, size: Optional[int] = None):
+        """Queue a message for one client without awaiting (size: precomputed payload bytes)"""
+        client = self.clients.get(websocket)
+        if client is not None:
+            self._enqueue(client, message, message_size(message) if size is None else size, time.monotonic())
+
+    async def broadcast(self, message: Message):
+        """Queue a message for every client; never waits on a socket"""
+        self.broadcasts += 1
+        size = message_size(message)
+        now = time.monotonic()
+        for client in list(self.clients.values()):
+            self._enqueue(client, message, size, now)
+
+    def stats(self, top: int = 20) -> Dict[str, Any]:
+        """Fan-out totals plus the `top` most lagged connections"""
+        clients = [client.stats() for client in self.clients.values()]
+        clients.sort(key=lambda c: (c["oldest_queued_ms"], c["last_lag_ms"]), reverse=True)
+        codecs: Dict[str, Dict[str, float]] = {}
+        for c in clients:
+            totals = codecs.setdefault(c["codec"], {"connections": 0, "sent": 0, "bytes_sent": 0,
+                                                    "bytes_per_hour": 0, "send_ms": 0.0})
+            for name in totals:
+                totals[name] += 1 if name == "connections" else c[name]
+        return {
+            "connections": len(clients),
+            "queue_size": self.queue_size,
+            "slow_client_policy": self.slow_client_policy,
+            "broadcasts": self.broadcasts,
+            "queued": sum(c["queued"] for c in clients),
+            "dropped": self.dropped,
+            "disconnected_slow": self.disconnected_slow,
+            "pruned": self.pruned,
+            "max_lag_ms": max((c["max_lag_ms"] for c in clients), default=0.0),
+            "codecs": codecs,
+            "most_lagged": clients[:top]
+        }
+
+    def _enqueue(self, client: ClientConnection, message: Message, size: int, enqueued_at: float):
+        if not client.open:
+            return
+        if len(client.queue) >= client.queue_size:
+            if self.slow_client_policy == "disconnect":
+                self.disconnected_slow += 1
+                self.disconnect(client.websocket)
+                task = asyncio.create_task(self._close_socket(client.websocket, 1013, "Client too slow"))
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+                return
+            client.queue.popleft()
+            client.dropped += 1
+            self.dropped += 1
+        client.queue.append((message, size, enqueued_at))
+        client.wakeup.set()
+
+    async def _writer(self, client: ClientConnection):
+        """Drain one client's queue until it closes or a send fails"""
+        websocket = client.websocket
+        try:
+            while client.open:
+                if not client.queue:
+                    client.wakeup.clear()
+                    await client.wakeup.wait()
+                    continue
+                message, size, enqueued_at = client.queue.popleft()
+                client.sending_since = started = time.monotonic()
+                if isinstance(message, bytes):
+                    await websocket.send_bytes(message)
+                else:
+                    await websocket.send_text(message)
+                client.sending_since = None
+                client.send_ms += (time.monotonic() - started) * 1000
+
+                client.last_lag_ms = (time.monotonic() - enqueued_at) * 1000
+                client.max_lag_ms = max(client.max_lag_ms, client.last_lag_ms)
+                client.sent += 1
+                client.bytes_sent += size
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Dead or stalled socket: prune it so it stops accumulating messages
+            if client.open:
+                logging.error(f"WebSocket client {client.client_id} dropped: {e!r}")
+                self.pruned += 1
+                self.disconnect(websocket)
+                await self._close_socket(websocket, 1011)
+
+    async def _watch_stalled_sends(self):
+        """Prune clients whose current send has been blocked longer than send_timeout"""
+        while self.clients:
+            await asyncio.sleep(self.send_timeout / 2)
+            deadline = time.monotonic() - self.send_timeout
+            for websocket, client in list(self.clients.items()):
+                if client.sending_since is not None and client.sending_since < deadline:
+                    logging.error(f"WebSocket client {client.client_id} stalled for over {self.send_timeout}s")
+                    self.pruned += 1
+                    self.disconnect(websocket)
+                    task = asyncio.create_task(self._close_socket(websocket, 1011))
+                    self._closing.add(task)
+                    task.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    async def _close_socket(websocket: WebSocket, code: int, reason: str = ""):
+        try:
+            await websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
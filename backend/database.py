@@ -0,0 +1,135 @@
+"""
+SQLite persistence layer for the API
+
+All database work runs on dedicated threads so the event loop never blocks
+on disk:
+- one writer thread with its own connection (SQLite allows a single writer);
+  every write call runs inside one BEGIN IMMEDIATE ... COMMIT transaction
+- a pool of reader threads, each owning one connection; in WAL mode readers
+  never block the writer or each other
+
+Connections are opened once and reused, keep a prepared statement cache
+(cached_statements) and are tuned with WAL journaling, NORMAL sync, a larger
+page cache and memory-mapped I/O.
+"""
+
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, List, Optional, Sequence
+
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",    # Durable across app crashes in WAL mode, one fsync per checkpoint
+    "temp_store": "MEMORY",
+    "cache_size": -64000,       # 64 MB page cache
+    "mmap_size": 268435456,     # 256 MB memory-mapped reads
+    "busy_timeout": 5000,
+}
+
+
+class Database:
+    """
+    Pooled SQLite access with async wrappers
+    """
+
+    def __init__(self, path: str, reader_pool_size: int = 4, statement_cache_size: int = 256):
+        self.path = path
+        self.reader_pool_size = reader_pool_size
+        self.statement_cache_size = statement_cache_size
+
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._readers: Optional[ThreadPoolExecutor] = None
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Create the writer and reader threads"""
+        if self._writer is not None:
+            return
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        self._readers = ThreadPoolExecutor(max_workers=self.reader_pool_size, thread_name_prefix="sqlite-reader")
+
+    def close(self):
+        """Wait for queued work, then close every pooled connection"""
+        if self._writer is None:
+            return
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self._writer = self._readers = None
+
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    # Refresh planner statistics; closing the last connection checkpoints the WAL
+                    conn.execute("PRAGMA optimize")
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._connections.clear()
+        self._local = threading.local()
+
+    def connect(self) -> sqlite3.Connection:
+        """Open a tuned connection (also usable directly by scripts and maintenance jobs)"""
+        conn = sqlite3.connect(
+            self.path,
+            isolation_level=None,  # Transactions are managed explicitly
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size
+        )
+        for name, value in PRAGMAS.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    def _thread_connection(self) -> sqlite3.Connection:
+        """The calling pool thread's own connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self.connect()
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _run_write(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        conn = self._thread_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def _run_read(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        return fn(self._thread_connection())
+
+    async def write(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Run fn(conn) in a single transaction on the writer thread"""
+        if self._writer is None:
+            raise RuntimeError("Database is not started")
+        return await asyncio.get_running_loop().run_in_executor(self._writer, self._run_write, fn)
+
+    async def read(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Run fn(conn) on a pooled reader connection"""
+        if self._readers is None:
+            raise RuntimeError("Database is not started")
+        return await asyncio.get_running_loop().run_in_executor(self._readers, self._run_read, fn)
+
+    async def execute(self, sql: str, params: Sequence = ()) -> int:
+        """Run one write statement; returns the affected row count"""
+        return await self.write(lambda conn: conn.execute(sql, params).rowcount)
+
+    async def executemany(self, sql: str, rows: Iterable[Sequence]) -> int:
+        """Run one write statement for many rows in a single transaction"""
+        return await self.write(lambda conn: conn.executemany(sql, rows).rowcount)
+
+    async def fetchall(self, sql: str, params: Sequence = ()) -> List[tuple]:
+        """Run a query and return all rows"""
+        return await self.read(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def fetchone(self, sql: str, params: Sequence = ()) -> Optional[tuple]:
+        """Run a query and return the first row"""
+        return await self.read(lambda conn: conn.execute(sql, params).fetchone())
@@ -0,0 +1,236 @@
+"""
+In-process pub/sub event bus
+
+Producers (detections, sprays, zone updates, device status, weather) publish
+plain event dicts to a topic. Each event is wrapped in an Envelope and
+serialized once, however many subscribers receive it; subscribers are
+indexed by topic and may narrow further to a set of zones.
+
+The bus also retains state for snapshots: the latest event per key (zone,
+device) for state-like topics and a short ring of recent events for
+stream-like ones, so a newly connected dashboard can render immediately
+and then apply deltas.
+
+Coalescing subscribers (binary wire formats) are not called per event.
+Events are grouped per (topic, zone, key) for one tick and delivered as
+Frames; within a keyed group only the latest state survives. Frames are
+likewise encoded once per codec and shared.
+"""
+
+import asyncio
+import itertools
+import logging
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+import wire
+
+TOPICS = ("detections", "sprays", "zones", "devices", "weather")
+
+
+class Envelope:
+    """
+    One published event plus its (lazily cached) wire encodings
+    """
+
+    __slots__ = ("topic", "zone_id", "key", "event", "_encoded")
+
+    def __init__(self, topic: str, event: Dict[str, Any], zone_id: Optional[str] = None,
+                 key: Optional[str] = None):
+        self.topic = topic
+        self.zone_id = zone_id
+        self.key = key
+        self.event = event
+        self._encoded: Dict[str, Tuple[wire.Payload, int]] = {}
+
+    def encode(self, codec: str = wire.JSON) -> Tuple[wire.Payload, int]:
+        """(payload, size in bytes) of the event, encoded on first use and shared by all subscribers"""
+        encoded = self._encoded.get(codec)
+        if encoded is None:
+            encoded = self._encoded[codec] = wire.encode(codec, [self.event])
+        return encoded
+
+
+class Frame:
+    """
+    Coalesced events of one (topic, zone, key) group within a tick
+    """
+
+    __slots__ = ("topic", "zone_id", "envelopes", "_encoded")
+
+    def __init__(self, topic: str, zone_id: Optional[str], envelopes: List[Envelope]):
+        self.topic = topic
+        self.zone_id = zone_id
+        self.envelopes = envelopes
+        self._encoded: Dict[str, Tuple[wire.Payload, int]] = {}
+
+    def encode(self, codec: str = wire.MSGPACK) -> Tuple[wire.Payload, int]:
+        """(payload, size in bytes) of all events in one frame, encoded once per codec"""
+        encoded = self._encoded.get(codec)
+        if encoded is None:
+            encoded = self._encoded[codec] = wire.encode(codec, [e.event for e in self.envelopes])
+        return encoded
+
+
+class Subscription:
+    """
+    A subscriber's topic/zone filter and delivery callback
+    """
+
+    def __init__(self, subscription_id: int, deliver: Callable[[Union[Envelope, Frame]], None],
+                 topics: Iterable[str], zones: Optional[Iterable[str]] = None, coalesce: bool = False):
+        self.subscription_id = subscription_id
+        self.deliver = deliver
+        self.topics: Set[str] = set(topics)
+        self.zones: Optional[Set[str]] = set(zones) if zones else None
+        self.coalesce = coalesce
+
+    def matches(self, item: Union[Envelope, Frame]) -> bool:
+        """Zone filters only apply to zone-scoped events"""
+        return self.zones is None or item.zone_id is None or item.zone_id in self.zones
+
+
+class EventBus:
+    """
+    Topic-indexed publish/subscribe with retained snapshot state
+    """
+
+    def __init__(self, recent_events: int = 20, coalesce_tick_ms: float = 100):
+        self.recent_events = recent_events
+        self.coalesce_tick_ms = coalesce_tick_ms
+        self._subscribers: Dict[str, Set[Subscription]] = {topic: set() for topic in TOPICS}
+        self._latest: Dict[str, Dict[str, Envelope]] = {topic: {} for topic in TOPICS}
+        self._recent: Dict[str, Deque[Envelope]] = {topic: deque(maxlen=recent_events) for topic in TOPICS}
+        self._ids = itertools.count(1)
+        self._pending: Dict[Tuple[str, Optional[str], Optional[str]], List[Envelope]] = {}
+        self._flusher: Optional[asyncio.Task] = None
+
+        self.published = {topic: 0 for topic in TOPICS}
+        self.deliveries = 0
+        self.frames = 0
+
+    def start(self):
+        """Start the coalescing tick on the running event loop"""
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the tick after flushing pending frames"""
+        if self._flusher is None:
+            return
+        self._flusher.cancel()
+        try:
+            await self._flusher
+        except asyncio.CancelledError:
+            pass
+        self._flusher = None
+        self.flush()
+
+    def subscribe(self, deliver: Callable[[Union[Envelope, Frame]], None], topics: Optional[Iterable[str]] = None,
+                  zones: Optional[Iterable[str]] = None, coalesce: bool = False) -> Subscription:
+        """
+        Register a delivery callback for topics (default: all) and optional zones
+        Coalescing subscribers receive Frames once per tick instead of Envelopes.
+        """
+        subscription = Subscription(next(self._ids), deliver, [], zones, coalesce)
+        self.update(subscription, topics=topics if topics is not None else TOPICS)
+        return subscription
+
+    def update(self, subscription: Subscription, topics: Optional[Iterable[str]] = None,
+               zones: Optional[Iterable[str]] = None):
+        """Replace a subscription's topics and/or zones"""
+        if topics is not None:
+            topics = self._validate(topics)
+            for topic in subscription.topics - topics:
+                self._subscribers[topic].discard(subscription)
+            for topic in topics:
+                self._subscribers[topic].add(subscription)
+            subscription.topics = topics
+        if zones is not None:
+            subscription.zones = set(zones) or None
+
+    def unsubscribe(self, subscription: Subscription):
+        """Stop delivering to a subscription"""
+        for topic in subscription.topics:
+            self._subscribers[topic].discard(subscription)
+        subscription.topics = set()
+
+    def publish(self, topic: str, event: Dict[str, Any], zone_id: Optional[str] = None,
+                key: Optional[str] = None) -> Envelope:
+        """
+        Deliver an event to matching subscribers
+        With a key, the event replaces that key's retained state (e.g. a zone's
+        latest status); without one it joins the topic's recent-events ring.
+        """
+        self._validate([topic])
+        envelope = Envelope(topic, {"topic": topic, **event}, zone_id, key)
+        if key is not None:
+            self._latest[topic][key] = envelope
+        else:
+            self._recent[topic].append(envelope)
+        self.published[topic] += 1
+
+        coalesced = False
+        for subscription in list(self._subscribers[topic]):
+            if subscription.coalesce:
+                coalesced = True
+            elif subscription.matches(envelope):
+                self._deliver(subscription, envelope)
+        if coalesced:
+            group = self._pending.setdefault((topic, zone_id, key), [])
+            if key is not None:
+                group.clear()  # Only the latest state of a key is worth sending
+            group.append(envelope)
+        return envelope
+
+    def flush(self):
+        """Deliver pending events to coalescing subscribers as one Frame per group"""
+        pending, self._pending = self._pending, {}
+        for (topic, zone_id, _), envelopes in pending.items():
+            frame = Frame(topic, zone_id, envelopes)
+            self.frames += 1
+            for subscription in list(self._subscribers[topic]):
+                if subscription.coalesce and subscription.matches(frame):
+                    self._deliver(subscription, frame)
+
+    def _deliver(self, subscription: Subscription, item: Union[Envelope, Frame]):
+        try:
+            subscription.deliver(item)
+            self.deliveries += 1
+        except Exception as e:
+            logging.error(f"Event delivery to subscription {subscription.subscription_id} failed: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.coalesce_tick_ms / 1000)
+            if self._pending:
+                self.flush()
+
+    def snapshot(self, topics: Optional[Iterable[str]] = None, zones: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """Retained state and recent events for the given topics and zones"""
+        probe = Subscription(0, lambda envelope: None, [], zones)
+        events = []
+        for topic in self._validate(topics if topics is not None else TOPICS):
+            for envelope in itertools.chain(self._latest[topic].values(), self._recent[topic]):
+                if probe.matches(envelope):
+                    events.append(envelope.event)
+        return events
+
+    def stats(self) -> Dict[str, Any]:
+        """Publish counts and subscribers per topic"""
+        return {
+            "published": dict(self.published),
+            "subscribers": {topic: len(subs) for topic, subs in self._subscribers.items()},
+            "deliveries": self.deliveries,
+            "coalesced_frames": self.frames,
+            "coalesce_tick_ms": self.coalesce_tick_ms,
+            "wire": wire.stats()
+        }
+
+    @staticmethod
+    def _validate(topics: Iterable[str]) -> Set[str]:
+        topics = set(topics)
+        unknown = topics - set(TOPICS)
+        if unknown:
+            raise ValueError(f"Unknown topics: {', '.join(sorted(unknown))}")
+        return topics
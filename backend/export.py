@@ -0,0 +1,65 @@
+"""
+Streaming NDJSON / CSV export
+
+Rows are read in keyset chunks (HistoryQuery, oldest first) on the pooled
+reader connections and encoded chunk by chunk, optionally through an
+incremental gzip compressor, so memory stays at one chunk no matter how many
+rows the export covers. Each chunk is its own short read, so a long export
+never pins a WAL snapshot and blocks checkpoints.
+"""
+
+import csv
+import io
+import json
+import zlib
+from typing import AsyncIterator, List, Sequence
+
+from database import Database
+from history import HistoryQuery
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+async def stream_rows(database: Database, history: HistoryQuery, chunk_size: int) -> AsyncIterator[List[tuple]]:
+    """Yield every matching row, oldest first, in chunks of at most chunk_size"""
+    cursor = None
+    while True:
+        rows, cursor = await database.read(
+            lambda conn, cursor=cursor: history.page(conn, cursor, chunk_size, descending=False)
+        )
+        if rows:
+            yield rows
+        if cursor is None:
+            return
+
+
+async def encode_rows(chunks: AsyncIterator[List[tuple]], columns: Sequence[str], fmt: str) -> AsyncIterator[bytes]:
+    """Encode row chunks as NDJSON lines or CSV (with a header row)"""
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        yield buffer.getvalue().encode()
+        async for rows in chunks:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(rows)
+            yield buffer.getvalue().encode()
+    else:
+        async for rows in chunks:
+            yield "".join(
+                json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in rows
+            ).encode()
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    """Compress a byte stream into a single gzip member on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,118 @@
+"""
+Perceptual near-duplicate frame skipping for continuous camera feeds
+
+Each frame gets a 64-bit difference hash (dHash) computed on a tiny grayscale
+thumbnail. Frames from the same device (or the same GPS cell when no device
+id is sent) and detection method are compared against that source's recent
+frames; if one is within max_distance bits, its detection result is reused
+instead of running inference again.
+"""
+
+import io
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+
+def dhash(image_bytes: bytes, hash_size: int = 8) -> int:
+    """
+    Difference hash: compare each pixel of a (hash_size+1) x hash_size
+    grayscale thumbnail with its right neighbour
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    if image.format == 'JPEG':
+        # Let libjpeg do most of the downscaling while decoding
+        image.draft('L', (hash_size * 8, hash_size * 8))
+    image = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BOX)
+
+    pixels = np.asarray(image)
+    diff = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(diff).tobytes(), 'big')
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Number of differing bits between two hashes"""
+    return bin(a ^ b).count('1')
+
+
+class FrameIndex:
+    """
+    Recent frame hashes and results per source (device or GPS cell)
+    """
+
+    def __init__(self, max_distance: int = 5, window: int = 8, max_age_seconds: float = 30,
+                 gps_cell_size: float = 1e-4, max_sources: int = 10000):
+        self.max_distance = max_distance
+        self.window = window
+        self.max_age_seconds = max_age_seconds
+        self.gps_cell_size = gps_cell_size  # Degrees; 1e-4 is roughly 11 m
+        self.max_sources = max_sources
+
+        self._frames: "OrderedDict[str, deque]" = OrderedDict()  # source -> (time, hash, result) frames
+        self._skipped: Dict[str, int] = {}
+        self.total_skipped = 0
+
+    def source_key(self, device_id: Optional[str], gps_lat: Optional[float],
+                   gps_lng: Optional[float], detection_method: str) -> Optional[str]:
+        """
+        Device id if given, else the GPS cell, else None (no dedup possible);
+        scoped to the detection method so methods never reuse each other's results
+        """
+        if device_id:
+            return f"{detection_method}:device:{device_id}"
+        if gps_lat is not None and gps_lng is not None:
+            cell_lat = int(gps_lat // self.gps_cell_size)
+            cell_lng = int(gps_lng // self.gps_cell_size)
+            return f"{detection_method}:cell:{cell_lat}:{cell_lng}"
+        return None
+
+    def lookup(self, source: str, frame_hash: int) -> Optional[Any]:
+        """Return the result of the closest recent matching frame, counting the skip"""
+        frames = self._frames.get(source)
+        if not frames:
+            return None
+
+        now = time.monotonic()
+        while frames and now - frames[0][0] > self.max_age_seconds:
+            frames.popleft()
+
+        best = None
+        best_distance = self.max_distance + 1
+        for _, known_hash, result in frames:
+            distance = hamming_distance(frame_hash, known_hash)
+            if distance < best_distance:
+                best, best_distance = result, distance
+
+        if best is not None:
+            self._skipped[source] = self._skipped.get(source, 0) + 1
+            self.total_skipped += 1
+        return best
+
+    def add(self, source: str, frame_hash: int, result: Any):
+        """Remember a frame that went through inference"""
+        frames = self._frames.get(source)
+        if frames is None:
+            frames = self._frames[source] = deque(maxlen=self.window)
+        frames.append((time.monotonic(), frame_hash, result))
+
+        self._frames.move_to_end(source)
+        while len(self._frames) > self.max_sources:
+            evicted, _ = self._frames.popitem(last=False)
+            self._skipped.pop(evicted, None)
+
+    def skipped(self, source: str) -> int:
+        """Inferences skipped so far for a source"""
+        return self._skipped.get(source, 0)
+
+    def stats(self) -> Dict[str, Any]:
+        """Index occupancy and skip counters"""
+        return {
+            "sources": len(self._frames),
+            "max_distance": self.max_distance,
+            "window": self.window,
+            "max_age_seconds": self.max_age_seconds,
+            "total_skipped": self.total_skipped
+        }
@@ -0,0 +1,161 @@
+"""
+Keyset (cursor) pagination for the history endpoints
+
+Pages are ordered by (timestamp_ms, rowid), newest first unless ascending
+order is requested, and each page continues strictly after the last row of
+the previous one, so fetching page 10,000 costs the same as page 1: an index
+seek plus `limit` rows. Cursors are opaque URL-safe strings encoding that
+(timestamp_ms, rowid) position.
+
+Filters are kept as (column, op, value) triples so the same query can also
+run against the Parquet archive tier; when an archive is attached, each page
+merges the hot SQLite rows with the cold archived rows. The hot query and
+the archive manifest lookup share one read transaction, so a compaction
+committing in between cannot make rows appear in both tiers or in neither.
+When the hot rows already fill the page, only archived rows that sort
+before the last of them are looked at, which usually means none.
+"""
+
+import base64
+import heapq
+import sqlite3
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+
+FILTER_OPS = ("=", "<", "<=", ">", ">=")
+
+
+def encode_cursor(timestamp_ms: int, rowid: int) -> str:
+    """Opaque cursor for the position after (timestamp_ms, rowid)"""
+    return base64.urlsafe_b64encode(f"{timestamp_ms}:{rowid}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    """Inverse of encode_cursor; raises ValueError on malformed input"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp_ms, rowid = base64.urlsafe_b64decode(padded.encode()).decode().split(":")
+        return int(timestamp_ms), int(rowid)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+@contextmanager
+def read_snapshot(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """Run several SELECTs against one WAL snapshot (joins an already open transaction)"""
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN")
+    try:
+        yield conn
+    finally:
+        conn.execute("COMMIT")
+
+
+class HistoryQuery:
+    """
+    Filtered, keyset-paginated SELECT over a table with a timestamp_ms column
+    """
+
+    def __init__(self, table: str, columns: Sequence[str], archive=None):
+        self.table = table
+        self.columns = list(columns)
+        self.archive = archive
+        self.filters: List[Tuple[str, str, Any]] = []
+
+    def where(self, column: str, op: str, value: Any) -> "HistoryQuery":
+        """Add an AND-ed `column op value` filter"""
+        if op not in FILTER_OPS:
+            raise ValueError(f"Unsupported filter operator: {op}")
+        self.filters.append((column, op, value))
+        return self
+
+    def equals(self, column: str, value: Any) -> "HistoryQuery":
+        """column = value, skipped when value is None"""
+        if value is not None:
+            self.where(column, "=", value)
+        return self
+
+    def time_range(self, start_ms: Optional[int], end_ms: Optional[int]) -> "HistoryQuery":
+        """start_ms <= timestamp_ms < end_ms; either bound may be open"""
+        if start_ms is not None:
+            self.where("timestamp_ms", ">=", start_ms)
+        if end_ms is not None:
+            self.where("timestamp_ms", "<", end_ms)
+        return self
+
+    def bounding_box(self, min_lat: Optional[float], max_lat: Optional[float],
+                     min_lng: Optional[float], max_lng: Optional[float]) -> "HistoryQuery":
+        """GPS bounding box; each edge is optional"""
+        for column, op, value in (("gps_lat", ">=", min_lat), ("gps_lat", "<=", max_lat),
+                                  ("gps_lng", ">=", min_lng), ("gps_lng", "<=", max_lng)):
+            if value is not None:
+                self.where(column, op, value)
+        return self
+
+    @property
+    def filtered(self) -> bool:
+        """True when any filter has been applied"""
+        return bool(self.filters)
+
+    def page(self, conn: sqlite3.Connection, cursor: Optional[str], limit: int,
+             descending: bool = True) -> Tuple[List[tuple], Optional[str]]:
+        """One page of rows (selected columns only) and the cursor for the next page, if any"""
+        position = decode_cursor(cursor) if cursor else None
+        with read_snapshot(conn):
+            rows = self._hot_page(conn, position, limit + 1, descending)
+            if self.archive is not None:
+                # A full hot page bounds which archived rows could still make the cut
+                bound_ms = rows[-1][-2] if len(rows) > limit else None
+                cold = self.archive.page(conn, self.table, self.columns, self.filters, position, limit + 1,
+                                         descending, bound_ms=bound_ms)
+                if cold:
+                    # Both inputs are sorted on (timestamp_ms, rowid), the last two columns
+                    rows = list(heapq.merge(rows, cold, key=lambda row: (row[-2], row[-1]),
+                                            reverse=descending))[:limit + 1]
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][-2], rows[-1][-1])
+
+        return [tuple(row[:-2]) for row in rows], next_cursor
+
+    def count(self, conn: sqlite3.Connection) -> int:
+        """Rows matching the filters (index-only for indexed filters), across both tiers"""
+        conditions, params = self._where(self.filters)
+        with read_snapshot(conn):
+            total = conn.execute(f"SELECT COUNT(*) FROM {self.table} {conditions}", params).fetchone()[0]
+            if self.archive is not None:
+                total += self.archive.count(conn, self.table, self.filters)
+        return total
+
+    def _hot_page(self, conn: sqlite3.Connection, position: Optional[Tuple[int, int]],
+                  limit: int, descending: bool) -> List[tuple]:
+        conditions, params = self._where(self.filters)
+        if position:
+            timestamp_ms, rowid = position
+            # The first term is an index range; the second breaks ties within one millisecond
+            if descending:
+                keyset = "timestamp_ms <= ? AND (timestamp_ms < ? OR rowid < ?)"
+            else:
+                keyset = "timestamp_ms >= ? AND (timestamp_ms > ? OR rowid > ?)"
+            conditions = f"{conditions} AND ({keyset})" if conditions else f"WHERE {keyset}"
+            params.extend([timestamp_ms, timestamp_ms, rowid])
+
+        direction = "DESC" if descending else "ASC"
+        return conn.execute(f'''
+            SELECT {", ".join(self.columns)}, timestamp_ms, rowid
+            FROM {self.table}
+            {conditions}
+            ORDER BY timestamp_ms {direction}, rowid {direction}
+            LIMIT ?
+        ''', (*params, limit)).fetchall()
+
+    @staticmethod
+    def _where(filters: List[Tuple[str, str, Any]]) -> Tuple[str, List[Any]]:
+        if not filters:
+            return "", []
+        return (f"WHERE {' AND '.join(f'{column} {op} ?' for column, op, _ in filters)}",
+                [value for _, _, value in filters])
@@ -0,0 +1,81 @@
+"""
+Content-addressed image storage for uploads
+
+Uploads are stored byte-for-byte (no decode/re-encode) under their SHA-256:
+
+    uploads/3f/a2/3fa2...e9.jpg
+
+The two levels of two-hex-digit shard directories keep every directory small
+(65,536 leaf directories) no matter how many images accumulate, and identical
+uploads are stored once. Writes happen on a worker thread in the background;
+the final path is known up front, so callers can record it immediately.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Set
+
+
+def sniff_extension(image_bytes: bytes) -> str:
+    """File extension from the image magic bytes"""
+    if image_bytes.startswith(b'\xff\xd8\xff'):
+        return ".jpg"
+    if image_bytes.startswith(b'\x89PNG\r\n\x1a\n'):
+        return ".png"
+    if image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
+        return ".webp"
+    if image_bytes[:6] in (b'GIF87a', b'GIF89a'):
+        return ".gif"
+    return ".img"
+
+
+class ImageStore:
+    """
+    Sharded, content-addressed upload directory with background writes
+    """
+
+    def __init__(self, root: str = "uploads"):
+        self.root = root
+        self._pending: Set[asyncio.Task] = set()
+
+    @staticmethod
+    async def checksum(image_bytes: bytes) -> str:
+        """SHA-256 hex digest of the image bytes, computed off the event loop"""
+        # hashlib releases the GIL on large buffers
+        digest = await asyncio.to_thread(hashlib.sha256, image_bytes)
+        return digest.hexdigest()
+
+    def path_for(self, checksum: str, extension: str = ".jpg") -> str:
+        """Sharded storage path for a checksum"""
+        return os.path.join(self.root, checksum[:2], checksum[2:4], checksum + extension)
+
+    def save_in_background(self, image_bytes: bytes, checksum: str) -> str:
+        """Schedule the original bytes to be written and return the path they will live at"""
+        image_path = self.path_for(checksum, sniff_extension(image_bytes))
+        task = asyncio.create_task(asyncio.to_thread(self._write, image_path, image_bytes))
+        self._pending.add(task)
+        task.add_done_callback(self._write_done)
+        return image_path
+
+    async def drain(self):
+        """Wait for all scheduled writes (used on shutdown)"""
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+    def _write_done(self, task: asyncio.Task):
+        self._pending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Image write failed: {task.exception()}")
+
+    @staticmethod
+    def _write(image_path: str, image_bytes: bytes):
+        """Atomically write image bytes unless identical content is already stored"""
+        if os.path.exists(image_path):
+            return
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        tmp_path = f"{image_path}.{os.getpid()}.{id(image_bytes)}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(image_bytes)
+        os.replace(tmp_path, image_path)
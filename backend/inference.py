@@ -0,0 +1,201 @@
+"""
+Process-pool inference executor for plant disease detection
+
+Keeps a pool of warm worker processes, each holding its own DiseaseDetector,
+so CPU-bound model work never runs on the API event loop.
+
+Request flow:
+1. Image bytes are decoded and resized on a thread (PIL releases the GIL)
+   straight into a shared memory block as uint8 224x224x3 pixels
+2. Only the block name and shape are sent to a worker process, which
+   attaches to the block and runs the vectorized detector over it
+3. The small result dicts come back pickled; the block is then released
+
+Failures are per image: an upload that cannot be decoded (or detected) gets
+its exception in its own result slot, and the rest of the job still runs.
+run_job and detect_batch therefore return a list in which failed slots hold
+the exception instead of a result dict.
+
+Pool size and queue depth bound CPU use and memory; when the queue is full
+new jobs are rejected with InferenceQueueFull instead of piling up.
+"""
+
+import asyncio
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from ml_model import DiseaseDetector
+
+
+class InferenceQueueFull(Exception):
+    """Raised when the executor already has queue_depth jobs in flight"""
+
+
+# One result dict per image, or the exception that image failed with
+SlotResult = Union[Dict[str, Any], Exception]
+
+
+# Worker process state
+_worker_detector: Optional[DiseaseDetector] = None
+
+
+def _init_worker(input_dtype: str):
+    """Load the model once per worker process"""
+    global _worker_detector
+    _worker_detector = DiseaseDetector(input_dtype=np.dtype(input_dtype))
+
+
+def _warm_up() -> int:
+    """Warm-up task; holds its worker briefly so each worker receives exactly one"""
+    time.sleep(0.2)
+    return os.getpid()
+
+
+def _detect_shared(shm_name: str, shape: Tuple[int, ...]) -> List[SlotResult]:
+    """Run detection over pixels stored in the named shared memory block"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        pixels = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        try:
+            try:
+                return _worker_detector.detect_pixels(pixels)
+            except Exception:
+                # Retry image by image so one bad slot does not fail the rest
+                results: List[SlotResult] = []
+                for i in range(len(pixels)):
+                    try:
+                        results.extend(_worker_detector.detect_pixels(pixels[i:i + 1]))
+                    except Exception as e:
+                        results.append(e)
+                return results
+        finally:
+            del pixels  # Release the buffer export before closing
+    finally:
+        shm.close()
+
+
+class InferenceExecutor:
+    """
+    Warm process pool for DiseaseDetector inference
+    """
+
+    def __init__(self, pool_size: Optional[int] = None, queue_depth: Optional[int] = None,
+                 input_dtype: type = np.float32):
+        self.pool_size = pool_size or os.cpu_count() or 2
+        self.queue_depth = queue_depth or self.pool_size * 4
+        self.input_dtype = np.dtype(input_dtype)
+
+        # Decodes uploads into uint8 pixels on the API side
+        self._decoder = DiseaseDetector(input_dtype=np.uint8)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        """Jobs currently queued or running"""
+        return self._pending
+
+    def start(self):
+        """Start the worker processes and wait until each one has loaded its model"""
+        if self._pool is not None:
+            return
+
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.pool_size,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.input_dtype.str,)
+        )
+
+        # One task per worker forces the whole pool to spawn now, not on first request
+        pids = {f.result() for f in [self._pool.submit(_warm_up) for _ in range(self.pool_size)]}
+        print(f"✅ Inference pool ready: {len(pids)} workers, queue depth {self.queue_depth}")
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    async def detect(self, image_bytes: bytes) -> Dict[str, Any]:
+        """Detect disease in a single image"""
+        result = (await self.run_job([image_bytes]))[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def detect_batch(self, images: List[bytes]) -> List[SlotResult]:
+        """
+        Detect disease in many images
+        The batch is split into one vectorized chunk per worker and the chunks
+        run in parallel. Results are returned in input order; images that
+        failed hold their exception.
+        """
+        if not images:
+            return []
+
+        chunk_size = math.ceil(len(images) / self.pool_size)
+        chunks = [images[i:i + chunk_size] for i in range(0, len(images), chunk_size)]
+
+        results = await asyncio.gather(*(self.run_job(chunk) for chunk in chunks))
+        return [result for chunk_results in results for result in chunk_results]
+
+    async def run_job(self, images: List[bytes]) -> List[SlotResult]:
+        """Decode images into shared memory and run one vectorized worker job over all of them"""
+        if self._pool is None:
+            raise RuntimeError("Inference executor is not started")
+        if self._pending >= self.queue_depth:
+            raise InferenceQueueFull(f"Inference queue full ({self.queue_depth} jobs in flight)")
+
+        width, height = self._decoder.INPUT_SIZE
+        shape = (len(images), height, width, 3)
+
+        self._pending += 1
+        try:
+            shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)))
+            try:
+                pixels = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+                try:
+                    errors = await asyncio.to_thread(self._decode_into, images, pixels)
+                finally:
+                    del pixels
+
+                decoded = len(images) - len(errors)
+                detected: List[SlotResult] = []
+                if decoded:
+                    loop = asyncio.get_running_loop()
+                    detected = await loop.run_in_executor(
+                        self._pool, _detect_shared, shm.name, (decoded, *shape[1:])
+                    )
+
+                # Put decode failures back in their input positions
+                detected_iter = iter(detected)
+                return [errors[i] if i in errors else next(detected_iter) for i in range(len(images))]
+            finally:
+                shm.close()
+                shm.unlink()
+        finally:
+            self._pending -= 1
+
+    def _decode_into(self, images: List[bytes], pixels: np.ndarray) -> Dict[int, Exception]:
+        """
+        Decode and resize the images into consecutive slots of the shared pixel array
+        Images that fail to decode are skipped; returns their errors by input index.
+        """
+        errors: Dict[int, Exception] = {}
+        slot = 0
+        for i, image_bytes in enumerate(images):
+            try:
+                self._decoder.preprocess_image(self._decoder.load_image(image_bytes), out=pixels[slot])
+            except Exception as e:
+                errors[i] = e
+                continue
+            slot += 1
+        return errors
@@ -1,17 +1,16 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, WebSocket, WebSocketDisconnect, BackgroundTasks
+from fastapi import FastAPI, HTTPException, UploadFile, File, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
 import numpy as np
 import cv2
-import io
-from PIL import Image
 import base64
+import io
+from PIL import Image, UnidentifiedImageError
 import asyncio
 import random
-import json
 import sqlite3
 import os
 import logging
@@ -19,9 +18,28 @@ from enum import Enum
 import uvicorn
 from pathlib import Path
 import requests
-import serial
 import time
 import threading
+import uuid
+from inference import InferenceExecutor, InferenceQueueFull
+from batching import MicroBatcher
+from result_cache import DetectionCache
+from frame_dedup import FrameIndex, dhash
+from cascade import HybridCascade
+from image_store import ImageStore
+from database import Database
+from write_behind import WriteBehindWriter
+from migrations import migrate
+from history import HistoryQuery, decode_cursor, read_snapshot
+from archive import ParquetArchive
+from connections import ConnectionManager
+from events import EventBus
+from actuator import SerialActuator, ActuatorError, ActuatorQueueFull
+from scheduler import SprayScheduler, SprayJob
+import wire
+from export import EXPORT_FORMATS, stream_rows, encode_rows, gzip_stream
+from aggregates import read_counter, most_common
+from rollups import RESOLUTIONS as ROLLUP_RESOLUTIONS, USAGE_GROUPS, DISEASE_GROUPS, usage_series, disease_totals
 
 app = FastAPI(
     title="Intelligent Pesticide Control System API",
@@ -95,7 +113,7 @@ class DetectionResult(BaseModel):
     detection_id: str
     disease_type: DiseaseType
     plant_type: PlantType
-    confidence: float
+    confidence: float  # Percent (0-100) whichever detector produced it
     severity: SeverityLevel
     affected_area_percentage: float
     recommendation: str
@@ -103,9 +121,20 @@ class DetectionResult(BaseModel):
     spray_time_seconds: int
     detection_method: DetectionMethod
     image_path: Optional[str] = None
+    image_checksum: Optional[str] = None
     gps_coordinates: Optional[Dict[str, float]] = None
     weather_conditions: Optional[Dict[str, Any]] = None
     timestamp: datetime
+    skipped_inferences: Optional[int] = None  # Near-duplicate frames served from this source so far
+
+class BatchDetectionFailure(BaseModel):
+    index: int
+    filename: Optional[str] = None
+    error: str
+
+class BatchDetectionResponse(BaseModel):
+    results: List[DetectionResult]
+    failed: List[BatchDetectionFailure] = []
 
 class SprayEvent(BaseModel):
     spray_id: str
@@ -165,104 +194,180 @@ class IoTDevice(BaseModel):
     location: Dict[str, float]
 
 # Database initialization
-DATABASE_PATH = "pesticide_control.db"
-
-def init_database():
-    """Initialize SQLite database with required tables"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    # Create tables
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS detections (
-            detection_id TEXT PRIMARY KEY,
-            disease_type TEXT NOT NULL,
-            plant_type TEXT NOT NULL,
-            confidence REAL NOT NULL,
-            severity TEXT NOT NULL,
-            affected_area_percentage REAL NOT NULL,
-            recommendation TEXT NOT NULL,
-            pesticide_dosage REAL NOT NULL,
-            spray_time_seconds INTEGER NOT NULL,
-            detection_method TEXT NOT NULL,
-            image_path TEXT,
-            gps_lat REAL,
-            gps_lng REAL,
-            weather_temp REAL,
-            weather_humidity REAL,
-            weather_wind_speed REAL,
-            timestamp DATETIME NOT NULL
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS spray_events (
-            spray_id TEXT PRIMARY KEY,
-            zone_id TEXT NOT NULL,
-            detection_id TEXT,
-            spray_duration INTEGER NOT NULL,
-            pesticide_type TEXT NOT NULL,
-            dosage REAL NOT NULL,
-            success BOOLEAN NOT NULL,
-            gps_lat REAL,
-            gps_lng REAL,
-            timestamp DATETIME NOT NULL,
-            FOREIGN KEY (detection_id) REFERENCES detections (detection_id)
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS zones (
-            zone_id TEXT PRIMARY KEY,
-            health_score REAL NOT NULL,
-            infection_rate REAL NOT NULL,
-            last_treated DATETIME,
-            treatment_needed BOOLEAN NOT NULL,
-            gps_lat REAL NOT NULL,
-            gps_lng REAL NOT NULL,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS weather_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            temperature REAL NOT NULL,
-            humidity REAL NOT NULL,
-            wind_speed REAL NOT NULL,
-            rain_probability REAL NOT NULL,
-            uv_index INTEGER NOT NULL,
-            conditions TEXT NOT NULL,
-            spray_suitable BOOLEAN NOT NULL,
-            timestamp DATETIME NOT NULL
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    print("✅ Database initialized successfully")
+DATABASE_PATH = os.getenv("DATABASE_PATH", "pesticide_control.db")
+DATABASE_READER_POOL_SIZE = int(os.getenv("DATABASE_READER_POOL_SIZE", 4))
+database = Database(DATABASE_PATH, reader_pool_size=DATABASE_READER_POOL_SIZE)
 
-# Initialize database on startup
-init_database()
+# Write-behind batching of detection / spray event inserts
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", 500))
+WRITE_BEHIND_FLUSH_MS = float(os.getenv("WRITE_BEHIND_FLUSH_MS", 250))
+write_behind = WriteBehindWriter(database, max_batch_size=WRITE_BEHIND_MAX_BATCH, flush_interval_ms=WRITE_BEHIND_FLUSH_MS)
 
-# Serial communication setup
-SERIAL_PORT = os.getenv("ARDUINO_SERIAL_PORT", "COM3")
-SERIAL_BAUD = 9600
-serial_connection = None
+# Initialize database on startup (not at import: inference workers re-import this module)
+@app.on_event("startup")
+async def startup_database():
+    database.start()
+    version = await database.write(migrate)
+    write_behind.start()
+    print(f"✅ Database initialized successfully (schema v{version})")
 
-def init_serial_connection():
-    """Initialize serial connection to Arduino"""
-    global serial_connection
+# Parquet archive tier for cold rows (ARCHIVE_AFTER_DAYS=0 disables automatic compaction)
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", 0))
+ARCHIVE_INTERVAL_HOURS = float(os.getenv("ARCHIVE_INTERVAL_HOURS", 24))
+archive = ParquetArchive(ARCHIVE_DIR)
+archive_task = None
+
+def compact_archive() -> int:
+    """Move rows older than ARCHIVE_AFTER_DAYS into the archive on a dedicated connection"""
+    conn = database.connect()
     try:
-        serial_connection = serial.Serial(SERIAL_PORT, SERIAL_BAUD, timeout=1)
-        print(f"✅ Serial connection established on {SERIAL_PORT}")
-    except Exception as e:
-        print(f"❌ Failed to establish serial connection: {e}")
-        serial_connection = None
+        return archive.compact(conn, ARCHIVE_AFTER_DAYS)
+    finally:
+        conn.close()
+
+async def run_archive_compaction():
+    """Compact on startup, then every ARCHIVE_INTERVAL_HOURS"""
+    while True:
+        try:
+            await asyncio.to_thread(compact_archive)
+        except Exception as e:
+            logging.error(f"Archive compaction failed: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_HOURS * 3600)
+
+@app.on_event("startup")
+async def start_archive_compaction():
+    global archive_task
+    if ARCHIVE_AFTER_DAYS > 0:
+        archive_task = asyncio.create_task(run_archive_compaction())
+
+@app.on_event("shutdown")
+async def stop_archive_compaction():
+    if archive_task is not None:
+        archive_task.cancel()
+
+# Serial actuator: its own I/O thread owns the port, spray commands are acknowledged by the ESP32
+SERIAL_PORT = os.getenv("ARDUINO_SERIAL_PORT", "COM3")
+SERIAL_BAUD = int(os.getenv("ARDUINO_SERIAL_BAUD", 115200))
+ACTUATOR_QUEUE_SIZE = int(os.getenv("ACTUATOR_QUEUE_SIZE", 32))
+ACTUATOR_ACK_TIMEOUT_SECONDS = float(os.getenv("ACTUATOR_ACK_TIMEOUT_SECONDS", 2))
+ACTUATOR_RETRIES = int(os.getenv("ACTUATOR_RETRIES", 2))
+ACTUATOR_RECONNECT_SECONDS = float(os.getenv("ACTUATOR_RECONNECT_SECONDS", 5))
+ACTUATOR_MAX_RUN_SECONDS = int(os.getenv("ACTUATOR_MAX_RUN_SECONDS", 60))  # The controller NAKs longer RUN commands
+actuator = SerialActuator(
+    port=SERIAL_PORT,
+    baud=SERIAL_BAUD,
+    queue_size=ACTUATOR_QUEUE_SIZE,
+    ack_timeout=ACTUATOR_ACK_TIMEOUT_SECONDS,
+    retries=ACTUATOR_RETRIES,
+    reconnect_interval=ACTUATOR_RECONNECT_SECONDS
+)
+
+# Start the actuator service on startup, in the API process only
+@app.on_event("startup")
+async def start_actuator():
+    actuator.start()
+
+# Durable spray job scheduler; dispatches due jobs to the actuator, deferring in bad weather
+SCHEDULER_MAX_WIND_SPEED = float(os.getenv("SCHEDULER_MAX_WIND_SPEED", 15))
+SCHEDULER_MAX_RAIN_PROBABILITY = float(os.getenv("SCHEDULER_MAX_RAIN_PROBABILITY", 40))
+SCHEDULER_DEFER_MINUTES = float(os.getenv("SCHEDULER_DEFER_MINUTES", 30))
+SCHEDULER_MAX_DEFERRALS = int(os.getenv("SCHEDULER_MAX_DEFERRALS", 12))
+SCHEDULER_RETRY_MINUTES = float(os.getenv("SCHEDULER_RETRY_MINUTES", 5))
+SCHEDULER_MAX_ATTEMPTS = int(os.getenv("SCHEDULER_MAX_ATTEMPTS", 3))
+spray_scheduler = SprayScheduler(
+    database,
+    execute=lambda job: run_scheduled_spray(job),
+    weather=lambda: get_current_weather(),
+    max_wind_speed=SCHEDULER_MAX_WIND_SPEED,
+    max_rain_probability=SCHEDULER_MAX_RAIN_PROBABILITY,
+    defer_minutes=SCHEDULER_DEFER_MINUTES,
+    max_deferrals=SCHEDULER_MAX_DEFERRALS,
+    retry_minutes=SCHEDULER_RETRY_MINUTES,
+    max_attempts=SCHEDULER_MAX_ATTEMPTS
+)
+
+@app.on_event("startup")
+async def start_spray_scheduler():
+    """Reload unfinished jobs once the database and actuator are up"""
+    await spray_scheduler.start()
+
+@app.on_event("shutdown")
+async def stop_spray_scheduler():
+    await spray_scheduler.stop()
+
+@app.on_event("shutdown")
+async def stop_actuator():
+    """Fail queued commands and release the serial port"""
+    await asyncio.to_thread(actuator.stop)
+
+# Inference executor setup
+INFERENCE_POOL_SIZE = int(os.getenv("INFERENCE_POOL_SIZE", os.cpu_count() or 2))
+INFERENCE_QUEUE_DEPTH = int(os.getenv("INFERENCE_QUEUE_DEPTH", INFERENCE_POOL_SIZE * 4))
+inference_executor = InferenceExecutor(pool_size=INFERENCE_POOL_SIZE, queue_depth=INFERENCE_QUEUE_DEPTH)
+
+# Micro-batching of concurrent single-image detections
+DETECT_BATCH_MAX_SIZE = int(os.getenv("DETECT_BATCH_MAX_SIZE", 16))
+DETECT_BATCH_MAX_WAIT_MS = float(os.getenv("DETECT_BATCH_MAX_WAIT_MS", 10))
+DETECT_BATCH_QUEUE_DEPTH = int(os.getenv("DETECT_BATCH_QUEUE_DEPTH", 256))
+micro_batcher = MicroBatcher(
+    inference_executor,
+    max_batch_size=DETECT_BATCH_MAX_SIZE,
+    max_wait_ms=DETECT_BATCH_MAX_WAIT_MS,
+    queue_depth=DETECT_BATCH_QUEUE_DEPTH
+)
 
-# Initialize serial connection
-init_serial_connection()
+# Detection result cache (content hash + method)
+DETECTION_CACHE_SIZE = int(os.getenv("DETECTION_CACHE_SIZE", 1024))
+DETECTION_CACHE_TTL_SECONDS = float(os.getenv("DETECTION_CACHE_TTL_SECONDS", 3600))
+detection_cache = DetectionCache(max_entries=DETECTION_CACHE_SIZE, ttl_seconds=DETECTION_CACHE_TTL_SECONDS)
+
+# Near-duplicate frame skipping for camera feeds
+FRAME_DEDUP_MAX_DISTANCE = int(os.getenv("FRAME_DEDUP_MAX_DISTANCE", 5))
+FRAME_DEDUP_WINDOW = int(os.getenv("FRAME_DEDUP_WINDOW", 8))
+FRAME_DEDUP_MAX_AGE_SECONDS = float(os.getenv("FRAME_DEDUP_MAX_AGE_SECONDS", 30))
+frame_index = FrameIndex(
+    max_distance=FRAME_DEDUP_MAX_DISTANCE,
+    window=FRAME_DEDUP_WINDOW,
+    max_age_seconds=FRAME_DEDUP_MAX_AGE_SECONDS
+)
+
+@app.on_event("startup")
+async def start_inference_executor():
+    """Spawn warm inference workers before serving requests"""
+    await asyncio.to_thread(inference_executor.start)
+    micro_batcher.start()
+
+@app.on_event("shutdown")
+async def stop_inference_executor():
+    """Drain pending detections and stop inference workers"""
+    await micro_batcher.stop()
+    await asyncio.to_thread(inference_executor.shutdown)
+
+# Upload decode failures: the client's fault (400), never escalated to Gemini
+INVALID_IMAGE_ERRORS = (UnidentifiedImageError, Image.DecompressionBombError)
+
+# Hybrid detection: escalate from the local model to Gemini only when needed
+HYBRID_MODE = os.getenv("HYBRID_MODE", "cascade")
+HYBRID_CONFIDENCE_THRESHOLD = float(os.getenv("HYBRID_CONFIDENCE_THRESHOLD", 85))  # Percent
+HYBRID_ESCALATE_SEVERITIES = os.getenv("HYBRID_ESCALATE_SEVERITIES", "high,critical")
+HYBRID_LATENCY_BUDGET_MS = float(os.getenv("HYBRID_LATENCY_BUDGET_MS", 1500))
+hybrid_cascade = HybridCascade(
+    confidence_threshold=HYBRID_CONFIDENCE_THRESHOLD,
+    escalate_severities=[s.strip() for s in HYBRID_ESCALATE_SEVERITIES.split(",") if s.strip()],
+    mode=HYBRID_MODE,
+    latency_budget_ms=HYBRID_LATENCY_BUDGET_MS,
+    client_errors=INVALID_IMAGE_ERRORS
+)
+
+# Content-addressed upload storage
+UPLOADS_DIR = os.getenv("UPLOADS_DIR", "uploads")
+image_store = ImageStore(root=UPLOADS_DIR)
+
+@app.on_event("shutdown")
+async def drain_image_store():
+    """Finish background image writes"""
+    await image_store.drain()
 
 # Mock database (for backward compatibility)
 zones_db = {
@@ -308,26 +413,77 @@ zones_db = {
     ),
 }
 
-# WebSocket connections manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+# WebSocket fan-out with per-client send queues
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", 256))
+WS_SLOW_CLIENT_POLICY = os.getenv("WS_SLOW_CLIENT_POLICY", "drop_oldest")
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", 10))
+manager = ConnectionManager(
+    queue_size=WS_SEND_QUEUE_SIZE,
+    slow_client_policy=WS_SLOW_CLIENT_POLICY,
+    send_timeout=WS_SEND_TIMEOUT_SECONDS
+)
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+# Pub/sub bus behind /ws: every producer publishes here, each event is serialized once
+EVENT_BUS_RECENT_EVENTS = int(os.getenv("EVENT_BUS_RECENT_EVENTS", 20))
+WS_COALESCE_TICK_MS = float(os.getenv("WS_COALESCE_TICK_MS", 100))
+SIMULATED_TELEMETRY_INTERVAL_SECONDS = float(os.getenv("SIMULATED_TELEMETRY_INTERVAL_SECONDS", 5))
+event_bus = EventBus(recent_events=EVENT_BUS_RECENT_EVENTS, coalesce_tick_ms=WS_COALESCE_TICK_MS)
+telemetry_task = None
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+def publish_zone_update(zone: ZoneStatus):
+    """Publish a zone's current state (retained for snapshots)"""
+    event_bus.publish("zones", {"event": "zone_update", **zone.model_dump(mode="json")},
+                      zone_id=zone.zone_id, key=zone.zone_id)
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+def publish_detection(detection: DetectionResult):
+    """Publish a summary of an accepted detection"""
+    event_bus.publish("detections", {
+        "event": "detection",
+        "detection_id": detection.detection_id,
+        "disease_type": detection.disease_type.value,
+        "plant_type": detection.plant_type.value,
+        "severity": detection.severity.value,
+        "confidence": detection.confidence,
+        "affected_area_percentage": detection.affected_area_percentage,
+        "detection_method": detection.detection_method.value,
+        "gps_coordinates": detection.gps_coordinates,
+        "timestamp": detection.timestamp.isoformat()
+    })
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+async def simulate_telemetry():
+    """Mock device and weather telemetry until real device reporting exists"""
+    while True:
+        await asyncio.sleep(SIMULATED_TELEMETRY_INTERVAL_SECONDS)
+        if random.random() < 0.5:
+            device_id = f"device_{random.randint(1, 8)}"
+            event_bus.publish("devices", {
+                "event": "device_status",
+                "device_id": device_id,
+                "status": random.choice(["online", "offline"]),
+                "battery": random.uniform(20, 100)
+            }, key=device_id)
+        else:
+            event_bus.publish("weather", {
+                "event": "weather_update",
+                "temperature": random.uniform(25, 32),
+                "humidity": random.uniform(60, 75)
+            }, key="current")
 
-manager = ConnectionManager()
+@app.on_event("startup")
+async def start_event_bus():
+    """Seed retained zone state, start frame coalescing and simulated telemetry"""
+    global telemetry_task
+    event_bus.start()
+    for zone in zones_db.values():
+        publish_zone_update(zone)
+    if SIMULATED_TELEMETRY_INTERVAL_SECONDS > 0:
+        telemetry_task = asyncio.create_task(simulate_telemetry())
+
+@app.on_event("shutdown")
+async def stop_event_bus():
+    if telemetry_task is not None:
+        telemetry_task.cancel()
+    await event_bus.stop()
 
 # API Endpoints
 @app.get("/")
@@ -355,48 +511,202 @@ async def detect_disease(
     file: UploadFile = File(...),
     gps_lat: Optional[float] = None,
     gps_lng: Optional[float] = None,
-    detection_method: DetectionMethod = DetectionMethod.HYBRID
+    detection_method: DetectionMethod = DetectionMethod.HYBRID,
+    device_id: Optional[str] = None
 ):
     """
     Advanced disease detection with multiple methods and data logging
+    Repeated uploads of the same image with the same method are served from
+    the result cache; identical concurrent uploads share one detection run.
+    Frames perceptually close to a recent frame from the same device (or GPS
+    cell), sent with the same method, reuse that frame's result without
+    running inference.
     """
+    # Reject non-images before anything is cached, stored or persisted
+    contents = await file.read()
+    try:
+        await asyncio.to_thread(verify_image, contents)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail="Uploaded file is not a readable image") from e
+    
     try:
-        # Read and process image
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
+        # Near-duplicate check against this source's recent frames
+        frame_source = frame_index.source_key(device_id, gps_lat, gps_lng, detection_method.value)
+        if frame_source is not None:
+            frame_hash = await asyncio.to_thread(dhash, contents)
+            previous = frame_index.lookup(frame_source, frame_hash)
+            if previous is not None:
+                return previous.model_copy(update={"skipped_inferences": frame_index.skipped(frame_source)})
+        
+        checksum = await image_store.checksum(contents)
+        cache_key = detection_cache.key_for(checksum, detection_method.value)
+        result = await detection_cache.get_or_compute(
+            cache_key,
+            lambda: run_detection(contents, checksum, gps_lat, gps_lng, detection_method)
+        )
         
-        # Save image for future reference
-        detection_id = f"det_{int(time.time() * 1000)}"
-        image_path = f"uploads/{detection_id}.jpg"
-        os.makedirs("uploads", exist_ok=True)
-        image.save(image_path)
+        if frame_source is not None:
+            frame_index.add(frame_source, frame_hash, result)
+            return result.model_copy(update={"skipped_inferences": frame_index.skipped(frame_source)})
         
-        # Get weather data
+        return result
+        
+    except InferenceQueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Detection busy: {str(e)}")
+    except INVALID_IMAGE_ERRORS as e:
+        raise HTTPException(status_code=400, detail="Uploaded file is not a readable image") from e
+    except Exception as e:
+        logging.error(f"Disease detection failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Detection failed: {str(e)}")
+
+def verify_image(contents: bytes):
+    """Check that the bytes are a readable image without decoding the pixels"""
+    with Image.open(io.BytesIO(contents)) as image:
+        image.verify()
+
+async def run_detection(
+    contents: bytes,
+    checksum: str,
+    gps_lat: Optional[float],
+    gps_lng: Optional[float],
+    detection_method: DetectionMethod
+) -> DetectionResult:
+    """Store the upload, run detection and log the result"""
+    # Save the original bytes for future reference, in the background
+    detection_id = f"det_{uuid.uuid4().hex}"  # Concurrent requests share milliseconds
+    image_path = image_store.save_in_background(contents, checksum)
+    
+    # Get weather data
+    weather_data = await get_current_weather()
+    
+    # Enhanced disease detection with multiple algorithms
+    if detection_method == DetectionMethod.GEMINI:
+        result = await detect_with_gemini(contents, detection_id)
+    elif detection_method == DetectionMethod.ML_MODEL:
+        result = await detect_with_ml_model(contents, detection_id)
+    else:  # HYBRID
+        result = await detect_hybrid(contents, detection_id)
+    
+    # Add additional data
+    result.gps_coordinates = {"lat": gps_lat, "lng": gps_lng} if gps_lat and gps_lng else None
+    result.weather_conditions = weather_data
+    result.image_path = image_path
+    result.image_checksum = checksum
+    
+    # Save to database
+    await save_detection_to_db(result)
+    
+    return result
+
+@app.post("/api/detect/batch", response_model=BatchDetectionResponse)
+async def detect_disease_batch(
+    files: List[UploadFile] = File(...),
+    gps_lat: Optional[float] = None,
+    gps_lng: Optional[float] = None
+):
+    """
+    Batched disease detection for multi-image uploads (e.g. a field camera pass).
+    All images are scored in one vectorized pass of the local ML model and
+    every row is written to the database in a single transaction. Files that
+    cannot be decoded are reported under "failed"; the rest are still saved.
+    """
+    try:
+        contents = [await file.read() for file in files]
+        
+        # Weather is shared across the whole pass
         weather_data = await get_current_weather()
         
-        # Enhanced disease detection with multiple algorithms
-        if detection_method == DetectionMethod.GEMINI:
-            result = await detect_with_gemini(image, detection_id)
-        elif detection_method == DetectionMethod.ML_MODEL:
-            result = await detect_with_ml_model(image, detection_id)
-        else:  # HYBRID
-            result = await detect_hybrid(image, detection_id)
+        ml_results, checksums = await asyncio.gather(
+            inference_executor.detect_batch(contents),
+            asyncio.gather(*(image_store.checksum(image_bytes) for image_bytes in contents))
+        )
         
-        # Add additional data
-        result.gps_coordinates = {"lat": gps_lat, "lng": gps_lng} if gps_lat and gps_lng else None
-        result.weather_conditions = weather_data
-        result.image_path = image_path
+        results = []
+        failed = []
+        for i, (file, image_bytes, checksum, ml_result) in enumerate(zip(files, contents, checksums, ml_results)):
+            if isinstance(ml_result, Exception):
+                logging.error(f"Batch detection failed for {file.filename}: {ml_result}")
+                failed.append(BatchDetectionFailure(index=i, filename=file.filename, error=str(ml_result)))
+                continue
+            
+            result = ml_result_to_detection(ml_result, f"det_{uuid.uuid4().hex}")
+            result.gps_coordinates = {"lat": gps_lat, "lng": gps_lng} if gps_lat and gps_lng else None
+            result.weather_conditions = weather_data
+            # Save original uploads for future reference, in the background
+            result.image_path = image_store.save_in_background(image_bytes, checksum)
+            result.image_checksum = checksum
+            results.append(result)
         
-        # Save to database
-        await save_detection_to_db(result)
+        # Save all rows in one transaction
+        if results:
+            await save_detections_to_db(results)
         
-        return result
+        return BatchDetectionResponse(results=results, failed=failed)
         
+    except InferenceQueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Detection busy: {str(e)}")
     except Exception as e:
-        logging.error(f"Disease detection failed: {e}")
-        raise HTTPException(status_code=500, detail=f"Detection failed: {str(e)}")
+        logging.error(f"Batch disease detection failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Batch detection failed: {str(e)}")
+
+# Local ML model labels -> API disease types
+ML_DISEASE_MAP = {
+    "Powdery Mildew": DiseaseType.POWDERY_MILDEW,
+    "Leaf Spot": DiseaseType.LEAF_SPOT,
+    "Rust": DiseaseType.RUST,
+    "Blight": DiseaseType.BLIGHT,
+    "Bacterial Spot": DiseaseType.BACTERIAL_SPOT,
+    "Early Blight": DiseaseType.BLIGHT,
+    "Late Blight": DiseaseType.BLIGHT,
+    "Leaf Mold": DiseaseType.LEAF_SPOT,
+    "Healthy": DiseaseType.HEALTHY,
+}
+
+def ml_result_to_detection(ml_result: Dict[str, Any], detection_id: str) -> DetectionResult:
+    """Convert a DiseaseDetector result dict into a DetectionResult"""
+    disease_type = ML_DISEASE_MAP.get(ml_result["disease"], DiseaseType.LEAF_SPOT)
+    treatment = ml_result["treatment"]
+    affected_area = ml_result["affected_area_percentage"]
+    
+    if disease_type == DiseaseType.HEALTHY:
+        recommendation = "No treatment needed. Continue regular monitoring."
+        spray_time = 0
+    else:
+        recommendation = (
+            f"Apply {treatment['pesticide']} at {treatment['dosage']}L/hectare, "
+            f"{treatment['frequency'].lower()} ({treatment['method']})"
+        )
+        # Scale spray time with the affected area (3-15 seconds)
+        spray_time = int(round(3 + min(affected_area, 45) / 45 * 12))
+    
+    return DetectionResult(
+        detection_id=detection_id,
+        disease_type=disease_type,
+        plant_type=PlantType.OTHER,
+        confidence=ml_result["confidence"],  # DiseaseDetector reports a percentage
+        severity=SeverityLevel(ml_result["severity"]),
+        affected_area_percentage=affected_area,
+        recommendation=recommendation,
+        pesticide_dosage=treatment["dosage"],
+        spray_time_seconds=spray_time,
+        detection_method=DetectionMethod.ML_MODEL,
+        timestamp=datetime.now()
+    )
 
-async def detect_with_gemini(image: Image.Image, detection_id: str) -> DetectionResult:
+@app.get("/api/inference/stats")
+async def get_inference_stats():
+    """Micro-batching and inference pool statistics for tuning"""
+    return {
+        "pool_size": inference_executor.pool_size,
+        "executor_queue_depth": inference_executor.queue_depth,
+        "batching": micro_batcher.stats(),
+        "result_cache": detection_cache.stats(),
+        "frame_dedup": frame_index.stats(),
+        "hybrid_cascade": hybrid_cascade.stats(),
+        "write_behind": write_behind.stats()
+    }
+
+async def detect_with_gemini(image_bytes: bytes, detection_id: str) -> DetectionResult:
     """Detect disease using Gemini API"""
     # This would integrate with the Gemini API
     # For now, return enhanced mock data
@@ -431,7 +741,7 @@ async def detect_with_gemini(image: Image.Image, detection_id: str) -> Detection
         detection_id=detection_id,
         disease_type=detected_disease,
         plant_type=detected_plant,
-        confidence=random.uniform(85, 99),
+        confidence=random.uniform(85, 99),  # Percent, like the local model
         severity=severity,
         affected_area_percentage=affected_area,
         recommendation=recommendation,
@@ -441,17 +751,17 @@ async def detect_with_gemini(image: Image.Image, detection_id: str) -> Detection
         timestamp=datetime.now()
     )
 
-async def detect_with_ml_model(image: Image.Image, detection_id: str) -> DetectionResult:
-    """Detect disease using local ML model"""
-    # This would use TensorFlow/PyTorch model
-    # For now, return enhanced mock data
-    return await detect_with_gemini(image, detection_id)  # Placeholder
+async def detect_with_ml_model(image_bytes: bytes, detection_id: str) -> DetectionResult:
+    """Detect disease using local ML model, batched with concurrent requests"""
+    ml_result = await micro_batcher.detect(image_bytes)
+    return ml_result_to_detection(ml_result, detection_id)
 
-async def detect_hybrid(image: Image.Image, detection_id: str) -> DetectionResult:
-    """Hybrid detection using both Gemini and ML model"""
-    # This would combine results from both methods
-    # For now, return enhanced mock data
-    return await detect_with_gemini(image, detection_id)  # Placeholder
+async def detect_hybrid(image_bytes: bytes, detection_id: str) -> DetectionResult:
+    """Local ML model first; Gemini only for low-confidence or high-stakes results (see cascade.py)"""
+    return await hybrid_cascade.detect(
+        lambda: detect_with_ml_model(image_bytes, detection_id),
+        lambda: detect_with_gemini(image_bytes, detection_id)
+    )
 
 async def get_current_weather() -> Dict[str, Any]:
     """Get current weather data"""
@@ -469,163 +779,200 @@ async def get_current_weather() -> Dict[str, Any]:
     except:
         return {}
 
-async def save_detection_to_db(detection: DetectionResult):
-    """Save detection result to database"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO detections (
-            detection_id, disease_type, plant_type, confidence, severity,
-            affected_area_percentage, recommendation, pesticide_dosage,
-            spray_time_seconds, detection_method, image_path,
-            gps_lat, gps_lng, weather_temp, weather_humidity, weather_wind_speed,
-            timestamp
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
+def to_epoch_ms(timestamp: datetime) -> int:
+    """Epoch milliseconds for the indexed timestamp_ms columns"""
+    return int(timestamp.timestamp() * 1000)
+
+INSERT_DETECTION_SQL = '''
+    INSERT INTO detections (
+        detection_id, disease_type, plant_type, confidence, severity,
+        affected_area_percentage, recommendation, pesticide_dosage,
+        spray_time_seconds, detection_method, image_path, image_checksum,
+        gps_lat, gps_lng, weather_temp, weather_humidity, weather_wind_speed,
+        timestamp, timestamp_ms
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def detection_to_row(detection: DetectionResult) -> tuple:
+    """Flatten a DetectionResult into a detections table row"""
+    return (
         detection.detection_id, detection.disease_type.value, detection.plant_type.value,
         detection.confidence, detection.severity.value, detection.affected_area_percentage,
         detection.recommendation, detection.pesticide_dosage, detection.spray_time_seconds,
-        detection.detection_method.value, detection.image_path,
+        detection.detection_method.value, detection.image_path, detection.image_checksum,
         detection.gps_coordinates.get("lat") if detection.gps_coordinates else None,
         detection.gps_coordinates.get("lng") if detection.gps_coordinates else None,
         detection.weather_conditions.get("temperature") if detection.weather_conditions else None,
         detection.weather_conditions.get("humidity") if detection.weather_conditions else None,
         detection.weather_conditions.get("wind_speed") if detection.weather_conditions else None,
-        detection.timestamp
-    ))
+        detection.timestamp, to_epoch_ms(detection.timestamp)
+    )
+
+async def save_detection_to_db(detection: DetectionResult):
+    """Write detection result in the next batched database write; returns once it is committed"""
+    await write_behind.enqueue(INSERT_DETECTION_SQL, detection_to_row(detection))
+    publish_detection(detection)
+
+async def save_detections_to_db(detections: List[DetectionResult]):
+    """Write a batch of detection results in the same transaction; returns once they are committed"""
+    await write_behind.enqueue_many(INSERT_DETECTION_SQL, [detection_to_row(d) for d in detections])
+    for detection in detections:
+        publish_detection(detection)
+
+async def run_spray(command: SprayCommand, seq: Optional[int] = None) -> Dict[str, Any]:
+    """Drive the sprayer for one zone, record the spray event and publish zone updates"""
+    # Create spray event
+    spray_id = f"spray_{uuid.uuid4().hex}"
+    spray_event = SprayEvent(
+        spray_id=spray_id,
+        zone_id=command.zone_id,
+        spray_duration=command.duration * 60,  # Convert minutes to seconds
+        pesticide_type=command.pesticide_type,
+        dosage=command.dosage,
+        success=False,
+        timestamp=datetime.now()
+    )
+    
+    # Send command to Arduino via serial
+    success = await send_serial_command(f"RUN:{command.duration * 60}", seq=seq)
+    spray_event.success = success
+    
+    # Queue spray event for the next batched database write
+    await save_spray_event_to_db(spray_event)
     
-    conn.commit()
-    conn.close()
+    # Update zone status
+    zone = zones_db[command.zone_id]
+    zone.last_treated = datetime.now()
+    zone.treatment_needed = False
+    zone.health_score = min(95, zone.health_score + random.uniform(10, 20))
+    zone.infection_rate = max(5, zone.infection_rate - random.uniform(15, 25))
+    
+    # Publish to WebSocket subscribers
+    event_bus.publish("sprays", {
+        "event": "spray_started",
+        "spray_id": spray_id,
+        "zone_id": command.zone_id,
+        "dosage": command.dosage,
+        "duration": command.duration,
+        "automatic": command.automatic,
+        "success": success
+    }, zone_id=command.zone_id)
+    publish_zone_update(zone)
+    
+    return {
+        "status": "success" if success else "partial",
+        "spray_id": spray_id,
+        "message": f"Spraying initiated for zone {command.zone_id}",
+        "estimated_completion": datetime.now() + timedelta(minutes=command.duration),
+        "serial_connected": actuator.connected
+    }
 
 @app.post("/api/spray")
-async def control_spray(command: SprayCommand, background_tasks: BackgroundTasks):
+async def control_spray(command: SprayCommand):
     """Advanced pesticide spraying control with serial communication"""
+    # Validate zone
+    if command.zone_id not in zones_db:
+        raise HTTPException(status_code=404, detail="Zone not found")
+    validate_spray_duration(command.duration)
+    
     try:
-        # Validate zone
-        if command.zone_id not in zones_db:
-            raise HTTPException(status_code=404, detail="Zone not found")
-        
-        # Create spray event
-        spray_id = f"spray_{int(time.time() * 1000)}"
-        spray_event = SprayEvent(
-            spray_id=spray_id,
-            zone_id=command.zone_id,
-            spray_duration=command.duration * 60,  # Convert minutes to seconds
-            pesticide_type=command.pesticide_type,
-            dosage=command.dosage,
-            success=False,
-            timestamp=datetime.now()
-        )
-        
-        # Send command to Arduino via serial
-        success = await send_serial_command(f"RUN:{command.duration * 60}")
-        spray_event.success = success
-        
-        # Save spray event to database
-        background_tasks.add_task(save_spray_event_to_db, spray_event)
-        
-        # Update zone status
-        zone = zones_db[command.zone_id]
-        zone.last_treated = datetime.now()
-        zone.treatment_needed = False
-        zone.health_score = min(95, zone.health_score + random.uniform(10, 20))
-        zone.infection_rate = max(5, zone.infection_rate - random.uniform(15, 25))
-        
-        # Broadcast update via WebSocket
-        await manager.broadcast(json.dumps({
-            "event": "spray_started",
-            "spray_id": spray_id,
-            "zone_id": command.zone_id,
-            "dosage": command.dosage,
-            "duration": command.duration,
-            "success": success
-        }))
-        
-        return {
-            "status": "success" if success else "partial",
-            "spray_id": spray_id,
-            "message": f"Spraying initiated for zone {command.zone_id}",
-            "estimated_completion": datetime.now() + timedelta(minutes=command.duration),
-            "serial_connected": serial_connection is not None
-        }
-        
+        return await run_spray(command)
+    except ActuatorQueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Sprayer busy: {str(e)}")
     except Exception as e:
         logging.error(f"Spray control failed: {e}")
         raise HTTPException(status_code=500, detail=f"Spray control failed: {str(e)}")
 
-async def send_serial_command(command: str) -> bool:
-    """Send command to Arduino via serial connection"""
-    global serial_connection
-    
-    if not serial_connection:
-        try:
-            init_serial_connection()
-        except:
-            return False
-    
-    if serial_connection and serial_connection.is_open:
-        try:
-            serial_connection.write(f"{command}\n".encode())
-            time.sleep(0.1)  # Small delay
-            return True
-        except Exception as e:
-            logging.error(f"Serial communication failed: {e}")
-            return False
-    
-    return False
+def validate_spray_duration(duration: int):
+    """400 for spray durations (minutes) the controller would NAK"""
+    max_duration = ACTUATOR_MAX_RUN_SECONDS // 60
+    if not 1 <= duration <= max_duration:
+        raise HTTPException(
+            status_code=400,
+            detail=f"duration must be at least 1 and at most {max_duration} minute(s) "
+                   f"(the spray controller accepts at most {ACTUATOR_MAX_RUN_SECONDS}s per run)"
+        )
 
-async def save_spray_event_to_db(spray_event: SprayEvent):
-    """Save spray event to database"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO spray_events (
-            spray_id, zone_id, detection_id, spray_duration,
-            pesticide_type, dosage, success, gps_lat, gps_lng, timestamp
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
+async def run_scheduled_spray(job: SprayJob) -> str:
+    """Scheduler callback: spray a job's zone, reusing the job's actuator sequence number"""
+    result = await run_spray(SprayCommand(
+        zone_id=job.zone_id,
+        pesticide_type=job.pesticide_type,
+        dosage=job.dosage,
+        duration=job.duration,
+        automatic=True
+    ), seq=job.command_seq)
+    if result["status"] != "success":
+        raise ActuatorError(f"Spray for zone {job.zone_id} was not acknowledged")
+    return result["spray_id"]
+
+@app.get("/api/spray/stats")
+async def get_actuator_stats():
+    """Serial actuator connection state and acknowledgement counters"""
+    return actuator.stats()
+
+async def send_serial_command(command: str, seq: Optional[int] = None) -> bool:
+    """Send a command to the spray controller and wait for its acknowledgement"""
+    try:
+        await actuator.send(command, seq=seq)
+        return True
+    except ActuatorQueueFull:
+        raise
+    except ActuatorError as e:
+        logging.error(f"Serial communication failed: {e}")
+        return False
+
+INSERT_SPRAY_EVENT_SQL = '''
+    INSERT INTO spray_events (
+        spray_id, zone_id, detection_id, spray_duration,
+        pesticide_type, dosage, success, gps_lat, gps_lng, timestamp, timestamp_ms
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def spray_event_to_row(spray_event: SprayEvent) -> tuple:
+    """Flatten a SprayEvent into a spray_events table row"""
+    return (
         spray_event.spray_id, spray_event.zone_id, spray_event.detection_id,
         spray_event.spray_duration, spray_event.pesticide_type, spray_event.dosage,
         spray_event.success,
         spray_event.gps_coordinates.get("lat") if spray_event.gps_coordinates else None,
         spray_event.gps_coordinates.get("lng") if spray_event.gps_coordinates else None,
-        spray_event.timestamp
-    ))
-    
-    conn.commit()
-    conn.close()
+        spray_event.timestamp, to_epoch_ms(spray_event.timestamp)
+    )
+
+async def save_spray_event_to_db(spray_event: SprayEvent):
+    """Write spray event in the next batched database write; returns once it is committed"""
+    await write_behind.enqueue(INSERT_SPRAY_EVENT_SQL, spray_event_to_row(spray_event))
+
+def read_dashboard_counters(conn: sqlite3.Connection) -> Dict[str, Any]:
+    """Dashboard totals from the trigger-maintained aggregates table (constant time)"""
+    total_detections = int(read_counter(conn, "detections"))
+    healthy_plants = int(read_counter(conn, "disease", DiseaseType.HEALTHY.value))
+    return {
+        "total_detections": total_detections,
+        "healthy_plants": healthy_plants,
+        "infected_plants": total_detections - healthy_plants,
+        "total_spray_events": int(read_counter(conn, "sprays")),
+        "pesticide_used_today": read_counter(conn, "dosage_day", datetime.now().strftime("%Y-%m-%d")),
+        "most_common_disease": most_common(conn, "disease", exclude=DiseaseType.HEALTHY.value) or "none",
+        "most_common_plant": most_common(conn, "plant") or "unknown"
+    }
 
 @app.get("/api/metrics", response_model=FieldMetrics)
 async def get_field_metrics():
     """Get comprehensive field metrics and statistics"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    # Get detection statistics
-    cursor.execute("SELECT COUNT(*) FROM detections")
-    total_detections = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM detections WHERE disease_type = 'healthy'")
-    healthy_plants = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM detections WHERE disease_type != 'healthy'")
-    infected_plants = cursor.fetchone()[0]
-    
-    # Get spray statistics
-    cursor.execute("SELECT COUNT(*) FROM spray_events")
-    total_spray_events = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT SUM(dosage) FROM spray_events WHERE DATE(timestamp) = DATE('now')")
-    pesticide_used_today = cursor.fetchone()[0] or 0
+    await write_behind.sync()
+    counters = await database.read(read_dashboard_counters)
+    total_detections = counters["total_detections"]
+    healthy_plants = counters["healthy_plants"]
+    infected_plants = counters["infected_plants"]
+    total_spray_events = counters["total_spray_events"]
+    pesticide_used_today = counters["pesticide_used_today"]
     
     # Calculate efficiency metrics
     efficiency_score = (healthy_plants / max(total_detections, 1)) * 100
     cost_saved = (infected_plants * 15) + (total_spray_events * 5)  # Mock calculation
     
-    conn.close()
-    
     total_area = 150.0  # hectares
     infected_zones = sum(1 for z in zones_db.values() if z.infection_rate > 20)
     
@@ -644,48 +991,15 @@ async def get_field_metrics():
 @app.get("/api/analytics/advanced", response_model=AnalyticsData)
 async def get_advanced_analytics():
     """Get advanced analytics data"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    # Get detection statistics
-    cursor.execute("SELECT COUNT(*) FROM detections")
-    total_detections = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM detections WHERE disease_type = 'healthy'")
-    healthy_plants = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM detections WHERE disease_type != 'healthy'")
-    infected_plants = cursor.fetchone()[0]
-    
-    # Get spray statistics
-    cursor.execute("SELECT COUNT(*) FROM spray_events")
-    total_spray_events = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT SUM(dosage) FROM spray_events WHERE DATE(timestamp) = DATE('now')")
-    pesticide_used_today = cursor.fetchone()[0] or 0
-    
-    # Get most common disease
-    cursor.execute("""
-        SELECT disease_type, COUNT(*) as count 
-        FROM detections 
-        WHERE disease_type != 'healthy' 
-        GROUP BY disease_type 
-        ORDER BY count DESC 
-        LIMIT 1
-    """)
-    most_common_disease_result = cursor.fetchone()
-    most_common_disease = most_common_disease_result[0] if most_common_disease_result else "none"
-    
-    # Get most common plant
-    cursor.execute("""
-        SELECT plant_type, COUNT(*) as count 
-        FROM detections 
-        GROUP BY plant_type 
-        ORDER BY count DESC 
-        LIMIT 1
-    """)
-    most_common_plant_result = cursor.fetchone()
-    most_common_plant = most_common_plant_result[0] if most_common_plant_result else "unknown"
+    await write_behind.sync()
+    counters = await database.read(read_dashboard_counters)
+    total_detections = counters["total_detections"]
+    healthy_plants = counters["healthy_plants"]
+    infected_plants = counters["infected_plants"]
+    total_spray_events = counters["total_spray_events"]
+    pesticide_used_today = counters["pesticide_used_today"]
+    most_common_disease = counters["most_common_disease"]
+    most_common_plant = counters["most_common_plant"]
     
     # Calculate detection accuracy (mock calculation)
     detection_accuracy = 85.0 + random.uniform(-5, 10)
@@ -696,8 +1010,6 @@ async def get_advanced_analytics():
     # Calculate cost saved
     cost_saved = (infected_plants * 15) + (total_spray_events * 5)
     
-    conn.close()
-    
     return AnalyticsData(
         total_detections=total_detections,
         healthy_plants=healthy_plants,
@@ -711,99 +1023,263 @@ async def get_advanced_analytics():
         detection_accuracy=detection_accuracy
     )
 
+HISTORY_MAX_LIMIT = int(os.getenv("HISTORY_MAX_LIMIT", 500))
+HISTORY_TOTAL_COUNTERS = {"detections": "detections", "spray_events": "sprays"}
+
+DETECTION_HISTORY_COLUMNS = [
+    "detection_id", "disease_type", "plant_type", "confidence", "severity",
+    "affected_area_percentage", "recommendation", "pesticide_dosage",
+    "spray_time_seconds", "detection_method", "gps_lat", "gps_lng", "timestamp"
+]
+
+SPRAY_HISTORY_COLUMNS = [
+    "spray_id", "zone_id", "detection_id", "spray_duration",
+    "pesticide_type", "dosage", "success", "gps_lat", "gps_lng", "timestamp"
+]
+
+async def run_history_query(history: HistoryQuery, cursor: Optional[str], limit: int, include_total: bool):
+    """Fetch one keyset page, plus the filtered total on the first page or when asked"""
+    if not 1 <= limit <= HISTORY_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {HISTORY_MAX_LIMIT}")
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    await write_behind.sync()  # Read-your-writes for just-accepted rows
+
+    def query(conn):
+        # Page and total come from the same snapshot
+        with read_snapshot(conn):
+            rows, next_cursor = history.page(conn, cursor, limit)
+            total = None
+            if include_total or not cursor:
+                # Unfiltered totals come straight from the aggregate counters
+                total = (history.count(conn) if history.filtered
+                         else int(read_counter(conn, HISTORY_TOTAL_COUNTERS[history.table])))
+        return rows, next_cursor, total
+
+    return await database.read(query)
+
 @app.get("/api/detections/history")
-async def get_detection_history(limit: int = 50, offset: int = 0):
-    """Get detection history with pagination"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT detection_id, disease_type, plant_type, confidence, severity,
-               affected_area_percentage, recommendation, pesticide_dosage,
-               spray_time_seconds, detection_method, timestamp
-        FROM detections 
-        ORDER BY timestamp DESC 
-        LIMIT ? OFFSET ?
-    """, (limit, offset))
-    
-    detections = []
-    for row in cursor.fetchall():
-        detections.append({
-            "detection_id": row[0],
-            "disease_type": row[1],
-            "plant_type": row[2],
-            "confidence": row[3],
-            "severity": row[4],
-            "affected_area_percentage": row[5],
-            "recommendation": row[6],
-            "pesticide_dosage": row[7],
-            "spray_time_seconds": row[8],
-            "detection_method": row[9],
-            "timestamp": row[10]
-        })
-    
-    conn.close()
-    return {"detections": detections, "total": len(detections)}
+async def get_detection_history(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    disease_type: Optional[DiseaseType] = None,
+    plant_type: Optional[PlantType] = None,
+    severity: Optional[SeverityLevel] = None,
+    min_lat: Optional[float] = None,
+    max_lat: Optional[float] = None,
+    min_lng: Optional[float] = None,
+    max_lng: Optional[float] = None,
+    include_total: bool = False
+):
+    """
+    Get detection history, newest first, with keyset pagination
+    Pass the returned next_cursor to fetch the following page. total is the
+    filtered row count; it is returned on the first page (and on later pages
+    with include_total=true).
+    """
+    history = (HistoryQuery("detections", DETECTION_HISTORY_COLUMNS, archive=archive)
+               .time_range(to_epoch_ms(start) if start else None, to_epoch_ms(end) if end else None)
+               .equals("disease_type", disease_type.value if disease_type else None)
+               .equals("plant_type", plant_type.value if plant_type else None)
+               .equals("severity", severity.value if severity else None)
+               .bounding_box(min_lat, max_lat, min_lng, max_lng))
+
+    rows, next_cursor, total = await run_history_query(history, cursor, limit, include_total)
+    detections = [dict(zip(DETECTION_HISTORY_COLUMNS, row)) for row in rows]
+
+    return {"detections": detections, "next_cursor": next_cursor, "total": total}
 
 @app.get("/api/spray/history")
-async def get_spray_history(limit: int = 50, offset: int = 0):
-    """Get spray event history with pagination"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT spray_id, zone_id, detection_id, spray_duration,
-               pesticide_type, dosage, success, timestamp
-        FROM spray_events 
-        ORDER BY timestamp DESC 
-        LIMIT ? OFFSET ?
-    """, (limit, offset))
-    
+async def get_spray_history(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    zone_id: Optional[str] = None,
+    detection_id: Optional[str] = None,
+    min_lat: Optional[float] = None,
+    max_lat: Optional[float] = None,
+    min_lng: Optional[float] = None,
+    max_lng: Optional[float] = None,
+    include_total: bool = False
+):
+    """Get spray event history, newest first, with keyset pagination (see detection history)"""
+    history = (HistoryQuery("spray_events", SPRAY_HISTORY_COLUMNS, archive=archive)
+               .time_range(to_epoch_ms(start) if start else None, to_epoch_ms(end) if end else None)
+               .equals("zone_id", zone_id)
+               .equals("detection_id", detection_id)
+               .bounding_box(min_lat, max_lat, min_lng, max_lng))
+
+    rows, next_cursor, total = await run_history_query(history, cursor, limit, include_total)
     sprays = []
-    for row in cursor.fetchall():
-        sprays.append({
-            "spray_id": row[0],
-            "zone_id": row[1],
-            "detection_id": row[2],
-            "spray_duration": row[3],
-            "pesticide_type": row[4],
-            "dosage": row[5],
-            "success": bool(row[6]),
-            "timestamp": row[7]
-        })
-    
-    conn.close()
-    return {"sprays": sprays, "total": len(sprays)}
+    for row in rows:
+        spray = dict(zip(SPRAY_HISTORY_COLUMNS, row))
+        spray["success"] = bool(spray["success"])
+        sprays.append(spray)
+
+    return {"sprays": sprays, "next_cursor": next_cursor, "total": total}
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 5000))
+
+DETECTION_EXPORT_COLUMNS = [
+    "detection_id", "disease_type", "plant_type", "confidence", "severity",
+    "affected_area_percentage", "recommendation", "pesticide_dosage",
+    "spray_time_seconds", "detection_method", "image_path", "image_checksum",
+    "gps_lat", "gps_lng", "weather_temp", "weather_humidity", "weather_wind_speed",
+    "timestamp", "timestamp_ms"
+]
+
+SPRAY_EXPORT_COLUMNS = [
+    "spray_id", "zone_id", "detection_id", "spray_duration", "pesticide_type",
+    "dosage", "success", "gps_lat", "gps_lng", "timestamp", "timestamp_ms"
+]
+
+async def export_response(history: HistoryQuery, name: str, format: str, compression: Optional[str]):
+    """Stream every row of a history query as NDJSON/CSV, optionally gzipped"""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    if compression not in (None, "gzip"):
+        raise HTTPException(status_code=400, detail="compression must be gzip or omitted")
+
+    await write_behind.sync()
+
+    body = encode_rows(stream_rows(database, history, EXPORT_CHUNK_SIZE), history.columns, format)
+    filename = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{format}"
+    media_type = EXPORT_FORMATS[format]
+    if compression == "gzip":
+        body = gzip_stream(body)
+        filename += ".gz"
+        media_type = "application/gzip"
+
+    return StreamingResponse(body, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/api/export/detections")
+async def export_detections(
+    format: str = "ndjson",
+    compression: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    disease_type: Optional[DiseaseType] = None,
+    plant_type: Optional[PlantType] = None
+):
+    """Export detections in [start, end), oldest first, as a streamed NDJSON or CSV download"""
+    # Bound open-ended exports at request time so rows arriving mid-export are not chased
+    end = end or datetime.now()
+    history = (HistoryQuery("detections", DETECTION_EXPORT_COLUMNS, archive=archive)
+               .time_range(to_epoch_ms(start) if start else None, to_epoch_ms(end))
+               .equals("disease_type", disease_type.value if disease_type else None)
+               .equals("plant_type", plant_type.value if plant_type else None))
+    return await export_response(history, "detections", format, compression)
+
+@app.get("/api/export/sprays")
+async def export_sprays(
+    format: str = "ndjson",
+    compression: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    zone_id: Optional[str] = None
+):
+    """Export spray events in [start, end), oldest first, as a streamed NDJSON or CSV download"""
+    end = end or datetime.now()
+    history = (HistoryQuery("spray_events", SPRAY_EXPORT_COLUMNS, archive=archive)
+               .time_range(to_epoch_ms(start) if start else None, to_epoch_ms(end))
+               .equals("zone_id", zone_id))
+    return await export_response(history, "sprays", format, compression)
+
+PESTICIDE_COST_PER_UNIT = float(os.getenv("PESTICIDE_COST_PER_UNIT", 25))
+
+def validate_rollup_query(resolution: str, group_by: Optional[str], allowed_groups: tuple):
+    """Reject unknown resolutions / groupings before they reach SQL"""
+    if resolution not in ROLLUP_RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of {', '.join(ROLLUP_RESOLUTIONS)}")
+    if group_by is not None and group_by not in allowed_groups:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(allowed_groups)}")
 
 @app.get("/api/analytics/usage")
-async def get_pesticide_usage():
-    """Get pesticide usage analytics"""
-    # Generate mock data for last 6 months
-    months = ["Jan", "Feb", "Mar", "Apr", "May", "Jun"]
+async def get_pesticide_usage(
+    resolution: str = "month",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    zone_id: Optional[str] = None,
+    pesticide_type: Optional[str] = None,
+    group_by: Optional[str] = None
+):
+    """
+    Get pesticide usage analytics
+    Served from the usage rollups: one point per hour/day/month bucket in
+    [start, end] (default: the last 6 months), optionally split by zone_id
+    or pesticide_type.
+    """
+    validate_rollup_query(resolution, group_by, USAGE_GROUPS)
+    if start is None and end is None:
+        start = datetime.now() - timedelta(days=180)
+
+    await write_behind.sync()
+    series = await database.read(lambda conn: usage_series(
+        conn, resolution, group_by, start, end, zone_id, pesticide_type
+    ))
+
     data = []
-    
-    for i, month in enumerate(months):
-        usage = 50 - (i * 5) + random.uniform(-3, 3)
-        saved = 15 + (i * 5) + random.uniform(-2, 2)
+    for point in series:
         data.append({
-            "month": month,
-            "usage": round(usage, 1),
-            "saved": round(saved, 1),
-            "cost": round(usage * 25, 2)
+            "period": point["bucket"],
+            **({group_by: point[group_by]} if group_by else {}),
+            "usage": round(point["dosage"], 3),
+            "spray_count": point["spray_count"],
+            "duration_seconds": point["duration_seconds"],
+            "cost": round(point["dosage"] * PESTICIDE_COST_PER_UNIT, 2)
         })
     
     return data
 
 @app.get("/api/analytics/diseases")
-async def get_disease_distribution():
-    """Get distribution of diseases in the field"""
-    return [
-        {"name": "Powdery Mildew", "value": 30, "zones_affected": 2},
-        {"name": "Leaf Spot", "value": 25, "zones_affected": 1},
-        {"name": "Rust", "value": 20, "zones_affected": 1},
-        {"name": "Blight", "value": 15, "zones_affected": 1},
-        {"name": "Healthy", "value": 10, "zones_affected": 0},
-    ]
+async def get_disease_distribution(
+    resolution: str = "month",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    plant_type: Optional[PlantType] = None,
+    series: bool = False
+):
+    """
+    Get distribution of diseases in the field
+    Detection share per disease over [start, end] (default: all time) from the
+    disease rollups; with series=true, counts per disease per bucket instead.
+    """
+    validate_rollup_query(resolution, None, DISEASE_GROUPS)
+
+    await write_behind.sync()
+    totals = await database.read(lambda conn: disease_totals(
+        conn, resolution, "disease_type", start, end,
+        plant_type.value if plant_type else None, by_bucket=series
+    ))
+
+    if series:
+        return [{
+            "period": point["bucket"],
+            "disease_type": point["disease_type"],
+            "detections": point["detections"],
+            "avg_affected_area": round(point["avg_affected_area"], 2)
+        } for point in totals]
+
+    total_detections = sum(point["detections"] for point in totals)
+    distribution = []
+    for point in sorted(totals, key=lambda p: p["detections"], reverse=True):
+        distribution.append({
+            "name": point["disease_type"].replace("_", " ").title(),
+            "disease_type": point["disease_type"],
+            "value": round(point["detections"] / total_detections * 100, 1),
+            "detections": point["detections"],
+            "avg_affected_area": round(point["avg_affected_area"], 2)
+        })
+    
+    return distribution
 
 @app.get("/api/weather")
 async def get_weather():
@@ -840,65 +1316,136 @@ async def get_iot_devices():
     
     return devices
 
+def parse_list_param(value: Optional[str]) -> Optional[List[str]]:
+    """Comma-separated query parameter -> list (None when absent)"""
+    return [item.strip() for item in value.split(",") if item.strip()] if value else None
+
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for real-time updates"""
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, topics: Optional[str] = None, zones: Optional[str] = None):
+    """
+    WebSocket endpoint for real-time updates
+    Subscribe with ?topics=sprays,zones&zones=zone_a (default: every topic and
+    zone). The first message is a snapshot of current state; deltas follow.
+    Send {"action": "subscribe", "topics": [...], "zones": [...]} to change
+    the subscription; a snapshot of the new selection is sent back.
+    Request subprotocol annrakshak.msgpack.v1 (or annrakshak.msgpack-deflate.v1)
+    for coalesced binary MessagePack frames instead of JSON text per event.
+    """
+    subprotocol, codec = wire.negotiate(websocket.scope.get("subprotocols", []))
+    await manager.connect(websocket, subprotocol=subprotocol, codec=codec)
+    deliver = lambda item: manager.queue_message(websocket, *item.encode(codec))
+
+    def send_event(event: Dict[str, Any]):
+        manager.queue_message(websocket, *wire.encode(codec, [event]))
+
+    def send_snapshot(subscription):
+        send_event({
+            "event": "snapshot",
+            "topics": sorted(subscription.topics),
+            "events": event_bus.snapshot(subscription.topics, subscription.zones)
+        })
+
+    try:
+        subscription = event_bus.subscribe(deliver, topics=parse_list_param(topics), zones=parse_list_param(zones),
+                                           coalesce=codec != wire.JSON)
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+        manager.disconnect(websocket)
+        return
+
+    send_snapshot(subscription)
     try:
         while True:
-            # Send periodic updates
-            await asyncio.sleep(5)
-            
-            # Random event generation
-            events = [
-                {
-                    "event": "zone_update",
-                    "zone_id": random.choice(list(zones_db.keys())),
-                    "health_score": random.uniform(60, 95),
-                    "infection_rate": random.uniform(5, 40)
-                },
-                {
-                    "event": "device_status",
-                    "device_id": f"device_{random.randint(1, 8)}",
-                    "status": random.choice(["online", "offline"]),
-                    "battery": random.uniform(20, 100)
-                },
-                {
-                    "event": "weather_update",
-                    "temperature": random.uniform(25, 32),
-                    "humidity": random.uniform(60, 75)
-                }
-            ]
-            
-            event = random.choice(events)
-            await websocket.send_text(json.dumps(event))
-            
-    except WebSocketDisconnect:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            try:
+                request = wire.decode_request(message)
+                if request.get("action") != "subscribe":
+                    raise ValueError(f"Unknown action: {request.get('action')}")
+                event_bus.update(subscription, topics=request.get("topics"), zones=request.get("zones"))
+                send_snapshot(subscription)
+            except (ValueError, AttributeError) as e:
+                send_event({"event": "error", "detail": str(e)})
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        event_bus.unsubscribe(subscription)
         manager.disconnect(websocket)
 
+@app.get("/api/ws/stats")
+async def get_websocket_stats(top: int = 20):
+    """WebSocket fan-out and event bus metrics, including the most lagged connections"""
+    return {**manager.stats(top=top), "event_bus": event_bus.stats()}
+
+def scheduled_dosage(infection_rate: float) -> float:
+    """Dosage (liters per hectare) scaled with infection, 0.3 to 0.8"""
+    return round(0.3 + 0.5 * min(max(infection_rate, 0), 60) / 60, 2)
+
 @app.post("/api/schedule")
-async def create_spray_schedule(zones: List[str], start_date: datetime):
-    """Create automated spray schedule for selected zones"""
-    schedule = []
-    
-    for i, zone_id in enumerate(zones):
-        if zone_id in zones_db:
-            scheduled_time = start_date + timedelta(hours=i*2)
-            schedule.append({
-                "zone_id": zone_id,
-                "scheduled_time": scheduled_time,
-                "pesticide_type": "Systemic Fungicide",
-                "estimated_dosage": random.uniform(0.3, 0.8),
-                "priority": "high" if zones_db[zone_id].infection_rate > 30 else "normal"
-            })
+async def create_spray_schedule(zones: List[str], start_date: datetime, interval_minutes: float = 120,
+                                pesticide_type: str = "Systemic Fungicide", duration: int = 1):
+    """
+    Create automated spray schedule for selected zones
+    Jobs are stored durably and executed by the scheduler; the most infected
+    zones get the earliest slots and win ties when several jobs are due.
+    """
+    # Reject now rather than let every attempt be NAKed at spray time
+    validate_spray_duration(duration)
+    if interval_minutes < duration:
+        # One sprayer: a run that starts before the previous one ends is NAKed "busy"
+        raise HTTPException(status_code=400, detail=f"interval_minutes must be at least duration ({duration})")
+    
+    selected = sorted((zone_id for zone_id in dict.fromkeys(zones) if zone_id in zones_db),
+                      key=lambda zone_id: zones_db[zone_id].infection_rate, reverse=True)
+    jobs = []
+    for i, zone_id in enumerate(selected):
+        infection_rate = zones_db[zone_id].infection_rate
+        jobs.append({
+            "zone_id": zone_id,
+            "pesticide_type": pesticide_type,
+            "dosage": scheduled_dosage(infection_rate),
+            "duration": duration,
+            "priority": infection_rate,
+            "due_at_ms": to_epoch_ms(start_date + timedelta(minutes=i * interval_minutes))
+        })
+    created = await spray_scheduler.schedule(jobs) if jobs else []
+    
+    schedule = [{
+        "job_id": job.job_id,
+        "zone_id": job.zone_id,
+        "scheduled_time": datetime.fromtimestamp(job.due_at_ms / 1000),
+        "pesticide_type": job.pesticide_type,
+        "estimated_dosage": job.dosage,
+        "priority": "high" if job.priority > 30 else "normal",
+        "status": job.status
+    } for job in created]
     
     return {
-        "schedule_id": f"sch_{datetime.now().timestamp()}",
+        "schedule_id": created[0].schedule_id if created else None,
         "total_zones": len(schedule),
-        "estimated_completion": start_date + timedelta(hours=len(zones)*2),
+        "estimated_completion": start_date + timedelta(minutes=len(schedule) * interval_minutes),
         "schedule": schedule
     }
 
+@app.get("/api/schedule/stats")
+async def get_schedule_stats():
+    """Scheduler queue depth, dispatch counters and the last weather reading"""
+    return spray_scheduler.stats()
+
+@app.get("/api/schedule/{schedule_id}")
+async def get_spray_schedule(schedule_id: str):
+    """Jobs of a schedule with their current status"""
+    jobs = await spray_scheduler.jobs(schedule_id)
+    if not jobs:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    return {"schedule_id": schedule_id, "jobs": jobs}
+
+@app.delete("/api/schedule/{schedule_id}")
+async def cancel_spray_schedule(schedule_id: str):
+    """Cancel a schedule's jobs that have not run yet"""
+    return {"schedule_id": schedule_id, "cancelled": await spray_scheduler.cancel(schedule_id)}
+
 @app.get("/api/notifications")
 async def get_notifications():
     """Get system notifications and alerts"""
@@ -931,6 +1478,12 @@ async def get_notifications():
     
     return notifications
 
+@app.on_event("shutdown")
+async def shutdown_database():
+    """Flush buffered writes, then close pooled connections once everything else has stopped"""
+    await write_behind.stop()
+    await asyncio.to_thread(database.close)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
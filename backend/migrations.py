@@ -0,0 +1,286 @@
+"""
+Versioned schema migrations for the SQLite database
+
+The applied version is tracked in PRAGMA user_version. migrate() applies every
+migration newer than that, in order, and bumps the version after each one.
+Call it inside a transaction (Database.write does this) so a failed upgrade
+leaves the schema untouched.
+
+To change the schema, append a new migration; never edit an applied one.
+"""
+
+import sqlite3
+from typing import Callable, List, Optional, Tuple
+
+
+def _initial_schema(conn: sqlite3.Connection):
+    """Tables as originally created by init_database"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS detections (
+            detection_id TEXT PRIMARY KEY,
+            disease_type TEXT NOT NULL,
+            plant_type TEXT NOT NULL,
+            confidence REAL NOT NULL,
+            severity TEXT NOT NULL,
+            affected_area_percentage REAL NOT NULL,
+            recommendation TEXT NOT NULL,
+            pesticide_dosage REAL NOT NULL,
+            spray_time_seconds INTEGER NOT NULL,
+            detection_method TEXT NOT NULL,
+            image_path TEXT,
+            gps_lat REAL,
+            gps_lng REAL,
+            weather_temp REAL,
+            weather_humidity REAL,
+            weather_wind_speed REAL,
+            timestamp DATETIME NOT NULL
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS spray_events (
+            spray_id TEXT PRIMARY KEY,
+            zone_id TEXT NOT NULL,
+            detection_id TEXT,
+            spray_duration INTEGER NOT NULL,
+            pesticide_type TEXT NOT NULL,
+            dosage REAL NOT NULL,
+            success BOOLEAN NOT NULL,
+            gps_lat REAL,
+            gps_lng REAL,
+            timestamp DATETIME NOT NULL,
+            FOREIGN KEY (detection_id) REFERENCES detections (detection_id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS zones (
+            zone_id TEXT PRIMARY KEY,
+            health_score REAL NOT NULL,
+            infection_rate REAL NOT NULL,
+            last_treated DATETIME,
+            treatment_needed BOOLEAN NOT NULL,
+            gps_lat REAL NOT NULL,
+            gps_lng REAL NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS weather_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            temperature REAL NOT NULL,
+            humidity REAL NOT NULL,
+            wind_speed REAL NOT NULL,
+            rain_probability REAL NOT NULL,
+            uv_index INTEGER NOT NULL,
+            conditions TEXT NOT NULL,
+            spray_suitable BOOLEAN NOT NULL,
+            timestamp DATETIME NOT NULL
+        )
+    ''')
+
+
+def _image_checksum(conn: sqlite3.Connection):
+    """Checksum of the stored upload (may already exist on databases created before migrations)"""
+    add_column(conn, "detections", "image_checksum", "TEXT")
+
+
+def _timestamp_ms(conn: sqlite3.Connection):
+    """
+    Numeric UTC epoch-millisecond timestamps
+    `timestamp` holds naive local-time text, so range predicates had to wrap it
+    in DATE()/strftime() and could never use an index. timestamp_ms is set on
+    every insert; existing rows are backfilled (the 'utc' modifier converts
+    from local time).
+    """
+    for table in ("detections", "spray_events"):
+        add_column(conn, table, "timestamp_ms", "INTEGER")
+        conn.execute(f'''
+            UPDATE {table}
+            SET timestamp_ms = CAST(ROUND((julianday(timestamp, 'utc') - 2440587.5) * 86400000) AS INTEGER)
+            WHERE timestamp_ms IS NULL
+        ''')
+
+
+def _indexes(conn: sqlite3.Connection):
+    """Covering indexes for history, filters, group-bys and dosage sums"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_detections_timestamp ON detections (timestamp_ms)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_detections_disease ON detections (disease_type, timestamp_ms)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_detections_plant ON detections (plant_type, timestamp_ms)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_spray_events_timestamp ON spray_events (timestamp_ms, dosage)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_spray_events_zone ON spray_events (zone_id, timestamp_ms)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_spray_events_detection ON spray_events (detection_id)")
+    conn.execute("ANALYZE")
+
+
+def _history_filter_indexes(conn: sqlite3.Connection):
+    """Indexes for the remaining history filters (severity, GPS bounding box)"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_detections_severity ON detections (severity, timestamp_ms)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_detections_gps ON detections (gps_lat, gps_lng)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_spray_events_gps ON spray_events (gps_lat, gps_lng)")
+    conn.execute("ANALYZE")
+
+
+def _aggregates(conn: sqlite3.Connection):
+    """Aggregate counters maintained by insert triggers (see aggregates.py)"""
+    from aggregates import DAY_SQL, rebuild_aggregates
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS aggregates (
+            metric TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value REAL NOT NULL,
+            PRIMARY KEY (metric, key)
+        ) WITHOUT ROWID
+    ''')
+
+    bump = "INSERT INTO aggregates (metric, key, value) VALUES ({}, {}, {}) " \
+           "ON CONFLICT (metric, key) DO UPDATE SET value = value + excluded.value;"
+    day = DAY_SQL.format(ms="COALESCE(NEW.timestamp_ms, CAST(strftime('%s', 'now') AS INTEGER) * 1000)")
+
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_detections_aggregates AFTER INSERT ON detections
+        BEGIN
+            {bump.format("'detections'", "''", "1")}
+            {bump.format("'disease'", "NEW.disease_type", "1")}
+            {bump.format("'plant'", "NEW.plant_type", "1")}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_spray_events_aggregates AFTER INSERT ON spray_events
+        BEGIN
+            {bump.format("'sprays'", "''", "1")}
+            {bump.format("'dosage_day'", day, "NEW.dosage")}
+        END
+    ''')
+
+    rebuild_aggregates(conn)
+
+
+def _rollups(conn: sqlite3.Connection):
+    """Hourly/daily/monthly usage and disease rollups maintained by insert triggers (see rollups.py)"""
+    from rollups import rebuild_rollups, trigger_statements
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS usage_rollups (
+            resolution TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            zone_id TEXT NOT NULL,
+            pesticide_type TEXT NOT NULL,
+            spray_count INTEGER NOT NULL,
+            dosage REAL NOT NULL,
+            duration_seconds INTEGER NOT NULL,
+            PRIMARY KEY (resolution, bucket, zone_id, pesticide_type)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS disease_rollups (
+            resolution TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            disease_type TEXT NOT NULL,
+            plant_type TEXT NOT NULL,
+            detections INTEGER NOT NULL,
+            affected_area REAL NOT NULL,
+            PRIMARY KEY (resolution, bucket, disease_type, plant_type)
+        ) WITHOUT ROWID
+    ''')
+
+    for table in ("spray_events", "detections"):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_rollups AFTER INSERT ON {table}
+            BEGIN
+                {"".join(trigger_statements(table))}
+            END
+        ''')
+
+    rebuild_rollups(conn)
+
+
+def _archive_partitions(conn: sqlite3.Connection):
+    """Manifest of Parquet archive partitions (see archive.py)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive_partitions (
+            path TEXT PRIMARY KEY,
+            table_name TEXT NOT NULL,
+            month TEXT NOT NULL,
+            min_timestamp_ms INTEGER NOT NULL,
+            max_timestamp_ms INTEGER NOT NULL,
+            row_count INTEGER NOT NULL,
+            created_at DATETIME NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_archive_partitions_range
+        ON archive_partitions (table_name, max_timestamp_ms, min_timestamp_ms)
+    ''')
+
+
+def _spray_jobs(conn: sqlite3.Connection):
+    """Durable spray job queue for the scheduler (see scheduler.py)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS spray_jobs (
+            job_id TEXT PRIMARY KEY,
+            schedule_id TEXT NOT NULL,
+            zone_id TEXT NOT NULL,
+            pesticide_type TEXT NOT NULL,
+            dosage REAL NOT NULL,
+            duration INTEGER NOT NULL,
+            priority REAL NOT NULL,
+            due_at_ms INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            deferrals INTEGER NOT NULL DEFAULT 0,
+            command_seq INTEGER,
+            spray_id TEXT,
+            last_error TEXT,
+            created_at_ms INTEGER NOT NULL,
+            updated_at_ms INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_spray_jobs_status_due ON spray_jobs (status, due_at_ms)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_spray_jobs_schedule ON spray_jobs (schedule_id)')
+
+
+# (version, description, migration) in application order
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "initial schema", _initial_schema),
+    (2, "detections.image_checksum", _image_checksum),
+    (3, "timestamp_ms epoch columns", _timestamp_ms),
+    (4, "secondary indexes", _indexes),
+    (5, "history filter indexes", _history_filter_indexes),
+    (6, "aggregate counters", _aggregates),
+    (7, "time-series rollups", _rollups),
+    (8, "archive partition manifest", _archive_partitions),
+    (9, "spray job queue", _spray_jobs),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def add_column(conn: sqlite3.Connection, table: str, column: str, declaration: str):
+    """Add a column to an existing table if it is missing"""
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    """Currently applied schema version"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection, target_version: Optional[int] = None) -> int:
+    """Apply pending migrations up to target_version (default: latest); returns the new version"""
+    target_version = LATEST_VERSION if target_version is None else target_version
+    current = schema_version(conn)
+
+    for version, description, migration in MIGRATIONS:
+        if current < version <= target_version:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+            current = version
+            print(f"🔧 Applied migration {version}: {description}")
+
+    return current
@@ -8,7 +8,8 @@ import numpy as np
 from PIL import Image
 import io
 import random
-from typing import Dict, Tuple, Any
+import threading
+from typing import Dict, List, Optional, Tuple, Any
 from enum import Enum
 
 class DiseaseDetector:
@@ -17,7 +18,12 @@ class DiseaseDetector:
     In production, this would load a trained TensorFlow/PyTorch model
     """
     
-    def __init__(self):
+    INPUT_SIZE = (224, 224)
+    
+    def __init__(self, input_dtype: type = np.float32):
+        # float32 (normalized to 0-1) or uint8 (raw 0-255) model input
+        self.input_dtype = np.dtype(input_dtype)
+        
         self.diseases = [
             "Powdery Mildew",
             "Leaf Spot", 
@@ -37,37 +43,79 @@ class DiseaseDetector:
             "critical": (0.85, 1.0)
         }
         
-    def preprocess_image(self, image: Image.Image) -> np.ndarray:
+        # Vectorized batch path draws all of its mock randomness from here
+        self.rng = np.random.default_rng()
+        
+        # Per-thread preallocated input buffers, reused across requests
+        self._buffers = threading.local()
+        
+    def load_image(self, image_bytes: bytes) -> Image.Image:
+        """
+        Decode image bytes for model input
+        JPEGs are decoded in draft mode, letting libjpeg downscale by 1/2, 1/4
+        or 1/8 during decoding so a 12 MP photo never materializes at full size
+        """
+        image = Image.open(io.BytesIO(image_bytes))
+        if image.format == 'JPEG':
+            image.draft('RGB', self.INPUT_SIZE)
+        return image
+    
+    def preprocess_image(self, image: Image.Image, out: Optional[np.ndarray] = None) -> np.ndarray:
         """
         Preprocess image for model input
-        In production: resize, normalize, augment as needed
+        Converts the mode before resizing (on the draft-reduced image), then
+        writes the 224x224x3 result into `out` (or the thread's reusable buffer)
+        as self.input_dtype. The returned array is only valid until the next
+        call on the same thread unless `out` is supplied.
         """
-        # Resize to standard input size
-        image = image.resize((224, 224))
-        
         # Convert to RGB if needed
         if image.mode != 'RGB':
             image = image.convert('RGB')
         
-        # Convert to numpy array
-        img_array = np.array(image)
+        # Resize to standard input size
+        if image.size != self.INPUT_SIZE:
+            image = image.resize(self.INPUT_SIZE, reducing_gap=3.0)
         
-        # Normalize pixel values
-        img_array = img_array / 255.0
+        if out is None:
+            out = self._get_buffer("single", (*self.INPUT_SIZE[::-1], 3))
         
-        return img_array
+        # uint8 view of the pixels, no copy beyond PIL's own export
+        return self._normalize_into(np.asarray(image), out)
+    
+    def _normalize_into(self, pixels: np.ndarray, out: np.ndarray) -> np.ndarray:
+        """Write uint8 pixels into `out` as self.input_dtype"""
+        if self.input_dtype == np.uint8:
+            np.copyto(out, pixels)
+        else:
+            # Normalize pixel values straight into the output buffer
+            np.multiply(pixels, self.input_dtype.type(1.0 / 255.0), out=out, casting='unsafe')
+        return out
+    
+    def _get_buffer(self, name: str, shape: Tuple[int, ...]) -> np.ndarray:
+        """Return a preallocated buffer for this thread, growing it if needed"""
+        buffer = getattr(self._buffers, name, None)
+        if buffer is None or buffer.shape[0] < shape[0] or buffer.shape[1:] != shape[1:]:
+            buffer = np.empty(shape, dtype=self.input_dtype)
+            setattr(self._buffers, name, buffer)
+        return buffer[:shape[0]]
+    
+    def _pixel_scale(self, img_array: np.ndarray) -> float:
+        """Scale that maps model input values onto the 0-1 range"""
+        return 1.0 / 255.0 if img_array.dtype == np.uint8 else 1.0
     
     def extract_features(self, img_array: np.ndarray) -> Dict[str, float]:
         """
         Extract features from image
         In production: use CNN feature extraction
         """
+        scale = self._pixel_scale(img_array)
+        
         # Mock feature extraction based on color analysis
         features = {
-            "green_ratio": np.mean(img_array[:, :, 1]),  # Green channel
+            "green_ratio": float(np.mean(img_array[:, :, 1])) * scale,  # Green channel
             "brown_spots": random.uniform(0, 0.5),
             "yellow_areas": random.uniform(0, 0.3),
-            "texture_variance": np.var(img_array),
+            "texture_variance": float(np.var(img_array)) * scale ** 2,
             "edge_density": random.uniform(0.1, 0.8)
         }
         return features
@@ -119,6 +167,63 @@ class DiseaseDetector:
         affected_percentage = random.uniform(5, 45)
         return affected_percentage
     
+    def extract_features_batch(self, batch: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Vectorized feature extraction over an (N, 224, 224, 3) batch
+        Returns one array of length N per feature
+        """
+        n = batch.shape[0]
+        scale = self._pixel_scale(batch)
+        features = {
+            "green_ratio": batch[:, :, :, 1].mean(axis=(1, 2)) * scale,
+            "brown_spots": self.rng.uniform(0, 0.5, n),
+            "yellow_areas": self.rng.uniform(0, 0.3, n),
+            "texture_variance": batch.reshape(n, -1).var(axis=1) * scale ** 2,
+            "edge_density": self.rng.uniform(0.1, 0.8, n)
+        }
+        return features
+    
+    def predict_disease_batch(self, features: Dict[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Vectorized counterpart of predict_disease
+        Returns (disease index into self.diseases, confidence) arrays
+        """
+        n = len(features["green_ratio"])
+        healthy_idx = len(self.diseases) - 1
+        
+        healthy = (features["green_ratio"] > 0.6) & (self.rng.random(n) > 0.7)
+        disease_idx = self.rng.integers(0, healthy_idx, n)  # Exclude "Healthy"
+        disease_idx[healthy] = healthy_idx
+        
+        confidence = np.where(
+            healthy,
+            self.rng.uniform(0.85, 0.95, n),
+            self.rng.uniform(0.75, 0.95, n)
+        )
+        return disease_idx, confidence
+    
+    def calculate_severity_batch(self, healthy: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Vectorized counterpart of calculate_severity
+        Returns (severity level, severity score) arrays
+        """
+        n = len(healthy)
+        levels = np.array(list(self.severity_thresholds.keys()) + ["none"])
+        upper_bounds = [max_val for _, max_val in list(self.severity_thresholds.values())[:-1]]
+        
+        severity_score = self.rng.uniform(0, 1, n)
+        level_idx = np.digitize(severity_score, upper_bounds)
+        level_idx[healthy] = len(levels) - 1
+        
+        return levels[level_idx], np.where(healthy, 0.0, severity_score * 100)
+    
+    def estimate_affected_area_batch(self, batch: np.ndarray, healthy: np.ndarray) -> np.ndarray:
+        """
+        Vectorized counterpart of estimate_affected_area
+        """
+        affected_percentage = self.rng.uniform(5, 45, batch.shape[0])
+        return np.where(healthy, 0.0, affected_percentage)
+    
     def get_treatment_recommendation(self, disease: str, severity: str, affected_area: float) -> Dict[str, Any]:
         """
         Generate treatment recommendations based on detection results
@@ -257,7 +362,7 @@ class DiseaseDetector:
         Main detection pipeline
         """
         # Load image
-        image = Image.open(io.BytesIO(image_bytes))
+        image = self.load_image(image_bytes)
         
         # Preprocess
         img_array = self.preprocess_image(image)
@@ -274,6 +379,61 @@ class DiseaseDetector:
         # Estimate affected area
         affected_area = self.estimate_affected_area(img_array, disease)
         
+        return self._compile_result(disease, confidence, severity, severity_score, affected_area)
+    
+    def detect_batch(self, images: List[bytes]) -> List[Dict[str, Any]]:
+        """
+        Batched detection pipeline
+        Preprocessed images are stacked into one (N, 224, 224, 3) tensor so
+        feature extraction, prediction, severity and affected-area estimation
+        each run once across the whole batch instead of once per image.
+        Returns one result dict per image, in input order.
+        """
+        if not images:
+            return []
+        
+        # Load and preprocess each image directly into its slot of the batch tensor
+        batch = self._get_buffer("batch", (len(images), *self.INPUT_SIZE[::-1], 3))
+        for i, image_bytes in enumerate(images):
+            self.preprocess_image(self.load_image(image_bytes), out=batch[i])
+        
+        return self._detect_preprocessed_batch(batch)
+    
+    def detect_pixels(self, pixels: np.ndarray) -> List[Dict[str, Any]]:
+        """
+        Batched detection from already decoded uint8 pixels of shape (N, 224, 224, 3)
+        Used by inference workers that receive pixel data through shared memory
+        """
+        if len(pixels) == 0:
+            return []
+        
+        batch = self._get_buffer("batch", pixels.shape)
+        self._normalize_into(pixels, batch)
+        
+        return self._detect_preprocessed_batch(batch)
+    
+    def _detect_preprocessed_batch(self, batch: np.ndarray) -> List[Dict[str, Any]]:
+        """Run the vectorized model stages over a preprocessed batch tensor"""
+        features = self.extract_features_batch(batch)
+        disease_idx, confidence = self.predict_disease_batch(features)
+        healthy = disease_idx == len(self.diseases) - 1
+        severity, severity_score = self.calculate_severity_batch(healthy)
+        affected_area = self.estimate_affected_area_batch(batch, healthy)
+        
+        return [
+            self._compile_result(
+                self.diseases[disease_idx[i]],
+                float(confidence[i]),
+                str(severity[i]),
+                float(severity_score[i]),
+                float(affected_area[i])
+            )
+            for i in range(batch.shape[0])
+        ]
+    
+    def _compile_result(self, disease: str, confidence: float, severity: str,
+                        severity_score: float, affected_area: float) -> Dict[str, Any]:
+        """Attach treatment and risk level and build the result dict"""
         # Get treatment recommendation
         treatment = self.get_treatment_recommendation(disease, severity, affected_area)
         
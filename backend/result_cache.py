@@ -0,0 +1,107 @@
+"""
+Content-addressed detection result cache
+
+Results are keyed by a hash of the uploaded image bytes plus the detection
+method, so a client retrying the same upload gets the original result back
+without another detection run or another stored image.
+
+- LRU eviction once max_entries is reached
+- Entries expire after ttl_seconds
+- Single-flight: identical requests that arrive while the first one is still
+  running await that same computation instead of starting their own. The
+  computation runs as its own task, so it survives any one client
+  (including the first) disconnecting
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+
+class DetectionCache:
+    """
+    Bounded LRU/TTL cache with in-flight request deduplication
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, result)
+        self._in_flight: Dict[str, asyncio.Task] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    @staticmethod
+    def key_for(checksum: str, method: str) -> str:
+        """Cache key from the image content hash (see ImageStore.checksum) and detection method"""
+        return f"{checksum}:{method}"
+
+    def get(self, key: str) -> Any:
+        """Return a live cached value or None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: Any):
+        """Store a value, evicting the least recently used entries past max_entries"""
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Return the cached value for key, joining an in-flight computation if
+        one exists, otherwise run compute() and cache its result.
+        Failures are propagated to every waiter and are not cached.
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.shared += 1
+        else:
+            self.misses += 1
+            in_flight = asyncio.create_task(compute())
+            self._in_flight[key] = in_flight
+            in_flight.add_done_callback(lambda task: self._finish(key, task))
+        # shield: a cancelled client must not cancel the others' result
+        return await asyncio.shield(in_flight)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        """Cache a finished computation's result and stop sharing it"""
+        del self._in_flight[key]
+        if task.cancelled():
+            return
+        # Retrieving the exception also stops an unawaited failure logging a warning
+        if task.exception() is None:
+            self.put(key, task.result())
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache occupancy and hit statistics"""
+        lookups = self.hits + self.misses + self.shared
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "in_flight": len(self._in_flight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared_in_flight": self.shared,
+            "hit_rate": round((self.hits + self.shared) / lookups, 3) if lookups else 0.0
+        }
@@ -0,0 +1,143 @@
+"""
+Hourly / daily / monthly time-series rollups
+
+usage_rollups buckets spray_events per (zone, pesticide type) and
+disease_rollups buckets detections per (disease, plant). Both are kept
+current by AFTER INSERT triggers (migration 7), one upsert per resolution,
+so the analytics endpoints only ever read pre-aggregated buckets.
+
+Buckets are local-time text keys that sort chronologically:
+hour "2024-06-01 13:00", day "2024-06-01", month "2024-06".
+"""
+
+import sqlite3
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# resolution -> strftime format shared by SQLite and Python
+RESOLUTIONS = {
+    "hour": "%Y-%m-%d %H:00",
+    "day": "%Y-%m-%d",
+    "month": "%Y-%m",
+}
+
+USAGE_GROUPS = ("zone_id", "pesticide_type")
+DISEASE_GROUPS = ("disease_type", "plant_type")
+
+
+def bucket_sql(resolution: str, ms: str) -> str:
+    """SQL expression for the bucket of an epoch-millisecond expression"""
+    return f"strftime('{RESOLUTIONS[resolution]}', ({ms}) / 1000, 'unixepoch', 'localtime')"
+
+
+def bucket_for(resolution: str, timestamp: datetime) -> str:
+    """Bucket key of a local datetime"""
+    return timestamp.strftime(RESOLUTIONS[resolution])
+
+
+def trigger_statements(table: str) -> List[str]:
+    """Per-resolution upserts run by the insert trigger on `table`"""
+    ms = "COALESCE(NEW.timestamp_ms, CAST(strftime('%s', 'now') AS INTEGER) * 1000)"
+    statements = []
+    for resolution in RESOLUTIONS:
+        if table == "spray_events":
+            statements.append(f'''
+                INSERT INTO usage_rollups (resolution, bucket, zone_id, pesticide_type,
+                                           spray_count, dosage, duration_seconds)
+                VALUES ('{resolution}', {bucket_sql(resolution, ms)}, NEW.zone_id, NEW.pesticide_type,
+                        1, NEW.dosage, NEW.spray_duration)
+                ON CONFLICT (resolution, bucket, zone_id, pesticide_type) DO UPDATE SET
+                    spray_count = spray_count + 1,
+                    dosage = dosage + excluded.dosage,
+                    duration_seconds = duration_seconds + excluded.duration_seconds;
+            ''')
+        else:
+            statements.append(f'''
+                INSERT INTO disease_rollups (resolution, bucket, disease_type, plant_type,
+                                             detections, affected_area)
+                VALUES ('{resolution}', {bucket_sql(resolution, ms)}, NEW.disease_type, NEW.plant_type,
+                        1, NEW.affected_area_percentage)
+                ON CONFLICT (resolution, bucket, disease_type, plant_type) DO UPDATE SET
+                    detections = detections + 1,
+                    affected_area = affected_area + excluded.affected_area;
+            ''')
+    return statements
+
+
+def rebuild_rollups(conn: sqlite3.Connection, detections: str = "detections", spray_events: str = "spray_events"):
+    """Recompute every bucket from the raw tables (run inside a transaction)"""
+    conn.execute("DELETE FROM usage_rollups")
+    conn.execute("DELETE FROM disease_rollups")
+    for resolution in RESOLUTIONS:
+        bucket = bucket_sql(resolution, "timestamp_ms")
+        conn.execute(f'''
+            INSERT INTO usage_rollups (resolution, bucket, zone_id, pesticide_type,
+                                       spray_count, dosage, duration_seconds)
+            SELECT '{resolution}', {bucket}, zone_id, pesticide_type,
+                   COUNT(*), SUM(dosage), SUM(spray_duration)
+            FROM {spray_events} WHERE timestamp_ms IS NOT NULL
+            GROUP BY 2, 3, 4
+        ''')
+        conn.execute(f'''
+            INSERT INTO disease_rollups (resolution, bucket, disease_type, plant_type,
+                                         detections, affected_area)
+            SELECT '{resolution}', {bucket}, disease_type, plant_type,
+                   COUNT(*), SUM(affected_area_percentage)
+            FROM {detections} WHERE timestamp_ms IS NOT NULL
+            GROUP BY 2, 3, 4
+        ''')
+
+
+def _range_query(table: str, measures: str, resolution: str, group_by: Optional[str],
+                 start: Optional[datetime], end: Optional[datetime],
+                 filters: Dict[str, Any], by_bucket: bool):
+    conditions = ["resolution = ?"]
+    params: List[Any] = [resolution]
+    if start is not None:
+        conditions.append("bucket >= ?")
+        params.append(bucket_for(resolution, start))
+    if end is not None:
+        conditions.append("bucket <= ?")
+        params.append(bucket_for(resolution, end))
+    for column, value in filters.items():
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+
+    keys = (["bucket"] if by_bucket else []) + ([group_by] if group_by else [])
+    select = ", ".join(keys + [measures])
+    group = f"GROUP BY {', '.join(keys)} ORDER BY {', '.join(keys)}" if keys else ""
+    sql = f"SELECT {select} FROM {table} WHERE {' AND '.join(conditions)} {group}"
+    return keys, sql, params
+
+
+def usage_series(conn: sqlite3.Connection, resolution: str = "month", group_by: Optional[str] = None,
+                 start: Optional[datetime] = None, end: Optional[datetime] = None,
+                 zone_id: Optional[str] = None, pesticide_type: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Spray usage per bucket (optionally split by zone or pesticide type)"""
+    keys, sql, params = _range_query(
+        "usage_rollups", "SUM(spray_count), SUM(dosage), SUM(duration_seconds)",
+        resolution, group_by, start, end, {"zone_id": zone_id, "pesticide_type": pesticide_type}, True
+    )
+    series = []
+    for row in conn.execute(sql, params):
+        point = dict(zip(keys, row))
+        point.update(spray_count=row[-3], dosage=row[-2], duration_seconds=row[-1])
+        series.append(point)
+    return series
+
+
+def disease_totals(conn: sqlite3.Connection, resolution: str = "month", group_by: str = "disease_type",
+                   start: Optional[datetime] = None, end: Optional[datetime] = None,
+                   plant_type: Optional[str] = None, by_bucket: bool = False) -> List[Dict[str, Any]]:
+    """Detection counts per disease (or plant) over a range, optionally per bucket"""
+    keys, sql, params = _range_query(
+        "disease_rollups", "SUM(detections), SUM(affected_area)",
+        resolution, group_by, start, end, {"plant_type": plant_type}, by_bucket
+    )
+    totals = []
+    for row in conn.execute(sql, params):
+        point = dict(zip(keys, row))
+        point.update(detections=row[-2], avg_affected_area=row[-1] / row[-2] if row[-2] else 0.0)
+        totals.append(point)
+    return totals
@@ -0,0 +1,351 @@
+"""
+Persistent spray job scheduler
+
+Jobs live in the spray_jobs table; memory only holds an index of them:
+- a timer heap of pending jobs ordered by due time
+- a ready heap of jobs that are due, ordered by priority (the zone's
+  infection rate when the job was planned), then due time
+
+One dispatcher task sleeps until the earliest timer (or until a new job is
+added ahead of it) and runs ready jobs one at a time through the execute
+callback, which drives the spray actuator. There is one sprayer and the
+controller NAKs "busy" while a run is in progress, so after a successful
+dispatch the next job waits out the job's duration (plus
+spray_gap_seconds) instead of burning its attempts on NAKs.
+
+Every state change is written to SQLite before it takes effect:
+1. claim: pending -> running, with the actuator sequence number to use
+2. execute the spray
+3. running -> done, or back to pending with a retry delay, or failed
+
+On start, pending and running jobs are reloaded. A job keeps one actuator
+sequence number (derived from its job_id) across all attempts, and a job
+left running by a crash is resent with it; the spray controller
+acknowledges a repeated sequence number without spraying again, so a job
+that already ran (even if its ACK was lost) is not fired twice (unless the
+controller itself rebooted in between).
+
+Due jobs are only dispatched when the weather (re-read at most every
+weather_cache_seconds) allows. In unsuitable conditions (wind, rain) every
+ready job is deferred by defer_minutes in a single transaction; a job
+expires after max_deferrals.
+"""
+
+import asyncio
+import heapq
+import logging
+import sqlite3
+import time
+import uuid
+import zlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from database import Database
+
+JOB_STATUSES = ("pending", "running", "done", "failed", "expired", "cancelled")
+
+JOB_COLUMNS = (
+    "job_id", "schedule_id", "zone_id", "pesticide_type", "dosage", "duration", "priority",
+    "due_at_ms", "status", "attempts", "deferrals", "command_seq", "spray_id", "last_error",
+    "created_at_ms", "updated_at_ms"
+)
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class SprayJob:
+    """
+    One row of spray_jobs
+    """
+
+    __slots__ = JOB_COLUMNS
+
+    def __init__(self, **fields: Any):
+        for name in JOB_COLUMNS:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "SprayJob":
+        return cls(**dict(zip(JOB_COLUMNS, row)))
+
+    def to_row(self) -> tuple:
+        return tuple(getattr(self, name) for name in JOB_COLUMNS)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in JOB_COLUMNS}
+
+
+class SprayScheduler:
+    """
+    Dispatches durable spray jobs when they fall due
+    """
+
+    def __init__(self, database: Database, execute: Callable[[SprayJob], Awaitable[str]],
+                 weather: Optional[Callable[[], Awaitable[Dict[str, Any]]]] = None,
+                 max_wind_speed: float = 15.0, max_rain_probability: float = 40.0,
+                 defer_minutes: float = 30, max_deferrals: int = 12,
+                 retry_minutes: float = 5, max_attempts: int = 3, weather_cache_seconds: float = 60,
+                 spray_gap_seconds: float = 2):
+        self.database = database
+        self.execute = execute
+        self.weather = weather
+        self.max_wind_speed = max_wind_speed
+        self.max_rain_probability = max_rain_probability
+        self.defer_minutes = defer_minutes
+        self.max_deferrals = max_deferrals
+        self.retry_minutes = retry_minutes
+        self.max_attempts = max_attempts
+        self.weather_cache_seconds = weather_cache_seconds
+        self.spray_gap_seconds = spray_gap_seconds
+
+        # job_id -> job for every pending/running job; heap entries for other ids are stale
+        self._jobs: Dict[str, SprayJob] = {}
+        self._timers: List[Tuple[int, float, str]] = []
+        self._ready: List[Tuple[float, int, str]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # Monotonic time the sprayer finishes its current run
+        self._busy_until = 0.0
+
+        self.dispatched = 0
+        self.completed = 0
+        self.failed = 0
+        self.deferred = 0
+        self.expired = 0
+        self.last_weather: Optional[Dict[str, Any]] = None
+        self._weather_checked_at = 0.0
+
+    async def start(self):
+        """Reload unfinished jobs and start the dispatcher"""
+        if self._task is not None:
+            return
+        rows = await self.database.fetchall(
+            f"SELECT {', '.join(JOB_COLUMNS)} FROM spray_jobs WHERE status IN ('pending', 'running')"
+        )
+        for row in rows:
+            job = SprayJob.from_row(row)
+            self._jobs[job.job_id] = job
+            if job.status == "running":
+                # Interrupted mid-dispatch: resend first, with the same sequence number
+                heapq.heappush(self._ready, (float("-inf"), job.due_at_ms, job.job_id))
+            else:
+                heapq.heappush(self._timers, (job.due_at_ms, -job.priority, job.job_id))
+        if rows:
+            print(f"⏰ Spray scheduler resumed {len(rows)} unfinished jobs")
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop dispatching; unfinished jobs stay in the database"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def schedule(self, jobs: List[Dict[str, Any]], schedule_id: Optional[str] = None) -> List[SprayJob]:
+        """
+        Durably add jobs (zone_id, pesticide_type, dosage, duration, priority,
+        due_at_ms) under one schedule id, in a single transaction
+        """
+        schedule_id = schedule_id or f"sch_{uuid.uuid4().hex[:12]}"
+        created = now_ms()
+        new_jobs = [SprayJob(
+            job_id=f"job_{uuid.uuid4().hex}", schedule_id=schedule_id, status="pending",
+            attempts=0, deferrals=0, created_at_ms=created, updated_at_ms=created, **job
+        ) for job in jobs]
+
+        placeholders = ", ".join("?" for _ in JOB_COLUMNS)
+        await self.database.executemany(
+            f"INSERT INTO spray_jobs ({', '.join(JOB_COLUMNS)}) VALUES ({placeholders})",
+            [job.to_row() for job in new_jobs]
+        )
+        for job in new_jobs:
+            self._track(job)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return new_jobs
+
+    async def cancel(self, schedule_id: str) -> int:
+        """Cancel a schedule's pending jobs; returns how many were cancelled"""
+        updated = now_ms()
+        cancelled = await self.database.write(lambda conn: [row[0] for row in conn.execute(
+            "UPDATE spray_jobs SET status = 'cancelled', updated_at_ms = ? "
+            "WHERE schedule_id = ? AND status = 'pending' RETURNING job_id",
+            (updated, schedule_id)
+        )])
+        for job_id in cancelled:
+            self._jobs.pop(job_id, None)
+        return len(cancelled)
+
+    async def jobs(self, schedule_id: str) -> List[Dict[str, Any]]:
+        """Every job of a schedule, in due order"""
+        rows = await self.database.fetchall(
+            f"SELECT {', '.join(JOB_COLUMNS)} FROM spray_jobs WHERE schedule_id = ? ORDER BY due_at_ms, priority DESC",
+            (schedule_id,)
+        )
+        return [SprayJob.from_row(row).to_dict() for row in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        """In-memory queue depth and dispatch counters"""
+        next_due = min((due for due, _, job_id in self._timers if job_id in self._jobs), default=None)
+        return {
+            "tracked_jobs": len(self._jobs),
+            "ready": len(self._ready),
+            "next_due_ms": next_due,
+            "dispatched": self.dispatched,
+            "completed": self.completed,
+            "failed": self.failed,
+            "deferred": self.deferred,
+            "expired": self.expired,
+            "last_weather": self.last_weather
+        }
+
+    def _track(self, job: SprayJob):
+        """Index a pending job under its due time"""
+        self._jobs[job.job_id] = job
+        heapq.heappush(self._timers, (job.due_at_ms, -job.priority, job.job_id))
+
+    def _current(self, job_id: str, due_at_ms: int) -> Optional[SprayJob]:
+        """The live job for a heap entry, or None if the entry is stale"""
+        job = self._jobs.get(job_id)
+        return job if job is not None and job.due_at_ms == due_at_ms else None
+
+    async def _run(self):
+        while True:
+            try:
+                now = now_ms()
+                while self._timers and self._timers[0][0] <= now:
+                    due_at_ms, priority, job_id = heapq.heappop(self._timers)
+                    if self._current(job_id, due_at_ms) is not None:
+                        heapq.heappush(self._ready, (priority, due_at_ms, job_id))
+
+                if self._ready:
+                    busy = self._busy_until - time.monotonic()
+                    if busy > 0:
+                        await asyncio.sleep(busy)
+                        continue
+                    if await self._weather_suitable():
+                        _, due_at_ms, job_id = heapq.heappop(self._ready)
+                        job = self._current(job_id, due_at_ms)
+                        if job is not None:
+                            await self._dispatch(job)
+                    else:
+                        await self._defer_ready()
+                    continue
+
+                timeout = (self._timers[0][0] - now) / 1000 if self._timers else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Spray scheduler error: {e}")
+                await asyncio.sleep(1)
+
+    async def _weather_suitable(self) -> bool:
+        """Whether conditions allow spraying; the reading is reused for weather_cache_seconds"""
+        if self.weather is None:
+            return True
+        if self.last_weather is None or time.monotonic() - self._weather_checked_at > self.weather_cache_seconds:
+            try:
+                self.last_weather = await self.weather()
+            except Exception as e:
+                logging.error(f"Weather check failed, spraying anyway: {e}")
+                return True
+            self._weather_checked_at = time.monotonic()
+        weather = self.last_weather
+        return (
+            weather.get("spray_suitable", True)
+            and weather.get("wind_speed", 0) <= self.max_wind_speed
+            and weather.get("rain_probability", 0) <= self.max_rain_probability
+        )
+
+    async def _defer_ready(self):
+        """Push every ready job back by defer_minutes (or expire it) in one transaction"""
+        ready, self._ready = self._ready, []
+        jobs = [job for _, due_at_ms, job_id in ready if (job := self._current(job_id, due_at_ms)) is not None]
+        updated = now_ms()
+        due = updated + int(self.defer_minutes * 60000)
+
+        def write(conn: sqlite3.Connection):
+            for job in jobs:
+                if job.deferrals >= self.max_deferrals:
+                    conn.execute(
+                        "UPDATE spray_jobs SET status = 'expired', last_error = ?, updated_at_ms = ? WHERE job_id = ?",
+                        ("Weather unsuitable", updated, job.job_id)
+                    )
+                else:
+                    conn.execute(
+                        "UPDATE spray_jobs SET status = 'pending', due_at_ms = ?, deferrals = deferrals + 1, "
+                        "updated_at_ms = ? WHERE job_id = ?",
+                        (due, updated, job.job_id)
+                    )
+
+        await self.database.write(write)
+        for job in jobs:
+            if job.deferrals >= self.max_deferrals:
+                self._jobs.pop(job.job_id, None)
+                self.expired += 1
+            else:
+                job.deferrals += 1
+                job.due_at_ms = due
+                job.status = "pending"
+                heapq.heappush(self._timers, (due, -job.priority, job.job_id))
+                self.deferred += 1
+        print(f"🌧️ Weather unsuitable, deferred {len(jobs)} spray jobs by {self.defer_minutes:g} min")
+
+    async def _dispatch(self, job: SprayJob):
+        """Claim, execute and record one job"""
+        if job.status == "pending":
+            job.attempts += 1
+            # One sequence number for the job's lifetime: if an earlier attempt sprayed but its ACK
+            # was lost, the controller recognises the retry (or the resend after a crash) and only re-ACKs
+            job.command_seq = zlib.crc32(job.job_id.encode())
+            claimed = await self.database.execute(
+                "UPDATE spray_jobs SET status = 'running', attempts = ?, command_seq = ?, updated_at_ms = ? "
+                "WHERE job_id = ? AND status = 'pending'",
+                (job.attempts, job.command_seq, now_ms(), job.job_id)
+            )
+            if not claimed:
+                self._jobs.pop(job.job_id, None)  # Cancelled meanwhile
+                return
+            job.status = "running"
+
+        self.dispatched += 1
+        started = time.monotonic()
+        try:
+            job.spray_id = await self.execute(job)
+        except Exception as e:
+            job.last_error = str(e)
+            if job.attempts >= self.max_attempts:
+                job.status = "failed"
+                self.failed += 1
+            else:
+                job.status = "pending"
+                job.due_at_ms = now_ms() + int(self.retry_minutes * 60000)
+            logging.error(f"Spray job {job.job_id} attempt {job.attempts} failed: {e}")
+        else:
+            job.status = "done"
+            job.last_error = None
+            self.completed += 1
+            self._busy_until = started + job.duration * 60 + self.spray_gap_seconds
+
+        job.updated_at_ms = now_ms()
+        await self.database.execute(
+            "UPDATE spray_jobs SET status = ?, due_at_ms = ?, spray_id = ?, last_error = ?, updated_at_ms = ? "
+            "WHERE job_id = ?",
+            (job.status, job.due_at_ms, job.spray_id, job.last_error, job.updated_at_ms, job.job_id)
+        )
+        if job.status == "pending":
+            heapq.heappush(self._timers, (job.due_at_ms, -job.priority, job.job_id))
+        else:
+            self._jobs.pop(job.job_id, None)
@@ -0,0 +1,202 @@
+"""
+Write-behind buffer for high-volume inserts
+
+Rows headed for detections / spray_events are queued in memory and flushed
+with executemany in a single transaction (one fsync) when either
+max_batch_size rows are waiting or flush_interval_ms has passed.
+
+Read-your-writes: readers call sync() before querying, which waits for any
+running flush and then flushes whatever is still buffered, so a detection
+that was just accepted is always visible to the next history query.
+
+Durability: enqueue() returns a future that resolves once the rows are
+committed, so callers acknowledge a write only after it is on disk (group
+commit: concurrent requests still share one transaction). If the batch
+fails, its rows are retried one by one:
+- a row the database rejects (constraint violation) fails its future with
+  WriteRejected and is counted in rows_rejected; it is never retried
+- on any other error (locked, I/O, ...) the untried rows go back to the
+  front of the buffer and are retried on the next flush
+No row leaves the buffer without being committed or reported.
+"""
+
+import asyncio
+import logging
+import sqlite3
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from database import Database
+
+
+class WriteRejected(Exception):
+    """Raised through enqueue()'s future when the database refuses a row"""
+
+
+class WriteBehindWriter:
+    """
+    Buffers INSERT rows and writes them in batched transactions
+    """
+
+    def __init__(self, database: Database, max_batch_size: int = 500, flush_interval_ms: float = 250):
+        self.database = database
+        self.max_batch_size = max_batch_size
+        self.flush_interval_ms = flush_interval_ms
+
+        # SQL statement -> (row, commit future) waiting for it, in arrival order
+        self._buffers: Dict[str, List[Tuple[Sequence, asyncio.Future]]] = {}
+        self._buffered = 0
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.rows_rejected = 0
+        self.retried_flushes = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def buffered(self) -> int:
+        """Rows accepted but not yet committed"""
+        return self._buffered
+
+    def start(self):
+        """Start the periodic flusher on the running event loop"""
+        if self._task is not None:
+            return
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write everything still buffered"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+        if self._buffered:
+            logging.error(f"Write-behind stopped with {self._buffered} rows unwritten: {self.last_error}")
+
+    def enqueue(self, sql: str, row: Sequence) -> asyncio.Future:
+        """Buffer one row for an INSERT statement; the future resolves once it is committed"""
+        return self.enqueue_many(sql, [row])
+
+    def enqueue_many(self, sql: str, rows: List[Sequence]) -> asyncio.Future:
+        """Buffer rows for an INSERT statement; the future resolves once all of them are committed"""
+        if self._task is None:
+            raise RuntimeError("Write-behind writer is not started")
+        committed = asyncio.get_running_loop().create_future()
+        self._buffers.setdefault(sql, []).extend((row, committed) for row in rows)
+        self._buffered += len(rows)
+        if not rows:
+            committed.set_result(None)
+        if self._buffered >= self.max_batch_size:
+            self._wakeup.set()
+        return committed
+
+    async def sync(self):
+        """Make every row enqueued before this call visible to readers"""
+        if self._buffered or self._flush_lock.locked():
+            await self.flush()
+
+    async def flush(self):
+        """Commit all buffered rows in one transaction"""
+        async with self._flush_lock:
+            if not self._buffered:
+                return
+            buffers, self._buffers, self._buffered = self._buffers, {}, 0
+
+            try:
+                await self.database.write(lambda conn: self._write_buffers(conn, buffers))
+            except Exception as e:
+                # One bad row must not take the whole batch down with it
+                logging.error(f"Batched write failed, retrying rows individually: {e}")
+                self.last_error = str(e)
+                await self._write_individually(buffers)
+            else:
+                written = [entry for entries in buffers.values() for entry in entries]
+                self.rows_written += len(written)
+                for _, committed in written:
+                    self._resolve(committed)
+
+            self.flushes += 1
+
+    def stats(self) -> Dict[str, float]:
+        """Buffer occupancy, flush counters and write failures"""
+        return {
+            "buffered": self._buffered,
+            "max_batch_size": self.max_batch_size,
+            "flush_interval_ms": self.flush_interval_ms,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "rows_rejected": self.rows_rejected,
+            "retried_flushes": self.retried_flushes,
+            "last_error": self.last_error,
+            "avg_rows_per_flush": round(self.rows_written / self.flushes, 2) if self.flushes else 0.0
+        }
+
+    @staticmethod
+    def _write_buffers(conn: sqlite3.Connection, buffers: Dict[str, List[Tuple[Sequence, asyncio.Future]]]):
+        for sql, entries in buffers.items():
+            conn.executemany(sql, [row for row, _ in entries])
+
+    @staticmethod
+    def _resolve(committed: asyncio.Future, error: Optional[Exception] = None):
+        # Rows of one enqueue_many share a future; the first failure decides it
+        if committed.done():
+            return
+        if error is None:
+            committed.set_result(None)
+        else:
+            committed.set_exception(error)
+
+    async def _write_individually(self, buffers: Dict[str, List[Tuple[Sequence, asyncio.Future]]]):
+        pending = [(sql, row, committed) for sql, entries in buffers.items() for row, committed in entries]
+        for i, (sql, row, committed) in enumerate(pending):
+            try:
+                await self.database.execute(sql, row)
+            except sqlite3.IntegrityError as e:
+                self.rows_rejected += 1
+                self.last_error = str(e)
+                logging.error(f"Database rejected row ({e}), not retrying: {row}")
+                self._resolve(committed, WriteRejected(str(e)))
+                continue
+            except Exception as e:
+                # Not the row's fault: put it and every untried row back for the next flush
+                self.retried_flushes += 1
+                self.last_error = str(e)
+                logging.error(f"Write failed ({e}), keeping {len(pending) - i} rows buffered for retry")
+                self._requeue(pending[i:])
+                return
+            self.rows_written += 1
+            # Shared futures resolve once every row of their enqueue_many call is committed
+            if not any(other is committed for _, _, other in pending[i + 1:]):
+                self._resolve(committed)
+
+    def _requeue(self, pending: List[Tuple[str, Sequence, asyncio.Future]]):
+        """Put rows back in front of anything enqueued since the flush started"""
+        buffers: Dict[str, List[Tuple[Sequence, asyncio.Future]]] = {}
+        for sql, row, committed in pending:
+            buffers.setdefault(sql, []).append((row, committed))
+        for sql, entries in self._buffers.items():
+            buffers.setdefault(sql, []).extend(entries)
+        self._buffers = buffers
+        self._buffered += len(pending)
+
+    async def _run(self):
+        """Flush on the size trigger or the time trigger, whichever fires first"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval_ms / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Write-behind flush failed: {e}")
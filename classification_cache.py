@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Ann Rakshak - Gemini Classification Cache
+=========================================
+
+Persistent cache of Gemini classifications, shared by python_workflow.py
+and demo_test.py. Re-running the same image (tests, retries, resumed
+batches) costs no upload, no generate_content call and no quota.
+
+- keyed by the SHA-256 of the image bytes plus the model name and a hash
+  of the prompt, so changing either one misses instead of returning stale
+  answers
+- stored in a local SQLite file (WAL mode, safe to share between processes
+  and worker threads)
+- bounded by max_bytes; least recently used entries are evicted first
+
+Usage:
+    cache = ClassificationCache("gemini_cache.sqlite3")
+    key = cache.key_for(image_bytes, "gemini-1.5-flash", prompt)
+    result = cache.get(key)
+    if result is None:
+        result = classify(...)
+        cache.put(key, result)
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# Bump when the shape of cached results changes
+CACHE_VERSION = 1
+
+
+class ClassificationCache:
+    """
+    Size-bounded LRU cache of classification results in SQLite
+    """
+
+    def __init__(self, path: str = "gemini_cache.sqlite3", max_bytes: int = 64 * 1024 * 1024):
+        """
+        Args:
+            path: SQLite file holding the cache
+            max_bytes: Total size of cached results before LRU eviction
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS classifications (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+        ''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_classifications_lru ON classifications (last_used_at)")
+
+    @staticmethod
+    def key_for(image_bytes: bytes, model: str, prompt: str) -> str:
+        """Cache key from image content, model and prompt"""
+        image_hash = hashlib.sha256(image_bytes).hexdigest()
+        prompt_hash = hashlib.sha256(prompt.encode()).hexdigest()[:16]
+        return f"v{CACHE_VERSION}:{model}:{prompt_hash}:{image_hash}"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached result for key, or None"""
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM classifications WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE classifications SET last_used_at = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, result: Dict[str, Any]):
+        """Store a result, then evict least recently used entries past max_bytes"""
+        payload = json.dumps(result)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO classifications (key, result, size_bytes, created_at, last_used_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, payload, len(payload), now, now)
+                )
+                self._evict()
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM classifications").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size_bytes FROM classifications ORDER BY last_used_at"):
+            if total - freed <= self.max_bytes:
+                break
+            victims.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM classifications WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    def stats(self) -> Dict[str, Any]:
+        """Entry count, size and hit/miss counters"""
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM classifications"
+            ).fetchone()
+        return {
+            "path": self.path,
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -14,16 +14,19 @@ import argparse
 import time
 import os
 import json
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import google.generativeai as genai
 from PIL import Image
+from classification_cache import ClassificationCache
 
 class AnnRakshakDemo:
-    def __init__(self, gemini_api_key: str):
-        """Initialize demo with Gemini AI"""
+    def __init__(self, gemini_api_key: str, cache_path: Optional[str] = "gemini_cache.sqlite3"):
+        """Initialize demo with Gemini AI (cache_path=None disables the classification cache)"""
         self.gemini_api_key = gemini_api_key
         genai.configure(api_key=gemini_api_key)
-        self.model = genai.GenerativeModel("gemini-1.5-flash")
+        self.model_name = "gemini-1.5-flash"
+        self.model = genai.GenerativeModel(self.model_name)
+        self.cache = ClassificationCache(cache_path) if cache_path else None
         
         print("🌿 Ann Rakshak - Demo Mode")
         print("=" * 40)
@@ -36,10 +39,6 @@ class AnnRakshakDemo:
             if not os.path.exists(image_path):
                 raise FileNotFoundError(f"Image not found: {image_path}")
             
-            # Load image
-            with Image.open(image_path) as img:
-                print(f"📸 Image: {img.size[0]}x{img.size[1]} pixels")
-            
             # Create prompt
             prompt = """
             You are an expert agricultural AI assistant specializing in plant disease detection.
@@ -59,6 +58,20 @@ class AnnRakshakDemo:
             Respond with ONLY one word: "healthy" or "infected"
             """
             
+            # Repeat classifications are served from the local cache (no upload, no quota)
+            cache_key = None
+            if self.cache is not None:
+                with open(image_path, "rb") as f:
+                    cache_key = self.cache.key_for(f.read(), self.model_name, prompt)
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    print(f"⚡ Cached result: {cached['status'].upper()}")
+                    return {**cached, "cached": True, "timestamp": time.time(), "image_path": image_path}
+            
+            # Load image
+            with Image.open(image_path) as img:
+                print(f"📸 Image: {img.size[0]}x{img.size[1]} pixels")
+            
             # Get AI response
             response = self.model.generate_content([prompt, genai.upload_file(image_path)])
             result_text = response.text.strip().lower()
@@ -74,6 +87,9 @@ class AnnRakshakDemo:
                 "timestamp": time.time()
             }
             
+            if cache_key is not None:
+                self.cache.put(cache_key, result)
+            
             print(f"✅ Result: {status.upper()}")
             print(f"🎯 Confidence: {confidence:.1%}")
             
@@ -167,6 +183,8 @@ def main():
     parser.add_argument("--gemini-key", required=True, help="Gemini API key")
     parser.add_argument("--spray-duration", type=int, default=2000, help="Spray duration (ms)")
     parser.add_argument("--create-sample", action="store_true", help="Create sample image")
+    parser.add_argument("--cache", default="gemini_cache.sqlite3", help="Classification cache file")
+    parser.add_argument("--no-cache", action="store_true", help="Always call Gemini")
     
     args = parser.parse_args()
     
@@ -187,7 +205,7 @@ def main():
         return
     
     # Run demo
-    demo = AnnRakshakDemo(args.gemini_key)
+    demo = AnnRakshakDemo(args.gemini_key, cache_path=None if args.no_cache else args.cache)
     demo.run_demo(image_path, args.spray_duration)
 
 if __name__ == "__main__":
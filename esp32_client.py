@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Ann Rakshak - Async ESP32 Fleet Client
+=====================================
+
+Talks to many ESP32 spray nodes (esp32_spray_control.ino) at once:
+- one httpx.AsyncClient with keep-alive connection pooling for every device
+- spray / status commands fanned out concurrently, bounded by max_concurrency
+- per-device timeouts, retries with jittered exponential backoff
+- a circuit breaker per device, so a dead node is skipped instead of
+  costing a timeout on every command
+- aggregated results per fan-out
+
+Spray commands are only retried when the request never reached the device
+(connection failures); a POST that may have been received is not resent,
+so a slow node cannot be made to spray twice.
+
+Usage:
+    async with ESP32Client(["192.168.1.101", "192.168.1.102"]) as client:
+        report = await client.spray_all(duration=2000, zone_id="field_1")
+"""
+
+import asyncio
+import random
+import time
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Union
+
+import httpx
+
+# Failures where the request was never sent, so even a spray command is safe to retry
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after failure_threshold consecutive failures; after
+    reset_timeout one trial request is let through (half-open)
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now"""
+        if self.state == "half_open":
+            self.opened_at = time.monotonic()  # Only one trial per reset_timeout
+            return True
+        return self.state == "closed"
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class ESP32Client:
+    """
+    Pooled, concurrent HTTP client for a fleet of ESP32 spray nodes
+    """
+
+    def __init__(self, devices: Union[Mapping[str, str], Iterable[str]], port: int = 80,
+                 timeout: float = 5.0, spray_timeout: float = 10.0, retries: int = 2,
+                 backoff: float = 0.25, max_concurrency: int = 32, max_connections: int = 64,
+                 failure_threshold: int = 3, reset_timeout: float = 30.0):
+        """
+        Args:
+            devices: device id -> base URL, or ESP32 IP addresses
+            port: Port of the ESP32 web servers (when devices are IPs)
+            timeout: Per-device timeout for status requests (seconds)
+            spray_timeout: Per-device timeout for spray requests (seconds)
+            retries: Extra attempts after a failed request
+            backoff: Base delay for jittered exponential backoff (seconds)
+            max_concurrency: Devices contacted at the same time during a fan-out
+            max_connections: Size of the keep-alive connection pool
+            failure_threshold: Consecutive failures that open a device's circuit
+            reset_timeout: Seconds before an open circuit allows a trial request
+        """
+        if isinstance(devices, Mapping):
+            self.devices = dict(devices)
+        else:
+            self.devices = {ip: f"http://{ip}:{port}" for ip in devices}
+        self.timeout = timeout
+        self.spray_timeout = spray_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.breakers = {device_id: CircuitBreaker(failure_threshold, reset_timeout) for device_id in self.devices}
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def __aenter__(self) -> "ESP32Client":
+        self._client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections)
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        """Close pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def spray(self, device_id: str, duration: int = 2000, zone_id: str = "field_1") -> Dict[str, Any]:
+        """Start a spray of `duration` milliseconds on one device"""
+        payload = {"duration": duration, "zone_id": zone_id, "timestamp": time.time()}
+        return await self._request(device_id, "POST", "/spray", payload, self.spray_timeout, idempotent=False)
+
+    async def status(self, device_id: str) -> Dict[str, Any]:
+        """Current status of one device"""
+        return await self._request(device_id, "GET", "/status", None, self.timeout, idempotent=True)
+
+    async def spray_all(self, duration: int = 2000, zone_id: str = "field_1",
+                        device_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Spray on many devices concurrently"""
+        return await self._fan_out(lambda device_id: self.spray(device_id, duration, zone_id), device_ids)
+
+    async def status_all(self, device_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Status of many devices concurrently"""
+        return await self._fan_out(self.status, device_ids)
+
+    async def _fan_out(self, command, device_ids: Optional[List[str]]) -> Dict[str, Any]:
+        device_ids = list(device_ids) if device_ids is not None else list(self.devices)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        start = time.perf_counter()
+
+        async def run(device_id: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await command(device_id)
+
+        results = await asyncio.gather(*(run(device_id) for device_id in device_ids))
+        by_device = dict(zip(device_ids, results))
+        return {
+            "total": len(device_ids),
+            "succeeded": sum(1 for r in results if r["success"]),
+            "failed": sum(1 for r in results if not r["success"] and not r.get("circuit_open")),
+            "circuit_open": sum(1 for r in results if r.get("circuit_open")),
+            "elapsed_seconds": round(time.perf_counter() - start, 3),
+            "results": by_device
+        }
+
+    async def _request(self, device_id: str, method: str, path: str, payload: Optional[Dict[str, Any]],
+                       timeout: float, idempotent: bool) -> Dict[str, Any]:
+        """One command to one device, with retries and circuit breaking"""
+        if self._client is None:
+            raise RuntimeError("ESP32Client is not open; use 'async with ESP32Client(...)'")
+        if device_id not in self.devices:
+            return {"device_id": device_id, "success": False, "error": "Unknown device", "attempts": 0}
+
+        breaker = self.breakers[device_id]
+        if not breaker.allow():
+            return {"device_id": device_id, "success": False, "circuit_open": True,
+                    "error": "Circuit open after repeated failures", "attempts": 0}
+
+        url = self.devices[device_id] + path
+        start = time.perf_counter()
+        error = None
+        attempt = 0
+        for attempt in range(1, self.retries + 2):
+            try:
+                response = await self._client.request(method, url, json=payload, timeout=timeout)
+                if response.status_code < 500:
+                    breaker.record_success()
+                    ok = response.status_code == 200
+                    return {
+                        "device_id": device_id,
+                        "success": ok,
+                        "response": response.json() if ok else None,
+                        "error": None if ok else f"HTTP {response.status_code}",
+                        "attempts": attempt,
+                        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)
+                    }
+                error = f"HTTP {response.status_code}"
+                retryable = idempotent
+            except httpx.HTTPError as e:
+                error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+                retryable = idempotent or isinstance(e, NOT_SENT_ERRORS)
+            except ValueError as e:
+                error = f"Invalid response: {e}"
+                retryable = False
+
+            if not retryable or attempt > self.retries:
+                break
+            # Full jitter spreads retries from many clients instead of synchronizing them
+            await asyncio.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+
+        breaker.record_failure()
+        return {
+            "device_id": device_id,
+            "success": False,
+            "error": error,
+            "attempts": attempt,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)
+        }
+
+    def circuit_states(self) -> Dict[str, str]:
+        """Breaker state per device"""
+        return {device_id: breaker.state for device_id, breaker in self.breakers.items()}
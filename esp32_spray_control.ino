@@ -53,6 +53,7 @@ unsigned long sprayStartTime = 0;
 int currentSprayDuration = 0;
 int sprayCount = 0;
 String lastCommand = "";
+String lastSerialSeq = "";   // Sequence number of the last serial command executed
 
 // Function Declarations
 void setupWiFi();
@@ -61,7 +62,9 @@ void setupMQTT();
 void handleSprayCommand();
 void handleStatusRequest();
 void handleRoot();
-void startSpray(int duration);
+void handleSerialCommand(String line);
+void sendSerialReply(const String& seq, bool ok, const String& reason);
+bool startSpray(int duration);
 void stopSpray();
 void updateSprayStatus();
 void mqttCallback(char* topic, byte* payload, unsigned int length);
@@ -113,24 +116,9 @@ void loop() {
   
   // Handle serial commands
   if (Serial.available()) {
-    String command = Serial.readStringUntil('\n');
-    command.trim();
-    
-    if (command.startsWith("RUN:")) {
-      // Parse the time value
-      String timeStr = command.substring(4);
-      int timeSeconds = timeStr.toInt();
-      
-      if (timeSeconds > 0 && timeSeconds <= 60) {
-        int durationMs = timeSeconds * 1000;
-        Serial.println("🌿 Serial command received: RUN:" + String(timeSeconds) + "s");
-        startSpray(durationMs);
-      } else {
-        Serial.println("❌ Invalid time value: " + String(timeSeconds));
-      }
-    } else {
-      Serial.println("❌ Unknown command: " + command);
-    }
+    String line = Serial.readStringUntil('\n');
+    line.trim();
+    handleSerialCommand(line);
   }
   
   // Check manual spray button
@@ -371,10 +359,10 @@ void handleStatusRequest() {
   server.send(200, "application/json", response);
 }
 
-void startSpray(int duration) {
+bool startSpray(int duration) {
   if (isSpraying) {
     Serial.println("⚠️ Spray already in progress");
-    return;
+    return false;
   }
   
   isSpraying = true;
@@ -400,6 +388,7 @@ void startSpray(int duration) {
     serializeJson(statusDoc, statusMsg);
     mqttClient.publish(mqtt_status_topic, statusMsg.c_str());
   }
+  return true;
 }
 
 void stopSpray() {
@@ -432,6 +421,71 @@ void stopSpray() {
   }
 }
 
+/*
+ * Serial protocol with the API's actuator service:
+ *   host -> device: RUN:<seconds>#<seq>, STOP#<seq>, PING#<seq>
+ *   device -> host: ACK:<seq> or NAK:<seq>:<reason>
+ * The host retries unacknowledged commands with the same sequence number,
+ * so a repeated sequence number is acknowledged again without re-running it.
+ * Commands without "#<seq>" are still accepted (no reply is sent).
+ */
+void handleSerialCommand(String line) {
+  if (line.length() == 0) {
+    return;
+  }
+  
+  String command = line;
+  String seq = "";
+  int hashIndex = line.lastIndexOf('#');
+  if (hashIndex >= 0) {
+    command = line.substring(0, hashIndex);
+    seq = line.substring(hashIndex + 1);
+  }
+  
+  if (seq.length() > 0 && seq == lastSerialSeq) {
+    sendSerialReply(seq, true, "");
+    return;
+  }
+  
+  if (command.startsWith("RUN:")) {
+    // Parse the time value
+    int timeSeconds = command.substring(4).toInt();
+    
+    if (timeSeconds > 0 && timeSeconds <= 60) {
+      Serial.println("🌿 Serial command received: RUN:" + String(timeSeconds) + "s");
+      if (startSpray(timeSeconds * 1000)) {
+        lastSerialSeq = seq;
+        sendSerialReply(seq, true, "");
+      } else {
+        sendSerialReply(seq, false, "busy");
+      }
+    } else {
+      Serial.println("❌ Invalid time value: " + String(timeSeconds));
+      sendSerialReply(seq, false, "invalid_duration");
+    }
+  } else if (command == "STOP") {
+    stopSpray();
+    lastSerialSeq = seq;
+    sendSerialReply(seq, true, "");
+  } else if (command == "PING") {
+    sendSerialReply(seq, true, "");
+  } else {
+    Serial.println("❌ Unknown command: " + command);
+    sendSerialReply(seq, false, "unknown_command");
+  }
+}
+
+void sendSerialReply(const String& seq, bool ok, const String& reason) {
+  if (seq.length() == 0) {
+    return;
+  }
+  if (ok) {
+    Serial.println("ACK:" + seq);
+  } else {
+    Serial.println("NAK:" + seq + ":" + reason);
+  }
+}
+
 void updateSprayStatus() {
   if (isSpraying && (millis() - sprayStartTime >= currentSprayDuration)) {
     stopSpray();
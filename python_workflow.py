@@ -13,18 +13,45 @@ pip install google-generativeai requests pillow
 
 Usage:
 python python_workflow.py --image leaf.jpg --esp32-ip 192.168.1.100
+python python_workflow.py --image leaf.jpg --devices 192.168.1.101,192.168.1.102
+python python_workflow.py --image-dir field_scans/ --concurrency 4 --rpm 15
 """
 
 import argparse
+import asyncio
 import time
 import os
 import requests
-from PIL import Image
 import google.generativeai as genai
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
+
+from esp32_client import ESP32Client
+from classification_cache import ClassificationCache
+from upload_payload import prepare_payload, gemini_part, describe
+from workflow_batch import BatchRunner
+
+CLASSIFICATION_PROMPT = """
+            You are an expert agricultural AI assistant specializing in plant disease detection.
+            
+            Analyze this plant leaf image and classify it as:
+            - "healthy" - if the plant appears healthy with no visible diseases or pests
+            - "infected" - if you detect any diseases, pests, or abnormalities
+            
+            Consider these common plant diseases:
+            - Powdery mildew (white powdery coating)
+            - Leaf spot (dark spots on leaves)
+            - Rust (orange/brown pustules)
+            - Blight (rapid wilting/browning)
+            - Pest damage (holes, chewed edges)
+            - Nutrient deficiencies (yellowing, stunted growth)
+            
+            Respond with ONLY one word: "healthy" or "infected"
+            """
 
 class AnnRakshakWorkflow:
-    def __init__(self, gemini_api_key: str, esp32_ip: str = "192.168.1.100", esp32_port: int = 80):
+    def __init__(self, gemini_api_key: str, esp32_ip: str = "192.168.1.100", esp32_port: int = 80,
+                 esp32_devices: Optional[List[str]] = None, cache_path: Optional[str] = "gemini_cache.sqlite3",
+                 max_image_side: int = 1024, image_quality: int = 85, image_format: str = "JPEG"):
         """
         Initialize the Ann Rakshak workflow
         
@@ -32,25 +59,79 @@ class AnnRakshakWorkflow:
             gemini_api_key: Your Gemini API key
             esp32_ip: IP address of ESP32 device
             esp32_port: Port of ESP32 web server
+            esp32_devices: IP addresses of every sprayer node; when given, spray
+                and status commands fan out to all of them concurrently
+            cache_path: Classification cache file (None disables the cache)
+            max_image_side: Longest side of the image sent to Gemini (pixels)
+            image_quality: JPEG/WebP quality of the image sent to Gemini
+            image_format: "JPEG" or "WEBP"
         """
         self.gemini_api_key = gemini_api_key
         self.esp32_ip = esp32_ip
         self.esp32_port = esp32_port
         self.esp32_base_url = f"http://{esp32_ip}:{esp32_port}"
+        self.esp32_devices = esp32_devices
+        
+        # Keep-alive session: repeated commands reuse one TCP connection
+        self.session = requests.Session()
         
         # Configure Gemini AI
         genai.configure(api_key=gemini_api_key)
-        self.model = genai.GenerativeModel("gemini-1.5-flash")
+        self.model_name = "gemini-1.5-flash"
+        self.model = genai.GenerativeModel(self.model_name)
+        
+        # Upload payload settings; part of the cache key since they change what the model sees
+        self.payload_options = {"max_side": max_image_side, "quality": image_quality, "fmt": image_format}
+        self.payload_signature = f"{image_format.lower()}{max_image_side}q{image_quality}"
+        
+        # Persistent classification cache (None disables it)
+        self.cache = ClassificationCache(cache_path) if cache_path else None
         
         print("🌿 Ann Rakshak - Python Workflow Initialized")
-        print(f"📡 ESP32 URL: {self.esp32_base_url}")
+        if esp32_devices:
+            print(f"📡 ESP32 fleet: {len(esp32_devices)} devices")
+        else:
+            print(f"📡 ESP32 URL: {self.esp32_base_url}")
+    
+    def _cache_key(self, image_path: str) -> str:
+        """Classification cache key for an image under the current model and payload settings"""
+        with open(image_path, "rb") as f:
+            return self.cache.key_for(f.read(), f"{self.model_name}:{self.payload_signature}", CLASSIFICATION_PROMPT)
     
-    def classify_plant(self, image_path: str) -> Dict[str, Any]:
+    def cached_classification(self, image_path: str) -> Optional[Dict[str, Any]]:
+        """
+        Cached classification for an image, without calling Gemini
+        
+        Args:
+            image_path: Path to the plant image
+            
+        Returns:
+            The cached result (marked cached, with this lookup's timing), or None on a miss
+        """
+        if self.cache is None or not os.path.exists(image_path):
+            return None
+        stage = time.perf_counter()
+        cached = self.cache.get(self._cache_key(image_path))
+        if cached is None:
+            return None
+        # Nothing was sent this run: drop the original run's payload stats and timings
+        return {
+            **cached,
+            "cached": True,
+            "payload": None,
+            "timings": {"cache_lookup_ms": round((time.perf_counter() - stage) * 1000, 1)},
+            "timestamp": time.time(),
+            "image_path": image_path
+        }
+    
+    def classify_plant(self, image_path: str, check_cache: bool = True) -> Dict[str, Any]:
         """
         Send plant image to Gemini API for classification
         
         Args:
             image_path: Path to the plant image
+            check_cache: Look the image up in the classification cache first
+                (False when the caller already did); results are still cached
             
         Returns:
             Dictionary with classification results
@@ -62,31 +143,28 @@ class AnnRakshakWorkflow:
             if not os.path.exists(image_path):
                 raise FileNotFoundError(f"Image file not found: {image_path}")
             
-            # Load and validate image
-            with Image.open(image_path) as img:
-                print(f"📸 Image loaded: {img.size[0]}x{img.size[1]} pixels")
+            # Repeat classifications are served from the local cache (no upload, no quota)
+            if check_cache:
+                cached = self.cached_classification(image_path)
+                if cached is not None:
+                    print(f"⚡ Cached result: {cached['status'].upper()}")
+                    return cached
+            cache_key = self._cache_key(image_path) if self.cache is not None else None
             
-            # Create the prompt
-            prompt = """
-            You are an expert agricultural AI assistant specializing in plant disease detection.
-            
-            Analyze this plant leaf image and classify it as:
-            - "healthy" - if the plant appears healthy with no visible diseases or pests
-            - "infected" - if you detect any diseases, pests, or abnormalities
-            
-            Consider these common plant diseases:
-            - Powdery mildew (white powdery coating)
-            - Leaf spot (dark spots on leaves)
-            - Rust (orange/brown pustules)
-            - Blight (rapid wilting/browning)
-            - Pest damage (holes, chewed edges)
-            - Nutrient deficiencies (yellowing, stunted growth)
-            
-            Respond with ONLY one word: "healthy" or "infected"
-            """
+            # Load, downsize and re-encode; small payloads go inline with the prompt (no upload round trip)
+            payload = prepare_payload(image_path, **self.payload_options)
+            print(f"📸 Image loaded: {payload['original_size'][0]}x{payload['original_size'][1]} pixels, "
+                  f"sending {payload['payload_size'][0]}x{payload['payload_size'][1]} "
+                  f"({payload['original_bytes'] / 1024:.0f} KB → {payload['payload_bytes'] / 1024:.0f} KB, "
+                  f"{'inline' if payload['inline'] else 'upload'})")
             
             # Generate content using Gemini
-            response = self.model.generate_content([prompt, genai.upload_file(image_path)])
+            stage = time.perf_counter()
+            image_part = gemini_part(payload, genai)
+            upload_ms = (time.perf_counter() - stage) * 1000
+            stage = time.perf_counter()
+            response = self.model.generate_content([CLASSIFICATION_PROMPT, image_part])
+            generate_ms = (time.perf_counter() - stage) * 1000
             result_text = response.text.strip().lower()
             
             # Determine status
@@ -98,9 +176,19 @@ class AnnRakshakWorkflow:
                 "confidence": round(confidence, 2),
                 "raw_response": result_text,
                 "timestamp": time.time(),
-                "image_path": image_path
+                "image_path": image_path,
+                "payload": describe(payload),
+                "timings": {
+                    "decode_ms": payload["decode_ms"],
+                    "encode_ms": payload["encode_ms"],
+                    "upload_ms": round(upload_ms, 1),
+                    "generate_ms": round(generate_ms, 1)
+                }
             }
             
+            if cache_key is not None:
+                self.cache.put(cache_key, result)
+            
             print(f"✅ Classification complete: {status.upper()}")
             print(f"🎯 Confidence: {confidence:.1%}")
             
@@ -137,7 +225,7 @@ class AnnRakshakWorkflow:
             }
             
             # Send HTTP request to ESP32
-            response = requests.post(
+            response = self.session.post(
                 f"{self.esp32_base_url}/spray",
                 json=spray_data,
                 timeout=10
@@ -179,7 +267,7 @@ class AnnRakshakWorkflow:
             Dictionary with ESP32 status
         """
         try:
-            response = requests.get(f"{self.esp32_base_url}/status", timeout=5)
+            response = self.session.get(f"{self.esp32_base_url}/status", timeout=5)
             
             if response.status_code == 200:
                 return response.json()
@@ -189,6 +277,49 @@ class AnnRakshakWorkflow:
         except requests.exceptions.RequestException as e:
             return {"error": str(e)}
     
+    def esp32_client(self) -> ESP32Client:
+        """Pooled async client for the configured sprayer fleet"""
+        return ESP32Client(self.esp32_devices or [self.esp32_ip], port=self.esp32_port)
+    
+    def trigger_spray_fleet(self, duration: int = 2000, zone_id: str = "field_1") -> Dict[str, Any]:
+        """
+        Send spray command to every ESP32 in the fleet concurrently
+        
+        Args:
+            duration: Spray duration in milliseconds
+            zone_id: Field zone identifier
+            
+        Returns:
+            Aggregated results with one entry per device
+        """
+        async def run():
+            async with self.esp32_client() as client:
+                return await client.spray_all(duration, zone_id)
+        
+        print(f"🌿 Triggering spray for {duration}ms in zone {zone_id} on {len(self.esp32_devices)} devices")
+        report = asyncio.run(run())
+        print(f"✅ {report['succeeded']}/{report['total']} devices spraying ({report['elapsed_seconds']:.2f}s)")
+        for device_id, result in report["results"].items():
+            if not result["success"]:
+                print(f"❌ {device_id}: {result['error']}")
+        report["success"] = report["succeeded"] == report["total"]
+        if not report["success"]:
+            report["error"] = f"{report['total'] - report['succeeded']} devices failed"
+        return report
+    
+    def get_fleet_status(self) -> Dict[str, Any]:
+        """
+        Get current status from every ESP32 in the fleet concurrently
+        
+        Returns:
+            Aggregated results with one status per device
+        """
+        async def run():
+            async with self.esp32_client() as client:
+                return await client.status_all()
+        
+        return asyncio.run(run())
+    
     def run_complete_workflow(self, image_path: str, spray_duration: int = 2000) -> Dict[str, Any]:
         """
         Run the complete workflow: classify → spray if infected
@@ -225,7 +356,10 @@ class AnnRakshakWorkflow:
             
             # Step 3: Trigger spray
             print("\n📋 Step 2: Trigger Spray System")
-            spray_result = self.trigger_spray(spray_duration)
+            if self.esp32_devices:
+                spray_result = self.trigger_spray_fleet(spray_duration)
+            else:
+                spray_result = self.trigger_spray(spray_duration)
             workflow_result["spray"] = spray_result
             
             if spray_result["success"]:
@@ -238,7 +372,7 @@ class AnnRakshakWorkflow:
         
         # Step 4: Get final ESP32 status
         print("\n📋 Step 3: System Status Check")
-        status = self.get_esp32_status()
+        status = self.get_fleet_status() if self.esp32_devices else self.get_esp32_status()
         workflow_result["final_status"] = status
         
         workflow_result["end_time"] = time.time()
@@ -251,27 +385,64 @@ class AnnRakshakWorkflow:
 
 def main():
     parser = argparse.ArgumentParser(description="Ann Rakshak - Plant Disease Detection & Spray Control")
-    parser.add_argument("--image", required=True, help="Path to plant image file")
+    images = parser.add_mutually_exclusive_group()
+    images.add_argument("--image", help="Path to plant image file")
+    images.add_argument("--image-dir", help="Directory of plant images to process in batch (recursive)")
+    images.add_argument("--glob", help="Glob of plant images to process in batch, e.g. 'scans/**/*.jpg'")
     parser.add_argument("--gemini-key", required=True, help="Gemini API key")
     parser.add_argument("--esp32-ip", default="192.168.1.100", help="ESP32 IP address")
     parser.add_argument("--esp32-port", type=int, default=80, help="ESP32 port")
+    parser.add_argument("--devices", help="Comma-separated ESP32 IPs to control concurrently (overrides --esp32-ip)")
     parser.add_argument("--spray-duration", type=int, default=2000, help="Spray duration in milliseconds")
     parser.add_argument("--status-only", action="store_true", help="Only check ESP32 status")
+    parser.add_argument("--max-image-side", type=int, default=1024, help="Longest side of the image sent to Gemini")
+    parser.add_argument("--image-quality", type=int, default=85, help="JPEG/WebP quality of the image sent to Gemini")
+    parser.add_argument("--image-format", choices=["JPEG", "WEBP"], default="JPEG", help="Encoding of the image sent to Gemini")
+    parser.add_argument("--cache", default="gemini_cache.sqlite3", help="Classification cache file")
+    parser.add_argument("--no-cache", action="store_true", help="Always call Gemini")
+    parser.add_argument("--concurrency", type=int, default=4, help="Batch mode: images in flight at once")
+    parser.add_argument("--rpm", type=float, default=15, help="Batch mode: Gemini requests per minute")
+    parser.add_argument("--results", default="workflow_results.ndjson", help="Batch mode: NDJSON result log / checkpoint")
+    parser.add_argument("--no-resume", action="store_true", help="Batch mode: start over instead of skipping completed images")
+    parser.add_argument("--no-spray", action="store_true", help="Batch mode: classify only")
     
     args = parser.parse_args()
+    if not (args.status_only or args.image or args.image_dir or args.glob):
+        parser.error("one of --image, --image-dir or --glob is required")
     
     # Initialize workflow
     workflow = AnnRakshakWorkflow(
         gemini_api_key=args.gemini_key,
         esp32_ip=args.esp32_ip,
-        esp32_port=args.esp32_port
+        esp32_port=args.esp32_port,
+        esp32_devices=[ip.strip() for ip in args.devices.split(",") if ip.strip()] if args.devices else None,
+        cache_path=None if args.no_cache else args.cache,
+        max_image_side=args.max_image_side,
+        image_quality=args.image_quality,
+        image_format=args.image_format
     )
     
     if args.status_only:
         # Just check ESP32 status
         print("📡 Checking ESP32 status...")
-        status = workflow.get_esp32_status()
+        status = workflow.get_fleet_status() if workflow.esp32_devices else workflow.get_esp32_status()
         print(f"ESP32 Status: {status}")
+    elif args.image_dir or args.glob:
+        # Batch mode: one process, one Gemini setup, bounded-concurrency pipeline
+        runner = BatchRunner(
+            workflow,
+            results_path=args.results,
+            concurrency=args.concurrency,
+            rate_per_minute=args.rpm,
+            spray_duration=args.spray_duration,
+            spray=not args.no_spray,
+            resume=not args.no_resume
+        )
+        summary = runner.run(image_dir=args.image_dir, pattern=args.glob)
+        
+        print("\n📊 BATCH SUMMARY:")
+        for key, value in summary.items():
+            print(f"{key}: {value}")
     else:
         # Run complete workflow
         result = workflow.run_complete_workflow(args.image, args.spray_duration)
@@ -279,7 +450,8 @@ def main():
         # Print summary
         print("\n📊 WORKFLOW SUMMARY:")
         print(f"Image: {result['image_path']}")
-        print(f"Classification: {result['classification']['status']}")
+        print(f"Classification: {result['classification']['status']}"
+              f"{' (cached)' if result['classification'].get('cached') else ''}")
         print(f"Confidence: {result['classification']['confidence']:.1%}")
         
         if "spray" in result:
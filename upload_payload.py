@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Ann Rakshak - Gemini Upload Payload
+===================================
+
+Shrinks plant photos before they are sent to Gemini. Phone photos are
+8-12 MB, but the model sees images at roughly 768-1024 px per tile, so
+most of those bytes only add upload time on a rural uplink.
+
+1. decode at reduced resolution (JPEG draft mode scales during decoding,
+   much cheaper than decoding the full frame), applying EXIF orientation
+2. downsize so the longest side is at most max_side
+3. re-encode as JPEG or WebP at a tuned quality
+4. when the result fits inline_max_bytes, send it inline with the prompt
+   instead of a separate genai.upload_file round trip
+
+If re-encoding would not make the image smaller, the original bytes are
+sent unchanged.
+"""
+
+import io
+import os
+import tempfile
+import time
+from typing import Any, Dict
+
+from PIL import Image, ImageOps
+
+FORMATS = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+ORIGINAL_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+SUFFIXES = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp"}
+
+
+def prepare_payload(image_path: str, max_side: int = 1024, quality: int = 85, fmt: str = "JPEG",
+                    inline_max_bytes: int = 4 * 1024 * 1024) -> Dict[str, Any]:
+    """
+    Downsized, re-encoded image bytes ready for Gemini
+
+    Args:
+        image_path: Path to the original photo
+        max_side: Longest side of the payload in pixels
+        quality: JPEG/WebP quality
+        fmt: "JPEG" or "WEBP"
+        inline_max_bytes: Largest payload sent inline instead of uploaded
+
+    Returns:
+        mime_type, data, inline flag, sizes and per-step timings
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"fmt must be one of {', '.join(FORMATS)}")
+
+    start = time.perf_counter()
+    with open(image_path, "rb") as f:
+        original = f.read()
+
+    with Image.open(io.BytesIO(original)) as img:
+        original_format = img.format
+        original_size = img.size
+        img.draft("RGB", (max_side, max_side))  # No-op for formats without reduced decoding
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        decode_ms = (time.perf_counter() - start) * 1000
+
+        stage = time.perf_counter()
+        buffer = io.BytesIO()
+        if fmt == "JPEG":
+            img.save(buffer, "JPEG", quality=quality, optimize=True)
+        else:
+            img.save(buffer, "WEBP", quality=quality, method=4)
+        encode_ms = (time.perf_counter() - stage) * 1000
+        size = img.size
+
+    data, mime_type = buffer.getvalue(), FORMATS[fmt]
+    if len(data) >= len(original) and original_format in ORIGINAL_MIME_TYPES:
+        data, mime_type, size = original, ORIGINAL_MIME_TYPES[original_format], original_size
+
+    return {
+        "mime_type": mime_type,
+        "data": data,
+        "inline": len(data) <= inline_max_bytes,
+        "original_bytes": len(original),
+        "payload_bytes": len(data),
+        "bytes_saved": len(original) - len(data),
+        "original_size": list(original_size),
+        "payload_size": list(size),
+        "decode_ms": round(decode_ms, 1),
+        "encode_ms": round(encode_ms, 1)
+    }
+
+
+def gemini_part(payload: Dict[str, Any], genai) -> Any:
+    """Inline blob for generate_content, or an uploaded file when the payload is too large"""
+    if payload["inline"]:
+        return {"mime_type": payload["mime_type"], "data": payload["data"]}
+
+    with tempfile.NamedTemporaryFile(suffix=SUFFIXES[payload["mime_type"]], delete=False) as tmp:
+        tmp.write(payload["data"])
+    try:
+        return genai.upload_file(tmp.name, mime_type=payload["mime_type"])
+    finally:
+        os.unlink(tmp.name)
+
+
+def describe(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Payload stats without the image bytes (for results and logs)"""
+    return {key: value for key, value in payload.items() if key != "data"}
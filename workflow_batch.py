@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Ann Rakshak - Batch Workflow
+============================
+
+Streams a directory (or glob) of plant images through the workflow in one
+process, so Gemini and the ESP32 connection pool are set up once:
+
+    discover -> cache -> [rate limit] -> classify -> decide -> spray -> log
+
+- bounded concurrency: `concurrency` workers pull from a bounded queue, so
+  memory stays flat however many images there are
+- a token-bucket rate limiter keeps Gemini calls within the API quota
+  (requests per minute, with a small burst); cached classifications are
+  looked up first and never wait for a token
+- every finished image is appended to an NDJSON log with per-stage
+  timings; the log doubles as the checkpoint, so a rerun skips images
+  that already completed and retries ones that errored
+
+Usage (via python_workflow.py):
+python python_workflow.py --image-dir field_scans/ --gemini-key KEY --concurrency 4 --rpm 15
+"""
+
+import asyncio
+import glob
+import json
+import os
+import time
+from typing import Any, Dict, Iterator, Optional, Set
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def discover_images(image_dir: Optional[str] = None, pattern: Optional[str] = None) -> Iterator[str]:
+    """Image paths under a directory (recursively) or matching a glob, in sorted order"""
+    if pattern:
+        paths = glob.iglob(pattern, recursive=True)
+    else:
+        paths = (os.path.join(root, name) for root, _, names in os.walk(image_dir) for name in names)
+    for path in sorted(paths):
+        if path.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(path):
+            yield path
+
+
+def completed_images(results_path: str) -> Set[str]:
+    """Images with a non-error record in an existing results log"""
+    done = set()
+    if not os.path.exists(results_path):
+        return done
+    with open(results_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Torn last line from an interrupted run
+            if record.get("status") != "error":
+                done.add(record["image_path"])
+    return done
+
+
+class RateLimiter:
+    """
+    Async token bucket: `rate_per_minute` tokens per minute, up to `burst` at once
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int = 1):
+        self.interval = 60.0 / rate_per_minute
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait for a token"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) / self.interval)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) * self.interval)
+
+
+class BatchRunner:
+    """
+    Classify -> decide -> spray pipeline over many images
+    """
+
+    def __init__(self, workflow, results_path: str, concurrency: int = 4, rate_per_minute: float = 15,
+                 burst: int = 2, spray_duration: int = 2000, zone_id: str = "field_1", spray: bool = True,
+                 resume: bool = True):
+        """
+        Args:
+            workflow: AnnRakshakWorkflow providing the Gemini model and ESP32 settings
+            results_path: NDJSON log of per-image results (also the checkpoint)
+            concurrency: Images in flight at once
+            rate_per_minute: Gemini requests allowed per minute
+            burst: Gemini requests allowed back to back
+            spray_duration: Spray duration for infected plants (ms)
+            zone_id: Field zone identifier sent with spray commands
+            spray: Whether infected plants trigger a spray
+            resume: Skip images already completed in results_path
+        """
+        self.workflow = workflow
+        self.results_path = results_path
+        self.concurrency = concurrency
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.spray_duration = spray_duration
+        self.zone_id = zone_id
+        self.spray = spray
+        self.resume = resume
+        self.counts = {"healthy": 0, "infected": 0, "error": 0, "sprayed": 0, "spray_failed": 0, "skipped": 0}
+
+    def run(self, image_dir: Optional[str] = None, pattern: Optional[str] = None) -> Dict[str, Any]:
+        """Process every image; returns a summary"""
+        return asyncio.run(self._run(discover_images(image_dir, pattern)))
+
+    async def _run(self, images: Iterator[str]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        done = completed_images(self.results_path) if self.resume else set()
+        limiter = RateLimiter(self.rate_per_minute, self.burst)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        with open(self.results_path, "a" if self.resume else "w") as log:
+            async with self.workflow.esp32_client() as esp32:
+                async def worker():
+                    while True:
+                        image_path = await queue.get()
+                        if image_path is None:
+                            return
+                        try:
+                            record = await self._process(image_path, limiter, esp32)
+                        except Exception as e:
+                            # A dead worker would leave the producer blocked on the full queue
+                            record = {"image_path": image_path, "status": "error",
+                                      "error": f"{type(e).__name__}: {e}", "timestamp": time.time()}
+                        self.counts[record["status"]] = self.counts.get(record["status"], 0) + 1
+                        log.write(json.dumps(record) + "\n")
+                        log.flush()
+
+                workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+                try:
+                    for image_path in images:
+                        if image_path in done:
+                            self.counts["skipped"] += 1
+                            continue
+                        await queue.put(image_path)
+                    for _ in workers:
+                        await queue.put(None)
+                    await asyncio.gather(*workers)
+                finally:
+                    for task in workers:
+                        task.cancel()
+
+        return {
+            **self.counts,
+            "processed": self.counts["healthy"] + self.counts["infected"] + self.counts["error"],
+            "elapsed_seconds": round(time.perf_counter() - start, 2),
+            "results_path": self.results_path
+        }
+
+    async def _process(self, image_path: str, limiter: RateLimiter, esp32) -> Dict[str, Any]:
+        """Run one image through every stage, timing each one"""
+        started = time.perf_counter()
+        timings = {}
+
+        # Cache hits cost no Gemini request, so they do not wait for a rate limit token
+        stage = time.perf_counter()
+        classification = await asyncio.to_thread(self.workflow.cached_classification, image_path)
+        if classification is None:
+            await limiter.acquire()
+            timings["rate_limit_wait_ms"] = round((time.perf_counter() - stage) * 1000, 1)
+
+            stage = time.perf_counter()
+            # The Gemini SDK is blocking; keep it off the event loop
+            classification = await asyncio.to_thread(self.workflow.classify_plant, image_path, False)
+        timings["classify_ms"] = round((time.perf_counter() - stage) * 1000, 1)
+
+        status = classification["status"]
+        record = {
+            "image_path": image_path,
+            "status": status,
+            "confidence": classification.get("confidence"),
+            "error": classification.get("error"),
+            "cached": classification.get("cached", False),
+            "payload": classification.get("payload"),
+            "spray": None
+        }
+        # Break classify_ms down into decode / encode / upload / generate (or the cache lookup)
+        timings.update(classification.get("timings") or {})
+
+        if status == "infected" and self.spray:
+            stage = time.perf_counter()
+            report = await esp32.spray_all(self.spray_duration, zone_id=self.zone_id)
+            timings["spray_ms"] = round((time.perf_counter() - stage) * 1000, 1)
+            sprayed = report["succeeded"] == report["total"]
+            self.counts["sprayed" if sprayed else "spray_failed"] += 1
+            record["spray"] = {
+                "success": sprayed,
+                "succeeded": report["succeeded"],
+                "total": report["total"],
+                "errors": {d: r["error"] for d, r in report["results"].items() if not r["success"]}
+            }
+
+        timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        record["timings"] = timings
+        record["timestamp"] = time.time()
+        return record